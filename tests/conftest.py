@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 19:52:10 by codeskyblue
+
+Fake device shared by the afc, archive and sync tests
+"""
+
+import contextlib
+import datetime
+import os
+import pathlib
+import stat
+import threading
+from typing import Callable, Dict, List, Type
+
+import pytest
+from pymobiledevice3.exceptions import AfcException, AfcFileNotFoundError
+
+
+class FakeAfc:
+    """ AfcService backed by a local directory """
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+        self.files: Dict[int, object] = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.stat_count = 0
+
+    def _path(self, path: str) -> pathlib.Path:
+        return self.root / path.lstrip("/")
+
+    @contextlib.contextmanager
+    def _busy(self):
+        assert self.lock.acquire(blocking=False), "session used by two threads"
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def listdir(self, path: str) -> List[str]:
+        with self._busy():
+            try:
+                return sorted(os.listdir(self._path(path)))
+            except FileNotFoundError as e:
+                raise AfcFileNotFoundError(str(e), 8)
+
+    def stat(self, path: str) -> dict:
+        self.stat_count += 1
+        with self._busy():
+            try:
+                st = self._path(path).lstat()
+            except FileNotFoundError as e:
+                raise AfcFileNotFoundError(str(e), 8)
+            if self._path(path).name.startswith("unreadable"):
+                raise AfcException("permission denied", 10)
+            ifmt = "S_IFDIR" if stat.S_ISDIR(st.st_mode) else "S_IFLNK" if stat.S_ISLNK(st.st_mode) else "S_IFREG"
+            return {"st_size": st.st_size, "st_ifmt": ifmt, "st_mtime": datetime.datetime.fromtimestamp(st.st_mtime)}
+
+    def fopen(self, path: str, mode: str = "r") -> int:
+        f = self._path(path).open({"r": "rb", "w": "wb"}[mode])
+        handle = len(self.files) + 1
+        self.files[handle] = f
+        return handle
+
+    def fread(self, handle: int, size: int) -> bytes:
+        with self._busy():
+            return self.files[handle].read(size)
+
+    def fwrite(self, handle: int, data: bytes):
+        with self._busy():
+            self.files[handle].write(data)
+
+    def fclose(self, handle: int):
+        self.files.pop(handle).close()
+
+    def makedirs(self, path: str):
+        self._path(path).mkdir(parents=True, exist_ok=True)
+
+    def rm(self, path: str):
+        p = self._path(path)
+        p.rmdir() if p.is_dir() else p.unlink()
+
+    def close(self):
+        self.closed = True
+
+
+def build_tree(root: pathlib.Path):
+    (root / "DCIM/100APPLE").mkdir(parents=True)
+    for i in range(50):
+        (root / f"DCIM/100APPLE/IMG_{i:04d}.JPG").write_bytes(os.urandom(i * 100))
+    (root / "Documents").mkdir()
+    (root / "Documents/a.txt").write_text("hello")
+    (root / "Documents/empty").mkdir()
+
+
+@pytest.fixture
+def fake_afc() -> Type[FakeAfc]:
+    """ fake_afc(root) opens a session on a local directory acting as the device """
+    return FakeAfc
+
+
+@pytest.fixture
+def make_tree() -> Callable[[pathlib.Path], None]:
+    """ make_tree(root) creates 50 photos in DCIM and a few documents under root """
+    return build_tree
+
+
+@pytest.fixture
+def device_root(tmp_path: pathlib.Path) -> pathlib.Path:
+    root = tmp_path / "device"
+    build_tree(root)
+    return root
@@ -1,9 +1,19 @@
+import hashlib
+import os
+import plistlib
 import sys
+import zipfile
 from pathlib import Path
 
 import pytest
+import requests
+from pymobiledevice3.exceptions import AppInstallError
+from pytest_httpserver import HTTPServer
 
+from tidevice3 import api
 from tidevice3.api import connect_service_provider, list_devices, screenshot
+from tidevice3.exceptions import DownloadError
+from tidevice3.utils.cache import DownloadCache
 
 
 @pytest.mark.skipif(sys.platform != "darwin", reason="only run on mac")
@@ -14,3 +24,254 @@ def test_api(tmp_path: Path):
         with service_provider:
             pil_im = screenshot(service_provider)
             pil_im.save(tmp_path / "screenshot.png")
+
+
+def test_app_install_all(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, httpserver: HTTPServer):
+    ipa_path = tmp_path / "app.ipa"
+    ipa_path.write_bytes(b"fake")
+    installed = []
+
+    class FakeServiceProvider:
+        def __init__(self, udid: str):
+            self.udid = udid
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    class FakeInstallationProxyService:
+        def __init__(self, lockdown: FakeServiceProvider):
+            self.udid = lockdown.udid
+
+        def install_from_local(self, package_path: Path, handler=None):
+            if self.udid == "bad":
+                raise RuntimeError("install failed")
+            assert package_path.suffix == ".ipa"  # pymobiledevice3 expects a Path
+            handler(100)
+            installed.append((self.udid, package_path))
+
+    monkeypatch.setattr(api, "connect_service_provider", lambda udid, **kwargs: FakeServiceProvider(udid))
+    monkeypatch.setattr(api, "InstallationProxyService", FakeInstallationProxyService)
+    progresses = []
+    results = api.app_install_all(str(ipa_path), ["a", "bad", "b"], max_workers=2,
+                                  progress=lambda udid, completion: progresses.append((udid, completion)))
+    assert [r.Identifier for r in results] == ["a", "bad", "b"]
+    assert [r.Success for r in results] == [True, False, True]
+    assert results[1].Error == "install failed"
+    assert sorted(installed) == [("a", ipa_path), ("b", ipa_path)]
+    assert sorted(progresses) == [("a", 100), ("b", 100)]
+
+    # url is downloaded once into cache, devices install the cached file
+    installed.clear()
+    httpserver.expect_request("/app.ipa").respond_with_data(b"fake")
+    results = api.app_install_all(httpserver.url_for("/app.ipa"), ["a", "b"], cache=DownloadCache(tmp_path / "cache"),
+                                  progress=lambda udid, completion: None)
+    assert [r.Success for r in results] == [True, True]
+    assert installed[0][1] == installed[1][1]
+    assert installed[0][1].read_bytes() == b"fake"
+
+
+def test_app_install_stream(httpserver: HTTPServer, monkeypatch: pytest.MonkeyPatch):
+    remote_files = {}
+    commands = []
+
+    class FakeAfcService:
+        def __init__(self, lockdown):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def makedirs(self, path):
+            pass
+
+        def fopen(self, path, mode):
+            remote_files[path] = b""
+            return path
+
+        def fwrite(self, handle, data):
+            remote_files[handle] += data
+
+        def fclose(self, handle):
+            pass
+
+        def rm(self, path, force=False):
+            remote_files.pop(path, None) if force else remote_files.pop(path)
+
+    responses = []
+    staged = []
+
+    class FakeService:
+        def send_plist(self, cmd):
+            commands.append(cmd)
+            staged.append(dict(remote_files))
+
+        def recv_plist(self):
+            return responses.pop(0) if responses else None
+
+    class FakeInstallationProxyService:
+        def __init__(self, lockdown):
+            self.service = FakeService()
+
+    monkeypatch.setattr(api, "AfcService", FakeAfcService)
+    monkeypatch.setattr(api, "InstallationProxyService", FakeInstallationProxyService)
+    content = b"ipa-content" * 100
+    httpserver.expect_request("/app.ipa").respond_with_data(
+        content, headers={"X-Checksum-Sha256": hashlib.sha256(content).hexdigest()})
+    httpserver.expect_request("/bad.ipa").respond_with_data(
+        content, headers={"X-Checksum-Sha256": hashlib.sha256(b"other").hexdigest()})
+
+    progresses = []
+    responses.extend([{"PercentComplete": 50}, {"PercentComplete": 100, "Status": "Complete"}])
+    api.app_install(None, httpserver.url_for("/app.ipa"), stream=True, progress=progresses.append)
+    package_path = commands[0]["PackagePath"]
+    assert package_path.startswith(api.STREAM_REMOTE_IPA_DIR + "/tidevice3-")
+    assert staged[0] == {package_path: content}
+    assert progresses == [50, 100]
+    # staged ipa is removed after install
+    assert remote_files == {}
+
+    # staged ipa is removed when install failed, a new name is used for every install
+    responses.extend([{"Error": "APIInternalError", "ErrorDescription": "bad ipa"}])
+    with pytest.raises(AppInstallError):
+        api.app_install_stream(None, httpserver.url_for("/app.ipa"))
+    assert commands[1]["PackagePath"] != package_path
+    assert remote_files == {}
+
+    with pytest.raises(ValueError):
+        api.app_install(None, "local.ipa", stream=True)
+
+    commands.clear()
+    closed = []
+    close = requests.Response.close
+    monkeypatch.setattr(requests.Response, "close", lambda r: closed.append(r.url) or close(r))
+    with pytest.raises(DownloadError):
+        api.app_install_stream(None, httpserver.url_for("/bad.ipa"), chunk_size=64)
+    assert remote_files == {}
+    assert commands == []
+    assert closed == [httpserver.url_for("/bad.ipa")]
+
+
+def test_app_install_skip_same(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    ipa_path = tmp_path / "local/demo.ipa"
+    ipa_path.parent.mkdir()
+    with zipfile.ZipFile(ipa_path, "w") as zf:
+        zf.writestr("Payload/Demo.app/Info.plist", plistlib.dumps({
+            "CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "2", "CFBundleShortVersionString": "1.0"}))
+    device_apps = {}
+    installed = []
+
+    class FakeServiceProvider:
+        udid = "fake-udid"
+
+    class FakeInstallationProxyService:
+        def __init__(self, lockdown):
+            pass
+
+        def get_apps(self, bundle_identifiers):
+            return {k: v for k, v in device_apps.items() if k in bundle_identifiers}
+
+        def install_from_local(self, package_path, handler=None):
+            installed.append(package_path)
+
+    monkeypatch.setattr(api, "InstallationProxyService", FakeInstallationProxyService)
+    cache = DownloadCache(tmp_path / "cache")
+    assert api.app_install(FakeServiceProvider(), str(ipa_path), cache=cache, skip_same=True)
+    record = cache.installed_record("fake-udid", "com.example.demo")
+    assert record.sha256 == hashlib.sha256(ipa_path.read_bytes()).hexdigest()
+    assert (record.version, record.short_version) == ("2", "1.0")
+    # nothing is written next to the local ipa of the user
+    assert os.listdir(tmp_path / "local") == ["demo.ipa"]
+
+    # same versions and same ipa as installed last time
+    device_apps["com.example.demo"] = {"CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "2",
+                                       "CFBundleShortVersionString": "1.0"}
+    assert not api.app_install(FakeServiceProvider(), str(ipa_path), cache=cache, skip_same=True)
+    # another build was installed over it outside t3, the recorded hash is stale
+    device_apps["com.example.demo"]["CFBundleVersion"] = "3"
+    assert api.app_install(FakeServiceProvider(), str(ipa_path), cache=cache, skip_same=True)
+    assert len(installed) == 2
+    # app removed from device
+    device_apps.clear()
+    assert api.app_install(FakeServiceProvider(), str(ipa_path), cache=cache, skip_same=True)
+    assert len(installed) == 3
+
+    # same versions, but another ipa was installed last time
+    device_apps["com.example.demo"] = {"CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "2",
+                                       "CFBundleShortVersionString": "1.0"}
+    cache.record_install("fake-udid", "com.example.demo", "0" * 64, "2", "1.0")
+    assert api.app_install(FakeServiceProvider(), str(ipa_path), cache=cache, skip_same=True)
+    assert len(installed) == 4
+    # no record, versions are compared
+    other_cache = DownloadCache(tmp_path / "other")
+    assert not api.app_install(FakeServiceProvider(), str(ipa_path), cache=other_cache, skip_same=True)
+
+
+def test_screenshot_session(monkeypatch: pytest.MonkeyPatch):
+    connects = []
+
+    class FakeScreenshotService:
+        def __init__(self, lockdown):
+            connects.append(lockdown)
+            self.count = 0
+            self.closed = False
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.closed = True
+
+        def take_screenshot(self) -> bytes:
+            self.count += 1
+            if len(connects) == 1 and self.count == 3:
+                raise ConnectionResetError("device gone")
+            return b"png%d" % self.count
+
+    class FakeServiceProvider:
+        product_version = "16.4"
+
+    monkeypatch.setattr(api, "ScreenshotService", FakeScreenshotService)
+    service_provider = FakeServiceProvider()
+    with api.ScreenshotSession(service_provider) as session:
+        assert api.screenshot_png(service_provider, session=session) == b"png1"
+        assert session.screenshot_png() == b"png2"
+        assert len(connects) == 1
+        # reconnect on failure
+        assert session.screenshot_png() == b"png1"
+        assert len(connects) == 2
+    assert session._stack is None
+
+    assert api.screenshot_png(service_provider) == b"png1"
+    assert len(connects) == 3
+
+
+def test_screenshot_formats(monkeypatch: pytest.MonkeyPatch):
+    import io
+
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGBA", (300, 600), (255, 0, 0, 255)).save(buf, format="PNG")
+    png_data = buf.getvalue()
+    monkeypatch.setattr(api, "screenshot_png", lambda service_provider, session=None: png_data)
+
+    assert api.screenshot_bytes(None) == png_data
+    img = api.decode_screenshot(png_data, (100, 100))
+    assert img.mode == "RGB" and img.size == (50, 100)
+    assert api.screenshot_bytes(None, "raw", size=(100, 100)) == b"\xff\x00\x00" * 50 * 100
+    jpeg_data = api.screenshot_bytes(None, "jpeg", size=(100, 100), quality=50)
+    assert Image.open(io.BytesIO(jpeg_data)).format == "JPEG"
+    assert Image.open(io.BytesIO(api.screenshot_bytes(None, "WEBP"))).size == (300, 600)
+    with pytest.raises(ValueError):
+        api.screenshot_bytes(None, "gif")
+
+    array = api.screenshot_array(None, size=(150, 150))
+    assert array.shape == (150, 75, 3)
+    assert array.dtype == "uint8"
+    assert tuple(array[0, 0]) == (255, 0, 0)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 20:31:52 by codeskyblue
+"""
+
+import datetime
+import io
+import os
+import pathlib
+import threading
+import time
+from typing import Callable
+
+import pytest
+from pymobiledevice3.exceptions import AfcException
+
+from tidevice3.utils.afc import AfcPool, FindFilter, disk_usage, find, pull_file, pull_tree, push_file, push_tree, \
+    walk_tree
+
+
+def test_afc_pool(device_root: pathlib.Path, fake_afc: Callable):
+    sessions = []
+
+    def factory():
+        sessions.append(fake_afc(device_root))
+        return sessions[-1]
+
+    with AfcPool(factory, 2) as pool:
+        with pool.session() as a, pool.session() as b:
+            assert a is not b
+        with pytest.raises(ConnectionError):
+            with pool.session():
+                raise ConnectionError()
+        assert sum(s.closed for s in sessions) == 1
+
+    # a thread waiting for the only session gets a new one when it is discarded
+    with AfcPool(factory, 1) as pool:
+        acquired = threading.Event()
+
+        def waiter():
+            with pool.session():
+                acquired.set()
+        with pytest.raises(ConnectionError):
+            with pool.session():
+                thread = threading.Thread(target=waiter)
+                thread.start()
+                time.sleep(.1)
+                raise ConnectionError()
+        assert acquired.wait(5)
+        thread.join()
+    assert all(s.closed for s in sessions)
+
+
+def test_walk_tree(device_root: pathlib.Path, fake_afc: Callable):
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        entries = dict(walk_tree(pool, "/"))
+    assert len(entries) == 55
+    assert entries["/DCIM/100APPLE"].is_dir()
+    assert entries["/DCIM/100APPLE/IMG_0010.JPG"].size == 1000
+    assert entries["/Documents/a.txt"].name == "a.txt"
+
+
+def test_pull_tree(device_root: pathlib.Path, tmp_path: pathlib.Path, fake_afc: Callable):
+    (device_root / "Documents/unreadable.txt").write_text("secret")
+    local_dir = tmp_path / "local"
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        stats = pull_tree(pool, "/", local_dir, 4, chunk_size=256)
+    assert stats.files == 51
+    assert stats.bytes == sum(i * 100 for i in range(50)) + 5
+    assert [path for path, _ in stats.errors] == ["/Documents/unreadable.txt"]
+    for i in range(50):
+        name = f"DCIM/100APPLE/IMG_{i:04d}.JPG"
+        assert (local_dir / name).read_bytes() == (device_root / name).read_bytes()
+    assert (local_dir / "Documents/empty").is_dir()
+    assert int((local_dir / "Documents/a.txt").stat().st_mtime) == int((device_root / "Documents/a.txt").stat().st_mtime)
+
+
+def test_push_pull_file(tmp_path: pathlib.Path, fake_afc: Callable):
+    device_root = tmp_path / "device"
+    device_root.mkdir()
+    afc = fake_afc(device_root)
+    content = os.urandom(10000)
+    assert push_file(afc, io.BytesIO(content), "/big.bin", chunk_size=1024) == len(content)
+    assert (device_root / "big.bin").read_bytes() == content
+    assert pull_file(afc, "/big.bin", tmp_path / "local/big.bin", chunk_size=1000) == len(content)
+    assert (tmp_path / "local/big.bin").read_bytes() == content
+
+    # connection lost in the middle, the old local file is kept and nothing partial is left
+    def broken_fread(handle: int, size: int) -> bytes:
+        raise AfcException("connection lost", 1)
+    (device_root / "big.bin").write_bytes(os.urandom(10000))
+    afc.fread = broken_fread
+    with pytest.raises(AfcException):
+        pull_file(afc, "/big.bin", tmp_path / "local/big.bin", chunk_size=1000)
+    assert (tmp_path / "local/big.bin").read_bytes() == content
+    assert os.listdir(tmp_path / "local") == ["big.bin"]
+
+
+def test_walk_tree_max_depth(device_root: pathlib.Path, fake_afc: Callable):
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        assert sorted(path for path, _ in walk_tree(pool, "/", max_depth=1)) == ["/DCIM", "/Documents"]
+        paths = sorted(path for path, _ in walk_tree(pool, "/Documents/", max_depth=2))
+    assert paths == ["/Documents/a.txt", "/Documents/empty"]
+
+
+def test_disk_usage(device_root: pathlib.Path, fake_afc: Callable):
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        totals = disk_usage(pool, "/", max_depth=1)
+        assert totals == {"/": sum(i * 100 for i in range(50)) + 5,
+                          "/DCIM": sum(i * 100 for i in range(50)), "/Documents": 5}
+        totals = disk_usage(pool, "/DCIM/", max_depth=0)
+        assert totals == {"/DCIM": sum(i * 100 for i in range(50))}
+
+
+def test_find(device_root: pathlib.Path, fake_afc: Callable):
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        found = sorted(path for path, _ in find(pool, "/", FindFilter(name="IMG_004*.JPG", min_size=4500)))
+        assert found == ["/DCIM/100APPLE/IMG_0045.JPG", "/DCIM/100APPLE/IMG_0046.JPG",
+                         "/DCIM/100APPLE/IMG_0047.JPG", "/DCIM/100APPLE/IMG_0048.JPG", "/DCIM/100APPLE/IMG_0049.JPG"]
+        found = sorted(path for path, _ in find(pool, "/", FindFilter(ifmt="S_IFDIR")))
+        assert found == ["/DCIM", "/DCIM/100APPLE", "/Documents", "/Documents/empty"]
+        newer = datetime.datetime.now() - datetime.timedelta(hours=1)
+        found = sorted(path for path, _ in find(pool, "/", FindFilter(ifmt="S_IFREG", newer=newer, exclude=["DCIM"])))
+        assert found == ["/Documents/a.txt"]
+        assert list(find(pool, "/", FindFilter(older=newer))) == []
+
+
+def test_push_tree(device_root: pathlib.Path, tmp_path: pathlib.Path, fake_afc: Callable):
+    target_root = tmp_path / "target"
+    target_root.mkdir()
+    with AfcPool(lambda: fake_afc(target_root), 4) as pool:
+        stats = push_tree(pool, device_root, "/fixtures", 4, chunk_size=256)
+    assert stats.files == 51 and not stats.errors
+    assert stats.bytes == sum(i * 100 for i in range(50)) + 5
+    assert (target_root / "fixtures/Documents/empty").is_dir()
+    for path in device_root.rglob("*"):
+        if path.is_file():
+            assert (target_root / "fixtures" / path.relative_to(device_root)).read_bytes() == path.read_bytes()
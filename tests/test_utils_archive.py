@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 22:58:40 by codeskyblue
+"""
+
+import io
+import pathlib
+import tarfile
+from typing import Callable
+
+from tidevice3.utils.afc import AfcPool
+from tidevice3.utils.archive import archive_tree, restore_tree
+
+
+def test_archive_restore(device_root: pathlib.Path, fake_afc: Callable):
+    buf = io.BytesIO()
+    with AfcPool(lambda: fake_afc(device_root), 4) as pool:
+        stats = archive_tree(pool, "/", buf, chunk_size=256)
+    assert stats.files == 51 and not stats.errors
+
+    buf.seek(0)
+    with tarfile.open(fileobj=buf) as tar:
+        assert tar.extractfile("Documents/a.txt").read() == b"hello"
+        assert tar.getmember("Documents/empty").isdir()
+
+    # restore into another directory, unsafe members are skipped
+    buf.seek(0)
+    with tarfile.open(fileobj=buf, mode="a") as tar:
+        tarinfo = tarfile.TarInfo("../escape.txt")
+        tarinfo.size = 3
+        tar.addfile(tarinfo, io.BytesIO(b"bad"))
+    buf.seek(0)
+    stats = restore_tree(fake_afc(device_root), buf, "/restored", chunk_size=256)
+    assert stats.files == 51
+    assert not (device_root / "escape.txt").exists()
+    for path in (device_root / "DCIM").rglob("*"):
+        restored = device_root / "restored" / path.relative_to(device_root)
+        assert restored.is_dir() if path.is_dir() else restored.read_bytes() == path.read_bytes()
+    assert (device_root / "restored/Documents/empty").is_dir()
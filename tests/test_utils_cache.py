@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 11:20:06 by codeskyblue
+"""
+
+import base64
+import hashlib
+import io
+import pathlib
+import plistlib
+import zipfile
+
+from pytest_httpserver import HTTPServer
+from werkzeug import Request, Response
+
+from tidevice3.utils.cache import DownloadCache
+from tidevice3.utils.download import download_file
+
+
+def md5_base64(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+def test_download_cache(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache")
+    headers = {"Content-Md5": md5_base64(b"hello"), "ETag": '"v1"'}
+    httpserver.expect_request("/a/app.ipa").respond_with_data("hello", headers=headers)
+    httpserver.expect_request("/b/other.ipa").respond_with_data("hello", headers=headers)
+
+    path = download_file(httpserver.url_for("/a/app.ipa"), cache=cache)
+    assert path.read_bytes() == b"hello"
+    assert path.name == "app.ipa"
+    assert path.parent.name == hashlib.sha256(b"hello").hexdigest()
+
+    # same url, and same content from another url, both hit the cache
+    assert download_file(httpserver.url_for("/a/app.ipa"), cache=cache) == path
+    assert download_file(httpserver.url_for("/b/other.ipa"), cache=cache) == path
+    assert len(cache.entries()) == 1
+    assert sorted(cache.urls(cache.entries()[0].sha256)) == [
+        httpserver.url_for("/a/app.ipa"), httpserver.url_for("/b/other.ipa")]
+    assert not any(cache.tmp_dir.iterdir())
+
+
+def test_download_cache_etag_changed(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache")
+    httpserver.expect_oneshot_request("/app.ipa").respond_with_data("12345", headers={"ETag": '"v1"'})
+    httpserver.expect_oneshot_request("/app.ipa").respond_with_data("67890", headers={"ETag": '"v2"'})
+    url = httpserver.url_for("/app.ipa")
+    assert download_file(url, cache=cache).read_bytes() == b"12345"
+    assert download_file(url, cache=cache).read_bytes() == b"67890"
+    assert len(cache.entries()) == 2
+
+
+def test_download_cache_prune(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache", max_bytes=10)
+    for name in ["a", "b", "c"]:
+        httpserver.expect_request(f"/{name}.ipa").respond_with_data(name * 4)
+    path_a = download_file(httpserver.url_for("/a.ipa"), cache=cache)
+    path_b = download_file(httpserver.url_for("/b.ipa"), cache=cache)
+    # a is used again, so b is the least recently used one
+    assert download_file(httpserver.url_for("/a.ipa"), cache=cache) == path_a
+    path_c = download_file(httpserver.url_for("/c.ipa"), cache=cache)
+    assert cache.total_bytes() == 12  # recently used files are never evicted automatically
+
+    removed = cache.prune(grace_seconds=0)
+    assert [entry.path for entry in removed] == [path_b]
+    assert not path_b.exists()
+    assert path_a.exists() and path_c.exists()
+    assert cache.lookup(httpserver.url_for("/b.ipa")) is None
+    assert cache.total_bytes() == 8
+
+
+def test_download_cache_revalidate(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache")
+    methods = []
+
+    def handler(request: Request) -> Response:
+        methods.append((request.method, request.headers.get("If-None-Match")))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return Response(status=304)
+        return Response("hello", headers={"ETag": '"v1"'})
+
+    httpserver.expect_request("/app.ipa").respond_with_handler(handler)
+    url = httpserver.url_for("/app.ipa")
+    path = download_file(url, cache=cache)
+    assert download_file(url, cache=cache) == path
+    assert methods == [("GET", None), ("GET", '"v1"')]
+
+    # conditional request also works without cache, with etag stored in the digest file
+    methods.clear()
+    filepath = tmp_path / "app.ipa"
+    download_file(url, filepath)
+    download_file(url, filepath, segments=4)
+    assert methods == [("GET", None), ("HEAD", '"v1"')]
+    assert filepath.read_text() == "hello"
+
+
+def test_download_cache_last_modified_changed(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache")
+    published = {"body": "build-1", "last_modified": "Sat, 17 Oct 2026 10:00:00 GMT"}
+
+    def handler(request: Request) -> Response:
+        if request.headers.get("If-Modified-Since") == published["last_modified"]:
+            return Response(status=304)
+        return Response(published["body"], headers={"Last-Modified": published["last_modified"]})
+
+    httpserver.expect_request("/app.ipa").respond_with_handler(handler)
+    url = httpserver.url_for("/app.ipa")
+    assert download_file(url, cache=cache).read_text() == "build-1"
+    assert download_file(url, cache=cache).read_text() == "build-1"
+
+    # new build of the same size published at the same url, only Last-Modified tells it apart
+    published.update(body="build-2", last_modified="Sat, 17 Oct 2026 11:00:00 GMT")
+    assert download_file(url, cache=cache).read_text() == "build-2"
+    filepath = tmp_path / "app.ipa"
+    download_file(url, filepath)
+    published.update(body="build-3", last_modified="Sat, 17 Oct 2026 12:00:00 GMT")
+    download_file(url, filepath)
+    assert filepath.read_text() == "build-3"
+
+
+def test_download_cache_find(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    cache = DownloadCache(tmp_path / "cache")
+    for version in ["1.0", "2.0"]:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("Payload/Demo.app/Info.plist", plistlib.dumps({
+                "CFBundleIdentifier": "com.example.demo", "CFBundleVersion": version.replace(".", ""),
+                "CFBundleShortVersionString": version}))
+        httpserver.expect_request(f"/{version}/demo.ipa").respond_with_data(buf.getvalue())
+        download_file(httpserver.url_for(f"/{version}/demo.ipa"), cache=cache)
+    httpserver.expect_request("/readme.txt").respond_with_data("hello")
+    download_file(httpserver.url_for("/readme.txt"), cache=cache)
+
+    entries = cache.find("com.example.demo")
+    assert [e.short_version for e in entries] == ["2.0", "1.0"]
+    entries = cache.find("com.example.demo", "1.0")
+    assert len(entries) == 1 and entries[0].version == "10"
+    assert cache.ipa_info(entries[0].sha256).CFBundleShortVersionString == "1.0"
+    assert cache.find("com.example.demo", "20")[0].short_version == "2.0"
+    assert cache.find("com.example.other") == []
+
+    # files cached before bundle indexing are indexed on query
+    with cache._connect() as conn:
+        conn.execute("DELETE FROM bundles")
+    assert len(cache.find("com.example.demo")) == 2
+
+
+def test_download_cache_migrate_installs(tmp_path: pathlib.Path):
+    import sqlite3
+
+    root = tmp_path / "cache"
+    root.mkdir()
+    with sqlite3.connect(root / "index.db") as conn:
+        conn.execute("CREATE TABLE installs (udid TEXT NOT NULL, bundle_id TEXT NOT NULL, sha256 TEXT NOT NULL, "
+                     "installed_at REAL NOT NULL, PRIMARY KEY (udid, bundle_id))")
+        conn.execute("INSERT INTO installs VALUES ('u', 'com.example.demo', 'abc', 0)")
+    cache = DownloadCache(root)
+    record = cache.installed_record("u", "com.example.demo")
+    assert record.sha256 == "abc"
+    assert record.version is None
+    cache.record_install("u", "com.example.demo", "def", "2", "1.0")
+    assert cache.installed_record("u", "com.example.demo").version == "2"
+    assert cache.installed_record("u", "other") is None
@@ -1,8 +1,9 @@
 import threading
+import time
 
 import pytest
 
-from tidevice3.utils.common import print_dict_as_table, threadsafe_function
+from tidevice3.utils.common import FileLock, byte2humansize, humansize2byte, print_dict_as_table, threadsafe_function
 
 
 def test_threadsafe_function():
@@ -54,3 +55,32 @@ def test_print_dict_as_table(capsys: pytest.CaptureFixture[str]):
     captured = capsys.readouterr()
     assert captured.out == "a-bb\n"
 
+
+
+def test_file_lock(tmp_path):
+    lockfile = tmp_path / "test.lock"
+    shared_variable = []
+
+    def worker(index: int):
+        with FileLock(lockfile):
+            shared_variable.append(index)
+            time.sleep(0.01)
+            shared_variable.append(index)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every worker holds the lock exclusively
+    assert [shared_variable[i] for i in range(0, 10, 2)] == [shared_variable[i] for i in range(1, 10, 2)]
+
+
+def test_humansize2byte():
+    assert humansize2byte("512") == 512
+    assert humansize2byte("10K") == 10240
+    assert humansize2byte("1.5m") == 1572864
+    assert humansize2byte("2GB") == 2 << 30
+    assert humansize2byte(byte2humansize(3 << 20)) == 3 << 20
+    with pytest.raises(ValueError):
+        humansize2byte("ten")
@@ -9,10 +9,15 @@ import hashlib
 import pathlib
 
 import pytest
+import requests
 from pytest_httpserver import HTTPServer
+from requests.structures import CaseInsensitiveDict
+from werkzeug import Request, Response
 
 from tidevice3.exceptions import DownloadError
-from tidevice3.utils.download import CACHE_DOWNLOAD_SUFFIX, download_file, guess_filename_from_url
+from tidevice3.utils import download
+from tidevice3.utils.download import CACHE_DOWNLOAD_SUFFIX, digest_path, download_file, get_remote_file_info, \
+    guess_filename_from_url, load_digests, save_digests, split_ranges
 
 
 def test_download_file(httpserver: HTTPServer, tmp_path: pathlib.Path):
@@ -78,4 +83,153 @@ def test_download_with_md5(httpserver: HTTPServer, tmp_path: pathlib.Path):
 
 def test_download_guess_filename():
     assert guess_filename_from_url("http://example.com/b/test.txt?foo=1") == "test.txt"
-    
\ No newline at end of file
+    
+
+def make_range_handler(content: bytes, fail_once_at: int = -1):
+    """ serve content with range support, the range starting at fail_once_at breaks once """
+    failed = []
+
+    def handler(request: Request) -> Response:
+        headers = {"Accept-Ranges": "bytes"}
+        range_header = request.headers.get("Range")
+        if not range_header:
+            return Response(content, headers=headers)
+        start, end = range_header.split("=")[1].split("-")
+        start = int(start)
+        end = int(end) if end else len(content) - 1
+        data = content[start:end+1]
+        if start == fail_once_at and not failed:
+            failed.append(start)
+            return Response(data[:1], status=206, headers=headers)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return Response(data, status=206, headers=headers)
+    return handler
+
+
+def test_split_ranges():
+    assert split_ranges(10, 3, 2) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(10, 20, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(10, 1, 4) == [(0, 9)]
+
+
+def test_download_file_segmented(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    content = bytes(range(256)) * 10
+    httpserver.expect_request("/segmented").respond_with_handler(make_range_handler(content, fail_once_at=768))
+    filepath = tmp_path / "segmented.bin"
+    download_file(httpserver.url_for("/segmented"), filepath, segments=4, chunk_size=256)
+    assert filepath.read_bytes() == content
+    assert not pathlib.Path(str(filepath) + CACHE_DOWNLOAD_SUFFIX).exists()
+
+
+def test_probe_remote_file_head_rejected(httpserver: HTTPServer, monkeypatch: pytest.MonkeyPatch):
+    closed = []
+    close = requests.Response.close
+
+    def record_close(self):
+        closed.append(self.request.method)
+        close(self)
+    monkeypatch.setattr(requests.Response, "close", record_close)
+    # presigned url, HEAD is not allowed
+    httpserver.expect_request("/presigned", method="HEAD").respond_with_data("", status=403)
+    httpserver.expect_request("/presigned", method="GET").respond_with_data("hello")
+    r = download.probe_remote_file(httpserver.url_for("/presigned"), 10, use_head=True)
+    assert r.request.method == "GET"
+    # the HEAD connection is given back to the pool
+    assert closed == ["HEAD"]
+    r.close()
+
+
+def test_download_segment_range_ignored(httpserver: HTTPServer, tmp_path: pathlib.Path,
+                                       monkeypatch: pytest.MonkeyPatch):
+    closed = []
+    close = requests.Response.close
+    monkeypatch.setattr(requests.Response, "close", lambda r: closed.append(r.status_code) or close(r))
+    httpserver.expect_request("/norange").respond_with_data("hello world")
+    filepath = tmp_path / "norange.bin"
+    filepath.write_bytes(bytes(11))
+    with pytest.raises(DownloadError):
+        download.download_segment(httpserver.url_for("/norange"), filepath, 0, 4, 4, 10, retries=1)
+    # every failed attempt gives its connection back
+    assert closed == [200, 200]
+
+
+def test_get_remote_file_info():
+    sha256_hex = hashlib.sha256(b"hello").hexdigest()
+    md5_hex = hashlib.md5(b"hello").hexdigest()
+    info = get_remote_file_info(CaseInsensitiveDict(
+        {"Digest": "sha-256=" + base64.b64encode(bytes.fromhex(sha256_hex)).decode()}))
+    assert info.content_sha256 == sha256_hex
+    assert info.content_md5 is None
+    info = get_remote_file_info(CaseInsensitiveDict({"X-Checksum-Sha256": sha256_hex, "X-Checksum-Md5": md5_hex}))
+    assert info.content_sha256 == sha256_hex
+    assert info.content_md5 == md5_hex
+
+
+def test_download_verify_digest(httpserver: HTTPServer, tmp_path: pathlib.Path):
+    filepath = tmp_path / "digest.txt"
+    url = httpserver.url_for("/digest")
+    httpserver.expect_request("/digest").respond_with_data(
+        "hello", headers={"X-Checksum-Sha256": hashlib.sha256(b"hello").hexdigest()})
+    download_file(url, filepath)
+    assert load_digests(filepath) == {
+        "md5": hashlib.md5(b"hello").hexdigest(),
+        "sha256": hashlib.sha256(b"hello").hexdigest(),
+    }
+    assert not digest_path(str(filepath) + CACHE_DOWNLOAD_SUFFIX).exists()
+
+    # stored digest is trusted while the file is unchanged, a wrong one makes the file downloaded again
+    save_digests(filepath, {"md5": "0" * 32, "sha256": "0" * 64})
+    httpserver.clear()
+    httpserver.expect_oneshot_request("/digest").respond_with_data(
+        "hello", headers={"X-Checksum-Sha256": hashlib.sha256(b"hello").hexdigest()})
+    httpserver.expect_oneshot_request("/digest").respond_with_data(
+        "hello", headers={"X-Checksum-Sha256": hashlib.sha256(b"hello").hexdigest()})
+    download_file(url, filepath)
+    assert load_digests(filepath)["sha256"] == hashlib.sha256(b"hello").hexdigest()
+
+    httpserver.expect_request("/digest-bad").respond_with_data(
+        "hello", headers={"X-Checksum-Sha256": hashlib.sha256(b"world").hexdigest()})
+    with pytest.raises(DownloadError):
+        download_file(httpserver.url_for("/digest-bad"), tmp_path / "bad.txt")
+    assert not (tmp_path / "bad.txt").exists()
+    assert sorted(tmp_path.iterdir()) == [filepath, digest_path(filepath)]
+
+
+def test_download_progress(httpserver: HTTPServer, tmp_path: pathlib.Path, caplog: pytest.LogCaptureFixture):
+    content = bytes(range(256)) * 10
+    httpserver.expect_request("/progress").respond_with_handler(make_range_handler(content))
+    filepath = tmp_path / "progress.bin"
+    events = []
+    with caplog.at_level("INFO", logger="tidevice3.utils.download"):
+        download_file(httpserver.url_for("/progress"), filepath, segments=4, chunk_size=256, progress=events.append)
+    assert events[0].phase == "transfer"
+    assert events[0].total_bytes == len(content)
+    summary = events[-1]
+    assert summary.phase == "done" and summary.status == "downloaded"
+    assert summary.bytes_done == len(content)
+    assert summary.connect_time is not None and summary.ttfb is not None
+    records = [r for r in caplog.records if hasattr(r, "t3_download")]
+    assert records[-1].t3_download["bytes_done"] == len(content)
+
+    # not modified, nothing transferred
+    events.clear()
+    download_file(httpserver.url_for("/progress"), filepath, progress=events.append)
+    assert [e.status for e in events] == ["cached"]
+
+
+def test_download_resume_interrupted(httpserver: HTTPServer, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    content = bytes(range(256)) * 10
+    range_handler = make_range_handler(content)
+
+    def handler(request: Request) -> Response:
+        if request.headers.get("Range"):
+            return range_handler(request)
+        # connection closed in the middle of the body
+        return Response(iter([content[:1000]]), headers={"Accept-Ranges": "bytes", "Content-Length": str(len(content))})
+
+    monkeypatch.setattr(download, "backoff_delay", lambda attempt: 0)
+    httpserver.expect_request("/interrupted").respond_with_handler(handler)
+    filepath = tmp_path / "interrupted.bin"
+    download_file(httpserver.url_for("/interrupted"), filepath)
+    assert filepath.read_bytes() == content
+    assert httpserver.log[-1][0].headers["Range"] == "bytes=1000-"
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 19:48:10 by codeskyblue
+"""
+
+from pytest_httpserver import HTTPServer
+
+from tidevice3.utils.http import backoff_delay, request
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 0.5, 4) <= 4
+
+
+def test_request_retry(httpserver: HTTPServer):
+    url = httpserver.url_for("/retry")
+    httpserver.expect_ordered_request("/retry").respond_with_data("bad gateway", status=502)
+    httpserver.expect_ordered_request("/retry").respond_with_data("busy", status=503, headers={"Retry-After": "0"})
+    httpserver.expect_ordered_request("/retry").respond_with_data("ok")
+    r = request("GET", url, timeout=5, backoff=0)
+    assert r.status_code == 200 and r.text == "ok"
+
+    # retries exhausted, the last response is returned
+    httpserver.clear()
+    httpserver.expect_request("/retry").respond_with_data("bad gateway", status=502)
+    assert request("GET", url, timeout=5, retries=1, backoff=0).status_code == 502
+    assert len(httpserver.log) == 2
+
+    # not idempotent, never retried
+    httpserver.clear()
+    httpserver.expect_request("/retry", method="POST").respond_with_data("bad gateway", status=502)
+    assert request("POST", url, timeout=5, backoff=0).status_code == 502
+    assert len(httpserver.log) == 1
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 17:05:11 by codeskyblue
+"""
+
+import pathlib
+import plistlib
+import zipfile
+
+import pytest
+
+from tidevice3.exceptions import FatalError
+from tidevice3.utils.ipa import read_ipa_info
+
+
+def make_ipa(path: pathlib.Path, info: dict):
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("Payload/Demo.app/Info.plist", plistlib.dumps(info, fmt=plistlib.FMT_BINARY))
+        zf.writestr("Payload/Demo.app/Frameworks/Foo.framework/Info.plist", plistlib.dumps({}))
+        zf.writestr("Payload/Demo.app/Demo", b"\0" * 1024)
+
+
+def test_read_ipa_info(tmp_path: pathlib.Path):
+    ipa_path = tmp_path / "demo.ipa"
+    make_ipa(ipa_path, {"CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "42",
+                        "CFBundleShortVersionString": "1.2.3"})
+    info = read_ipa_info(ipa_path)
+    assert info.CFBundleIdentifier == "com.example.demo"
+    assert info.CFBundleVersion == "42"
+    assert info.CFBundleShortVersionString == "1.2.3"
+    assert info.same_version({"CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "42",
+                              "CFBundleShortVersionString": "1.2.3"})
+    assert not info.same_version({"CFBundleIdentifier": "com.example.demo", "CFBundleVersion": "41",
+                                  "CFBundleShortVersionString": "1.2.3"})
+
+    (tmp_path / "bad.ipa").write_bytes(b"not a zip")
+    with pytest.raises(FatalError):
+        read_ipa_info(tmp_path / "bad.ipa")
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 23:40:02 by codeskyblue
+"""
+
+import io
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from tidevice3.utils.recorder import ScreenRecorder, SegmentWriter, TextOverlay, VfrWriter, decode_frame, draw_text, \
+    limit_fps
+
+
+def make_png(color, size=(31, 21)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def append_data(self, frame):
+        self.frames.append(frame)
+
+
+def slow_frames(count: int, interval: float):
+    for i in range(count):
+        yield make_png((i * 20 % 256, 0, 0))
+        time.sleep(interval)
+
+
+def test_decode_frame():
+    frame = decode_frame(make_png((255, 0, 0)))
+    assert frame.shape == (20, 30, 3)
+    assert tuple(frame[0, 0]) == (255, 0, 0)
+    assert decode_frame(make_png((0, 0, 0), (200, 100)), "Frame: 1").any()
+
+
+def test_limit_fps_fill():
+    frames = list(limit_fps(slow_frames(3, 0.25), fps=10))
+    assert len(frames) >= 5  # gaps are filled with the last frame
+
+
+def test_screen_recorder():
+    writer = FakeWriter()
+    recorder = ScreenRecorder(slow_frames(5, 0.2), writer, fps=10, show_time=False, decoders=1)
+    stats = recorder.run()
+    assert stats.captured == 5
+    assert stats.dropped == 0
+    assert stats.encoded == len(writer.frames)
+    assert stats.duplicated > 0
+    assert stats.encoded - stats.duplicated == 5
+    assert all(isinstance(f, np.ndarray) and f.shape == (20, 30, 3) for f in writer.frames)
+    # frames keep capture order
+    reds = [int(f[0, 0, 0]) for f in writer.frames]
+    assert reds == sorted(reds)
+
+
+def test_screen_recorder_drop():
+    class SlowWriter(FakeWriter):
+        def append_data(self, frame):
+            time.sleep(0.05)
+            super().append_data(frame)
+
+    writer = SlowWriter()
+    frames = (make_png((0, 0, 0)) for _ in range(100))
+    stats = ScreenRecorder(frames, writer, fps=1000, show_time=False, decoders=1, queue_size=2).run()
+    assert stats.captured == 100
+    assert stats.dropped > 0
+    assert stats.encoded - stats.duplicated + stats.dropped <= 100
+
+
+def read_pts(path) -> list:
+    import re
+
+    import imageio_ffmpeg
+    output = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-i", str(path), "-vf", "showinfo", "-f", "null", "-"],
+                            capture_output=True, text=True).stderr
+    return [float(v) for v in re.findall(r"pts_time:([\d.]+)", output)]
+
+
+def test_vfr_writer(tmp_path):
+    out = tmp_path / "out.mp4"
+    writer = VfrWriter(str(out), slack=0.1)
+    start = time.monotonic()
+    for i, t in enumerate([0, 0.1, 0.6, 0.7]):
+        writer.append_data(np.full((20, 30, 3), i * 60, np.uint8), start + t)
+    writer.close()
+    assert writer.late == 0
+    pts = read_pts(out)
+    assert len(pts) == 4
+    assert pts == pytest.approx([0, 0.1, 0.6, 0.7], abs=0.03)
+
+
+def test_screen_recorder_vfr():
+    class FakeVfrWriter(VfrWriter):
+        def __init__(self):
+            super().__init__("-")
+            self.timestamps = []
+
+        def append_data(self, frame, timestamp):
+            self.timestamps.append(timestamp)
+
+    writer = FakeVfrWriter()
+    stats = ScreenRecorder(slow_frames(4, 0.2), writer, fps=10, show_time=False, decoders=1).run()
+    assert stats.encoded == 4
+    assert stats.duplicated == 0
+    assert len(writer.timestamps) == 4
+    gaps = np.diff(writer.timestamps)
+    assert all(0.15 < gap < 0.35 for gap in gaps)
+
+
+def test_limit_fps_vfr():
+    frames = list(limit_fps(slow_frames(3, 0.25), fps=10, vfr=True))
+    assert len(frames) == 3
+    assert len(set(frames)) == 3
+
+
+def test_text_overlay():
+    text = "Time: 2026-10-17 23:12:30 Frame: 12"
+    img = Image.new("RGB", (300, 120), (10, 200, 30))
+    expect = np.asarray(draw_text(img.copy(), text)).astype(int)
+    frame = TextOverlay().draw(np.array(img), text)
+    diff = np.abs(expect - frame).sum(axis=2)
+    assert (diff > 0).sum() <= 5  # glyph overhang into the next glyph is not kept
+
+    # clipped at frame border
+    small = TextOverlay().draw(np.zeros((45, 100, 3), dtype=np.uint8), text)
+    assert tuple(small[44, 15]) == (128, 128, 128)
+
+
+def test_screen_recorder_unchanged():
+    def frames():
+        for i in range(6):
+            yield make_png((0, 0, 0) if i < 4 else (200, 0, 0))
+            time.sleep(0.1)
+
+    writer = FakeWriter()
+    stats = ScreenRecorder(frames(), writer, fps=20, decoders=1, skip_unchanged=True).run()
+    assert stats.decoded == 2
+    assert stats.unchanged == 4
+    assert stats.saved_ratio == pytest.approx(4 / 6)
+    assert stats.encoded == len(writer.frames) >= 6
+    # time overlay is held while the screen does not change
+    assert all(np.array_equal(writer.frames[0], f) for f in writer.frames[:4])
+
+
+def test_segment_writer(tmp_path):
+    playlist = tmp_path / "out.m3u8"
+    writer = SegmentWriter(str(playlist), fps=10, segment_seconds=1, keep=2)
+    for i in range(55):
+        writer.append_data(np.full((20, 30, 3), i * 4, np.uint8))
+    writer.close()
+    segments = sorted(p.name for p in tmp_path.glob("*.ts"))
+    assert 2 <= len(segments) <= 3  # ffmpeg deletes a segment one step later
+    content = playlist.read_text()
+    assert "#EXT-X-ENDLIST" in content
+    listed = [line for line in content.splitlines() if line.endswith(".ts")]
+    assert len(listed) == 2
+    assert set(listed) <= set(segments)
+    assert "#EXTINF:1.000000," in content
+    assert all((tmp_path / name).stat().st_size > 0 for name in listed)
+
+
+def test_segment_writer_keep_all(tmp_path):
+    playlist = tmp_path / "out.m3u8"
+    writer = SegmentWriter(str(playlist), fps=10, segment_seconds=1)
+    for i in range(35):
+        writer.append_data(np.full((20, 30, 3), i * 4, np.uint8))
+    writer.close()
+    assert len(list(tmp_path.glob("*.ts"))) == 4
+    assert "#EXT-X-PLAYLIST-TYPE:EVENT" in playlist.read_text()
+
+
+def test_screen_recorder_vfr_unchanged():
+    class FakeVfrWriter(VfrWriter):
+        def __init__(self):
+            super().__init__("-")
+            self.writes = []
+
+        def append_data(self, frame, timestamp):
+            self.writes.append((int(frame[0, 0, 1]), timestamp, time.monotonic()))
+
+    def frames():
+        for green in [0, 200, 200, 200, 200, 200, 100]:
+            yield make_png((0, green, 0))
+            time.sleep(0.2)
+
+    writer = FakeVfrWriter()
+    stats = ScreenRecorder(frames(), writer, fps=20, show_time=False, decoders=1, skip_unchanged=True).run()
+    assert stats.unchanged == 4
+    assert [w[0] for w in writer.writes] == [0, 200, 100]
+    # the changed screen reaches the writer right after capture, not at the next change
+    _, captured_at, written_at = writer.writes[1]
+    assert written_at - captured_at < 0.5
+
+
+def test_screen_recorder_vfr_static_end(tmp_path):
+    def frames():
+        for i in range(8):
+            yield make_png((200, 0, 0) if i == 0 else (0, 200, 0))
+            time.sleep(0.2)
+
+    out = tmp_path / "out.mp4"
+    writer = VfrWriter(str(out), slack=0.1)
+    try:
+        stats = ScreenRecorder(frames(), writer, fps=10, show_time=False, decoders=1, skip_unchanged=True).run()
+    finally:
+        writer.close()
+    assert stats.decoded == 2 and stats.unchanged == 6
+    # the green screen is held until the last capture, not cut after its first frame
+    pts = read_pts(out)
+    assert len(pts) == 3
+    assert pts[-1] == pytest.approx(1.4, abs=0.1)
+
+
+RECORD_UNTIL_SIGINT = """
+import io, sys, time
+from PIL import Image
+from tidevice3.utils.recorder import ScreenRecorder, VfrWriter
+
+def frames():
+    for i in range(1000):
+        buf = io.BytesIO()
+        Image.new("RGB", (30, 20), (i * 20 % 256, 0, 0)).save(buf, format="PNG")
+        yield buf.getvalue()
+        time.sleep(0.1)
+
+writer = VfrWriter(sys.argv[1], slack=0.1)
+print("recording", flush=True)
+try:
+    stats = ScreenRecorder(frames(), writer, fps=10, show_time=False, decoders=1).run()
+finally:
+    writer.close()
+print("encoded", stats.encoded, flush=True)
+"""
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="Ctrl-C is sent to the process group")
+def test_vfr_writer_sigint(tmp_path):
+    out = tmp_path / "out.mp4"
+    # like a terminal, Ctrl-C is sent to every process in the foreground group
+    proc = subprocess.Popen([sys.executable, "-c", RECORD_UNTIL_SIGINT, str(out)], stdout=subprocess.PIPE,
+                            text=True, start_new_session=True, cwd=pathlib.Path(__file__).parent.parent)
+    assert proc.stdout.readline().strip() == "recording"
+    time.sleep(2)
+    os.killpg(proc.pid, signal.SIGINT)
+    stdout, _ = proc.communicate(timeout=30)
+    assert proc.returncode == 0
+    encoded = int(stdout.split()[-1])
+    assert encoded > 5
+    assert len(read_pts(out)) == encoded
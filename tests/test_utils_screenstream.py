@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 23:59:40 by codeskyblue
+"""
+
+import asyncio
+import io
+import time
+
+import pytest
+from PIL import Image
+
+from tidevice3.utils.screenstream import MJPEG_BOUNDARY, ScreenBroadcaster, create_app
+
+
+def make_png(color) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 80), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class FakeSession:
+    def __init__(self):
+        self.count = 0
+        self.closed = 0
+
+    def screenshot_png(self) -> bytes:
+        self.count += 1
+        # screen changes every 3 captures
+        return make_png((self.count // 3 * 10 % 256, 0, 0))
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def broadcaster():
+    b = ScreenBroadcaster(FakeSession(), fps=50, idle_timeout=0.3)
+    b.start()
+    yield b
+    b.close()
+
+
+def test_capture_on_demand(broadcaster: ScreenBroadcaster):
+    time.sleep(0.2)
+    assert broadcaster.session.count == 0  # nobody watching
+
+    jpeg = asyncio.run(broadcaster.latest_jpeg())
+    assert Image.open(io.BytesIO(jpeg)).format == "JPEG"
+    time.sleep(0.1)
+    assert broadcaster.stats.captured > 1
+    assert broadcaster.stats.reused > 0
+    assert broadcaster.stats.encoded + broadcaster.stats.reused == broadcaster.stats.captured
+
+    time.sleep(0.6)  # idle, capture paused
+    captured = broadcaster.stats.captured
+    assert broadcaster.session.closed == 1
+    time.sleep(0.2)
+    assert broadcaster.stats.captured == captured
+
+
+def test_mjpeg(broadcaster: ScreenBroadcaster):
+    async def read(count: int, fps: float):
+        parts = []
+        start = time.monotonic()
+        stream = broadcaster.mjpeg(fps)
+        async for part in stream:
+            parts.append(part)
+            if len(parts) == count:
+                break
+        await stream.aclose()
+        return parts, time.monotonic() - start
+
+    parts, elapsed = asyncio.run(read(4, fps=10))
+    assert broadcaster.stats.clients == 0
+    assert elapsed >= 0.25  # rate limited by client fps
+    for part in parts:
+        assert part.startswith(f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n".encode())
+        jpeg = part.split(b"\r\n\r\n", 1)[1][:-2]
+        assert Image.open(io.BytesIO(jpeg)).size == (40, 80)
+
+
+def test_app(broadcaster: ScreenBroadcaster):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    client = TestClient(create_app(broadcaster))
+    r = client.get("/screenshot.jpg")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/jpeg"
+    stats = client.get("/stats").json()
+    assert stats["captured"] >= 1
+    assert client.get("/").text.startswith("<!DOCTYPE html>")
+
+
+def test_drop_stalled_viewer():
+    import os
+    import socket
+    import threading
+
+    import uvicorn
+
+    class NoiseSession(FakeSession):
+        def screenshot_png(self) -> bytes:
+            # random pixels, so that the jpeg is large and socket buffers fill up quickly
+            buf = io.BytesIO()
+            Image.frombytes("RGB", (400, 400), os.urandom(400 * 400 * 3)).save(buf, format="PNG", compress_level=0)
+            return buf.getvalue()
+
+    broadcaster = ScreenBroadcaster(NoiseSession(), fps=50, idle_timeout=0.1, slow_client_timeout=0.5)
+    broadcaster.start()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(broadcaster), log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    try:
+        while not server.started:
+            time.sleep(0.01)
+        viewer = socket.socket()
+        viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        viewer.connect(("127.0.0.1", port))
+        viewer.sendall(b"GET /stream.mjpeg HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        # never read
+        deadline = time.monotonic() + 20
+        while broadcaster.stats.dropped_clients == 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert broadcaster.stats.dropped_clients == 1
+        assert broadcaster.stats.clients == 0
+        time.sleep(0.5)
+        captured = broadcaster.stats.captured
+        time.sleep(0.3)
+        assert broadcaster.stats.captured == captured  # capture paused
+        viewer.close()
+    finally:
+        server.should_exit = True
+        thread.join(5)
+        broadcaster.close()
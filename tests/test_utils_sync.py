@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 21:40:27 by codeskyblue
+"""
+
+import os
+import pathlib
+import time
+from typing import Callable
+
+import pytest
+
+from tidevice3.utils.afc import AfcPool
+from tidevice3.utils.sync import Manifest, sync_pull, sync_push
+
+
+def tree_files(root: pathlib.Path) -> dict:
+    return {p.relative_to(root).as_posix(): p.read_bytes() for p in root.rglob("*") if p.is_file()}
+
+
+def test_sync_push(tmp_path: pathlib.Path, fake_afc: Callable, make_tree: Callable):
+    local_dir = tmp_path / "local"
+    make_tree(local_dir)
+    device_root = tmp_path / "device"
+    device_root.mkdir()
+    afc = fake_afc(device_root)
+    pool = AfcPool(lambda: afc, 1)
+    manifest = Manifest(tmp_path / "manifest.json")
+
+    result = sync_push(pool, local_dir, "/data", manifest)
+    assert result.files == 51 and result.skipped == 0 and not result.errors
+    assert tree_files(device_root / "data") == tree_files(local_dir)
+    assert (device_root / "data/Documents/empty").is_dir()
+
+    # unchanged tree is verified by listing only
+    afc.stat_count = 0
+    manifest = Manifest(tmp_path / "manifest.json")
+    manifest.load()
+    result = sync_push(pool, local_dir, "/data", manifest)
+    assert result.files == 0 and result.skipped == 51
+    assert afc.stat_count == 0
+
+    # changed, new and extraneous files
+    (local_dir / "Documents/a.txt").write_text("hello world")
+    (local_dir / "Documents/new.txt").write_text("new")
+    (device_root / "data/Documents/extra.txt").write_text("extra")
+    changes = []
+    sync_push(pool, local_dir, "/data", manifest, delete=True,
+              on_change=lambda action, rel: changes.append((action, rel)))
+    assert sorted(changes) == [("delete", "Documents/extra.txt"), ("push", "Documents/a.txt"),
+                               ("push", "Documents/new.txt")]
+    assert tree_files(device_root / "data") == tree_files(local_dir)
+
+
+def test_sync_pull(tmp_path: pathlib.Path, device_root: pathlib.Path, fake_afc: Callable):
+    local_dir = tmp_path / "local"
+    pool = AfcPool(lambda: fake_afc(device_root), 2)
+
+    result = sync_pull(pool, "/", local_dir, checksum=True)
+    assert result.files == 51 and not result.errors
+    assert tree_files(local_dir) == tree_files(device_root)
+
+    result = sync_pull(pool, "/", local_dir)
+    assert result.files == 0 and result.skipped == 51
+
+    (local_dir / "Documents/extra.txt").write_text("extra")
+    (local_dir / "Documents/extra").mkdir()
+    (device_root / "Documents/a.txt").write_text("changed")
+    os.utime(device_root / "Documents/a.txt", (time.time() + 10, time.time() + 10))
+    changes = []
+    result = sync_pull(pool, "/", local_dir, delete=True, dry_run=True,
+                       on_change=lambda action, rel: changes.append((action, rel)))
+    assert sorted(changes) == [("delete", "Documents/extra"), ("delete", "Documents/extra.txt"),
+                               ("pull", "Documents/a.txt")]
+    assert (local_dir / "Documents/extra.txt").exists()
+    sync_pull(pool, "/", local_dir, delete=True)
+    assert tree_files(local_dir) == tree_files(device_root)
+    assert not (local_dir / "Documents/extra").exists()
+
+
+def test_sync_push_unexpected_error(tmp_path: pathlib.Path, fake_afc: Callable, make_tree: Callable):
+    local_dir = tmp_path / "local"
+    make_tree(local_dir)
+    afc = fake_afc(tmp_path / "device")
+    afc.makedirs("/")
+
+    def broken_fopen(path: str, mode: str = "r"):
+        raise RuntimeError("connection lost")
+    afc.fopen = broken_fopen
+    manifest = Manifest(tmp_path / "manifest.json")
+    with pytest.raises(RuntimeError):
+        sync_push(AfcPool(lambda: afc, 1), local_dir, "/data", manifest)
+    # the manifest must not claim files which never reached the device
+    assert not (tmp_path / "manifest.json").exists()
@@ -5,18 +5,26 @@ import datetime
 import io
 import logging
 import os
+import pathlib
 import socket
-from typing import Any, Dict, Iterator, Optional
-
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
 import requests
 from packaging.version import Version
 from PIL import Image
 from pydantic import BaseModel
 from pymobiledevice3.common import get_home_folder
-from pymobiledevice3.exceptions import AlreadyMountedError
+from pymobiledevice3.exceptions import AlreadyMountedError, AppInstallError
 from pymobiledevice3.lockdown import LockdownClient, create_using_usbmux, usbmux
 from pymobiledevice3.lockdown_service_provider import LockdownServiceProvider
 from pymobiledevice3.remote.remote_service_discovery import RemoteServiceDiscoveryService
+from pymobiledevice3.services.afc import AfcService
 from pymobiledevice3.services.amfi import AmfiService
 from pymobiledevice3.services.dvt.dvt_secure_socket_proxy import DvtSecureSocketProxyService
 from pymobiledevice3.services.dvt.instruments.device_info import DeviceInfo
@@ -26,11 +34,19 @@ from pymobiledevice3.services.mobile_image_mounter import auto_mount
 from pymobiledevice3.services.screenshot import ScreenshotService
 from pymobiledevice3.utils import get_asyncio_loop
 
-from tidevice3.exceptions import FatalError
-from tidevice3.utils.download import download_file, is_hyperlink
+from tidevice3.exceptions import DownloadError, FatalError
+from tidevice3.utils import http
+from tidevice3.utils.afc import AfcFile
+from tidevice3.utils.cache import DownloadCache
+from tidevice3.utils.download import DEFAULT_CHUNK_SIZE, DEFAULT_DOWNLOAD_TIMEOUT, DigestWriter, DownloadMonitor, \
+    DownloadProgress, check_digests, download_file, get_file_digests, get_remote_file_info, is_hyperlink, \
+    make_request_get_stream
+from tidevice3.utils.ipa import IPAInfo, read_ipa_info
 
 logger = logging.getLogger(__name__)
 
+STREAM_REMOTE_IPA_DIR = "/PublicStaging"
+
 class DeviceShortInfo(BaseModel):
     BuildVersion: str
     ConnectionType: Optional[str]
@@ -41,6 +57,14 @@ class DeviceShortInfo(BaseModel):
     ProductVersion: str
 
 
+class InstallResult(BaseModel):
+    Identifier: str
+    Success: bool
+    Elapsed: float
+    Skipped: bool = False
+    Error: Optional[str] = None
+
+
 class ProcessInfo(BaseModel):
     isApplication: bool
     pid: int
@@ -109,7 +133,7 @@ def connect_remote_service_discovery_service(udid: str, tunneld_url: str = None)
             tunneld_url = "http://localhost:5555" # for backward compatibility
 
     try:
-        resp = requests.get(tunneld_url, timeout=DEFAULT_TIMEOUT)
+        resp = http.request("GET", tunneld_url, timeout=DEFAULT_TIMEOUT)
         tunnels: Dict[str, Any] = resp.json()
         ipv6_address = tunnels.get(udid)
         if ipv6_address is None:
@@ -121,30 +145,141 @@ def connect_remote_service_discovery_service(udid: str, tunneld_url: str = None)
     except (TimeoutError, ConnectionError):
         raise FatalError("RemoteServiceDiscoveryService connect failed")
 
-def iter_screenshot(service_provider: LockdownClient) -> Iterator[bytes]:
-    if int(service_provider.product_version.split(".")[0]) >= 17:
-        with DvtSecureSocketProxyService(lockdown=service_provider) as dvt:
-            screenshot_service = Screenshot(dvt)
-            while True:
-                yield screenshot_service.get_screenshot()
-    else:
-        screenshot_service = ScreenshotService(service_provider)
+class ScreenshotSession:
+    """
+    Keep the screenshot service open between screenshots, so that only the image is transferred every time.
+    When a screenshot fails, the service is reconnected and the screenshot is taken again.
+
+    Usage:
+        with ScreenshotSession(service_provider) as session:
+            png_data = session.screenshot_png()
+            pil_img = screenshot(service_provider, session=session)
+    """
+    def __init__(self, service_provider: LockdownClient, reconnects: int = 1):
+        self.service_provider = service_provider
+        self.reconnects = reconnects
+        self._stack: Optional[ExitStack] = None
+        self._take_screenshot: Optional[Callable[[], bytes]] = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        stack = ExitStack()
+        try:
+            if int(self.service_provider.product_version.split(".")[0]) >= 17:
+                dvt = stack.enter_context(DvtSecureSocketProxyService(lockdown=self.service_provider))
+                self._take_screenshot = Screenshot(dvt).get_screenshot
+            else:
+                service = stack.enter_context(ScreenshotService(self.service_provider))
+                self._take_screenshot = service.take_screenshot
+        except BaseException:
+            stack.close()
+            raise
+        self._stack = stack
+
+    def _disconnect(self):
+        stack, self._stack, self._take_screenshot = self._stack, None, None
+        if stack is not None:
+            try:
+                stack.close()
+            except Exception as e:
+                logger.debug("close screenshot service: %s", e)
+
+    def screenshot_png(self) -> bytes:
+        with self._lock:
+            for attempt in range(self.reconnects + 1):
+                if self._take_screenshot is None:
+                    self._connect()
+                try:
+                    return self._take_screenshot()
+                except Exception as e:
+                    self._disconnect()
+                    if attempt == self.reconnects:
+                        raise
+                    logger.warning("screenshot failed: %s, reconnect", e)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def __iter__(self) -> Iterator[bytes]:
         while True:
-            yield screenshot_service.take_screenshot()
+            yield self.screenshot_png()
+
+    def __enter__(self) -> ScreenshotSession:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_screenshot(service_provider: LockdownClient) -> Iterator[bytes]:
+    with ScreenshotSession(service_provider) as session:
+        yield from session
+
 
+def screenshot_png(service_provider: LockdownClient, session: Optional[ScreenshotSession] = None) -> bytes:
+    """ get screenshot as png data, reuse the service of session if given """
+    if session is not None:
+        return session.screenshot_png()
+    with ScreenshotSession(service_provider) as session:
+        return session.screenshot_png()
 
-def screenshot_png(service_provider: LockdownClient) -> bytes:
-    """ get screenshot as png data """
-    it = iter_screenshot(service_provider)
-    png_data = next(it)
-    it.close()
-    return png_data
 
+def decode_screenshot(data: bytes, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    decode screenshot into RGB image
 
-def screenshot(service_provider: LockdownClient) -> Image.Image:
+    :param size: max (width, height), aspect ratio is kept. png (what the device sends) is always fully decoded
+        and reduced afterwards, only jpeg can be reduced while decoding. RGB conversion runs on the reduced image
+    """
+    img = Image.open(io.BytesIO(data))
+    if size:
+        img.thumbnail(size)
+    return img.convert("RGB")
+
+
+def screenshot(service_provider: LockdownClient, session: Optional[ScreenshotSession] = None,
+               size: Optional[Tuple[int, int]] = None) -> Image.Image:
     """ get screenshot as PIL.Image.Image """
-    png_data = screenshot_png(service_provider)
-    return Image.open(io.BytesIO(png_data)).convert("RGB")
+    png_data = screenshot_png(service_provider, session=session)
+    return decode_screenshot(png_data, size)
+
+
+def screenshot_array(service_provider: LockdownClient, session: Optional[ScreenshotSession] = None,
+                     size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """
+    get screenshot as RGB uint8 array with shape (height, width, 3), read only.
+    PIL does not expose its pixel buffer, so the pixels are copied once from the decoded image, it is not a view
+    """
+    return np.asarray(screenshot(service_provider, session=session, size=size))
+
+
+SCREENSHOT_FORMATS = ("png", "jpeg", "webp", "raw")
+
+
+def encode_screenshot(png_data: bytes, format: str = "png", size: Optional[Tuple[int, int]] = None,
+                      quality: int = 85) -> bytes:
+    """
+    encode screenshot as png, jpeg, webp or raw (RGB pixels, 3 bytes per pixel, row by row)
+    png without size is returned as is
+    """
+    format = format.lower()
+    if format not in SCREENSHOT_FORMATS:
+        raise ValueError("unsupported screenshot format", format)
+    if format == "png" and not size:
+        return png_data
+    img = decode_screenshot(png_data, size)
+    if format == "raw":
+        return img.tobytes()
+    buf = io.BytesIO()
+    img.save(buf, format=format, quality=quality)
+    return buf.getvalue()
+
+
+def screenshot_bytes(service_provider: LockdownClient, format: str = "png", size: Optional[Tuple[int, int]] = None,
+                     quality: int = 85, session: Optional[ScreenshotSession] = None) -> bytes:
+    """ get screenshot encoded as png, jpeg, webp or raw, see encode_screenshot """
+    return encode_screenshot(screenshot_png(service_provider, session=session), format, size, quality)
 
 
 def proclist(service_provider: LockdownClient) -> Iterator[ProcessInfo]:
@@ -157,14 +292,195 @@ def proclist(service_provider: LockdownClient) -> Iterator[ProcessInfo]:
                 yield ProcessInfo.model_validate(process)
 
 
-def app_install(service_provider: LockdownClient, path_or_url: str):
+def resolve_ipa(path_or_url: str, segments: int = 1, cache: Optional[DownloadCache] = None,
+                download_progress: Optional[Callable[[DownloadProgress], None]] = None) -> pathlib.Path:
+    """ return local path of given .ipa or url, url is downloaded into cache """
     if is_hyperlink(path_or_url):
-        ipa_path = download_file(path_or_url)
+        return download_file(path_or_url, segments=segments, cache=cache or DownloadCache(),
+                             progress=download_progress)
     elif os.path.isfile(path_or_url):
-        ipa_path = path_or_url
+        return pathlib.Path(path_or_url)
     else:
         raise ValueError("local file not found", path_or_url)
-    InstallationProxyService(lockdown=service_provider).install_from_local(ipa_path)
+
+
+def app_install(service_provider: LockdownClient, path_or_url: str, segments: int = 1,
+                cache: Optional[DownloadCache] = None, progress: Optional[Callable[[int], None]] = None,
+                stream: bool = False, skip_same: bool = False,
+                download_progress: Optional[Callable[[DownloadProgress], None]] = None) -> bool:
+    """
+    install given .ipa or url
+
+    :param segments: number of parallel download connections
+    :param cache: download cache for url, default is DownloadCache()
+    :param progress: called with install percent
+    :param download_progress: called with DownloadProgress while downloading url
+    :param stream: upload url to device directly without saving to local disk, only for url
+    :param skip_same: skip when the same build is already installed
+    :return: False if skipped
+    """
+    if stream:
+        if not is_hyperlink(path_or_url):
+            raise ValueError("stream can only be used with url", path_or_url)
+        if skip_same:
+            raise ValueError("skip_same can not be used with stream")
+        app_install_stream(service_provider, path_or_url, progress=progress, download_progress=download_progress)
+        return True
+    ipa_path = resolve_ipa(path_or_url, segments, cache, download_progress)
+    if skip_same:
+        cache = cache or DownloadCache()
+        sha256 = cache.sha256_of(ipa_path)
+        # cached ipa are looked up in the index, instead of opening the zip again
+        ipa_info = cache.ipa_info(sha256) if sha256 else None
+        if ipa_info is None:
+            ipa_info = read_ipa_info(ipa_path)
+        if sha256 is None:
+            # a local ipa of the user, nothing is written next to it
+            sha256 = get_file_digests(ipa_path, save=False)["sha256"]
+        if is_same_app_installed(service_provider, ipa_info, sha256, cache):
+            logger.info("%s %s (%s) already installed, skip", ipa_info.CFBundleIdentifier,
+                        ipa_info.CFBundleShortVersionString, ipa_info.CFBundleVersion)
+            return False
+    handler = (lambda completion, *args: progress(completion)) if progress else None
+    InstallationProxyService(lockdown=service_provider).install_from_local(ipa_path, handler=handler)
+    if skip_same:
+        cache.record_install(service_provider.udid, ipa_info.CFBundleIdentifier, sha256,
+                             ipa_info.CFBundleVersion, ipa_info.CFBundleShortVersionString)
+    return True
+
+
+def is_same_app_installed(service_provider: LockdownClient, ipa_info: IPAInfo, sha256: str,
+                          cache: DownloadCache) -> bool:
+    """
+    compare with the content hash of the ipa installed last time by t3,
+    if the device now has other versions (installed by something else), compare versions instead
+    """
+    bundle_id = ipa_info.CFBundleIdentifier
+    apps = InstallationProxyService(lockdown=service_provider).get_apps(bundle_identifiers=[bundle_id])
+    app_info = apps.get(bundle_id)
+    if not app_info:
+        return False
+    record = cache.installed_record(service_provider.udid, bundle_id)
+    if record and record.version == app_info.get("CFBundleVersion") \
+            and record.short_version == app_info.get("CFBundleShortVersionString"):
+        return record.sha256 == sha256
+    return ipa_info.same_version(app_info)
+
+
+def app_install_stream(service_provider: LockdownClient, url: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       timeout: float = DEFAULT_DOWNLOAD_TIMEOUT, progress: Optional[Callable[[int], None]] = None,
+                       download_progress: Optional[Callable[[DownloadProgress], None]] = None):
+    """
+    install from url without staging on local disk,
+    the response body is uploaded to device chunk by chunk while the digest is verified
+
+    raise DownloadError if the body does not match content-length or digest published by server
+    """
+    logger.info("stream install from url: %s", url)
+    # unique name, so that installs running at the same time on one device do not overwrite each other
+    remote_path = f"{STREAM_REMOTE_IPA_DIR}/tidevice3-{uuid.uuid4().hex}.ipa"
+    monitor = DownloadMonitor(url, download_progress)
+    try:
+        r = make_request_get_stream(url, timeout)
+        try:
+            monitor.connected()
+            remote_file_info = get_remote_file_info(r.headers)
+            with AfcService(service_provider) as afc:
+                afc.makedirs(STREAM_REMOTE_IPA_DIR)
+                monitor.start_transfer(remote_file_info.content_length)
+                try:
+                    with AfcFile(afc, remote_path, "w") as f:
+                        writer = DigestWriter(f)
+                        while True:
+                            chunk = r.raw.read(chunk_size)
+                            if not chunk:
+                                break
+                            writer.write(chunk)
+                            monitor.update(len(chunk))
+                    if (remote_file_info.content_length
+                            and monitor.bytes_done != remote_file_info.content_length) \
+                            or not check_digests(remote_file_info, writer.hexdigests()):
+                        raise DownloadError("download file not complete", url)
+                except BaseException:
+                    afc.rm(remote_path, force=True)
+                    raise
+        finally:
+            r.close()
+    except Exception as e:
+        monitor.finish("failed", str(e))
+        raise
+    monitor.finish("downloaded")
+
+    iproxy = InstallationProxyService(lockdown=service_provider)
+    try:
+        iproxy.service.send_plist({
+            "Command": "Install",
+            "ClientOptions": {},
+            "PackagePath": remote_path,
+        })
+        watch_install_completion(iproxy, progress)
+    finally:
+        with AfcService(service_provider) as afc:
+            afc.rm(remote_path, force=True)
+
+
+def watch_install_completion(iproxy: InstallationProxyService, progress: Optional[Callable[[int], None]] = None):
+    """ wait until the install command sent to iproxy finished, raise AppInstallError if failed """
+    while True:
+        response = iproxy.service.recv_plist()
+        if not response:
+            raise AppInstallError("installation_proxy closed before install complete")
+        error = response.get("Error")
+        if error:
+            raise AppInstallError(f"{error}: {response.get('ErrorDescription')}")
+        completion = response.get("PercentComplete")
+        if completion and progress:
+            progress(completion)
+        if response.get("Status") == "Complete":
+            return
+
+
+def app_install_all(
+    path_or_url: str, udids: Optional[List[str]] = None, max_workers: int = 8, segments: int = 1,
+    cache: Optional[DownloadCache] = None, progress: Optional[Callable[[str, int], None]] = None,
+    usbmux_address: Optional[str] = None, skip_same: bool = False,
+    download_progress: Optional[Callable[[DownloadProgress], None]] = None,
+) -> List[InstallResult]:
+    """
+    install given .ipa or url to many devices in parallel, the ipa is downloaded only once
+
+    :param udids: target devices, default all usb devices
+    :param max_workers: max devices installed at the same time
+    :param progress: called with (udid, install percent)
+    :param download_progress: called with DownloadProgress while downloading url
+    :param skip_same: skip devices which already have the same build
+    :return: one result per device, errors are collected instead of raised
+    """
+    if cache is None and (skip_same or is_hyperlink(path_or_url)):
+        cache = DownloadCache()
+    ipa_path = resolve_ipa(path_or_url, segments, cache, download_progress)
+    if skip_same and not cache.sha256_of(ipa_path):
+        get_file_digests(ipa_path)  # hash once, instead of once per device
+    if udids is None:
+        udids = [d.Identifier for d in list_devices(usb=True, usbmux_address=usbmux_address)]
+
+    def install(udid: str) -> InstallResult:
+        start = time.time()
+        try:
+            service_provider = connect_service_provider(udid, force_usbmux=True, usbmux_address=usbmux_address)
+            with service_provider:
+                installed = app_install(
+                    service_provider, str(ipa_path), cache=cache, skip_same=skip_same,
+                    progress=(lambda completion: progress(udid, completion)) if progress else None)
+        except Exception as e:
+            logger.warning("install to %s failed: %s", udid, e)
+            return InstallResult(Identifier=udid, Success=False, Elapsed=time.time() - start, Error=str(e))
+        return InstallResult(Identifier=udid, Success=True, Elapsed=time.time() - start, Skipped=not installed)
+
+    if not udids:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(install, udids))
 
 
 def enable_developer_mode(service_provider: LockdownClient):
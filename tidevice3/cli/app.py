@@ -18,8 +18,9 @@ from pymobiledevice3.services.dvt.dvt_secure_socket_proxy import DvtSecureSocket
 from pymobiledevice3.services.dvt.instruments.process_control import ProcessControl
 from pymobiledevice3.services.installation_proxy import InstallationProxyService
 
-from tidevice3.api import app_install, proclist
+from tidevice3.api import proclist
 from tidevice3.cli.cli_common import cli, pass_rsd, pass_service_provider
+from tidevice3.cli.install import install, install_options
 from tidevice3.exceptions import FatalError
 from tidevice3.utils.common import print_dict_as_table
 
@@ -33,10 +34,12 @@ def app():
 
 @app.command("install")
 @click.argument("path_or_url")
-@pass_service_provider
-def cli_app_install(service_provider: LockdownClient, path_or_url: str):
+@install_options
+@click.pass_context
+def cli_app_install(ctx: click.Context, path_or_url: str, segments: int, all_devices: bool, parallel: int,
+                    stream: bool, skip_same: bool):
     """install given .ipa or url"""
-    app_install(service_provider, path_or_url)
+    install(ctx, path_or_url, segments, all_devices, parallel, stream, skip_same)
 
 
 @app.command("list")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 11:02:15 by codeskyblue
+"""
+
+from __future__ import annotations
+
+from typing import List, Optional
+
+import click
+
+from tidevice3.cli.cli_common import cli
+from tidevice3.utils.cache import CacheEntry, DownloadCache
+from tidevice3.utils.common import byte2humansize, print_dict_as_table
+
+
+@cli.group()
+@click.option("--dir", "cache_dir", default=None, type=click.Path(file_okay=False), help="cache directory")
+@click.pass_context
+def cache(ctx: click.Context, cache_dir: str):
+    """download cache for installed ipa"""
+    ctx.ensure_object(dict)
+    ctx.obj["cache_dir"] = cache_dir
+
+
+def get_download_cache(ctx: click.Context) -> DownloadCache:
+    return DownloadCache(ctx.obj["cache_dir"])
+
+
+def print_entries(download_cache: DownloadCache, entries: List[CacheEntry]):
+    rows = []
+    for entry in entries:
+        rows.append({
+            "SHA256": entry.sha256[:12],
+            "Size": byte2humansize(entry.size),
+            "LastUsed": entry.last_used.strftime("%Y-%m-%d %H:%M:%S"),
+            "BundleID": entry.bundle_id or "",
+            "Version": f"{entry.short_version}({entry.version})" if entry.bundle_id else "",
+            "Filename": entry.filename,
+            "URL": ", ".join(download_cache.urls(entry.sha256)),
+        })
+    print_dict_as_table(rows, ["SHA256", "Size", "LastUsed", "BundleID", "Version", "Filename", "URL"])
+
+
+@cache.command("list")
+@click.pass_context
+def cache_list(ctx: click.Context):
+    """list cached files, most recently used first"""
+    download_cache = get_download_cache(ctx)
+    print_entries(download_cache, download_cache.entries())
+
+
+@cache.command("find")
+@click.argument("bundle_id")
+@click.argument("version", required=False)
+@click.option("--path", "path_only", is_flag=True, help="print file path only")
+@click.pass_context
+def cache_find(ctx: click.Context, bundle_id: str, version: Optional[str], path_only: bool):
+    """find cached ipa by bundle id and version (CFBundleShortVersionString or CFBundleVersion)"""
+    download_cache = get_download_cache(ctx)
+    entries = download_cache.find(bundle_id, version)
+    if path_only:
+        for entry in entries:
+            click.echo(entry.path)
+    else:
+        print_entries(download_cache, entries)
+
+
+@cache.command("info")
+@click.pass_context
+def cache_info(ctx: click.Context):
+    """show cache directory and usage"""
+    download_cache = get_download_cache(ctx)
+    click.echo(f"Directory: {download_cache.root}")
+    click.echo(f"Files: {len(download_cache.entries())}")
+    click.echo(f"Used: {byte2humansize(download_cache.total_bytes())} / {byte2humansize(download_cache.max_bytes)}")
+
+
+@cache.command("prune")
+@click.option("--max-bytes", type=click.IntRange(min=0), default=None, help="byte budget, default T3_CACHE_MAX_BYTES")
+@click.option("-a", "--all", "remove_all", is_flag=True, help="remove all cached files")
+@click.pass_context
+def cache_prune(ctx: click.Context, max_bytes: int, remove_all: bool):
+    """evict least recently used files"""
+    download_cache = get_download_cache(ctx)
+    if remove_all:
+        removed = download_cache.prune(max_bytes=0, grace_seconds=0)
+    else:
+        removed = download_cache.prune(max_bytes=max_bytes)
+    for entry in removed:
+        click.echo(f"removed {entry.filename} {entry.sha256[:12]} {byte2humansize(entry.size)}")
+    click.echo(f"Used: {byte2humansize(download_cache.total_bytes())}")
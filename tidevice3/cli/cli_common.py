@@ -56,6 +56,6 @@ def pass_rsd(func):
     return update_wrapper(new_func, func)
 
 
-CLI_GROUPS = ["list", "info", "developer", "screenshot", "screenrecord", "install", "fsync", "app", "reboot", "tunneld", "runwda", "relay", "exec"]
+CLI_GROUPS = ["list", "info", "developer", "screenshot", "screenrecord", "screenstream", "install", "cache", "fsync", "app", "reboot", "tunneld", "runwda", "relay", "exec"]
 for group in CLI_GROUPS:
     __import__(f"tidevice3.cli.{group}")
@@ -7,32 +7,43 @@
 from __future__ import annotations
 
 import datetime
+import functools
+import json
 import pathlib
 import posixpath
+import time
 from functools import update_wrapper
-from typing import List
+from typing import List, Optional, Tuple
 
 import click
-from pydantic import BaseModel
-from pymobiledevice3.exceptions import AfcException, AfcFileNotFoundError
+from pymobiledevice3.exceptions import AfcFileNotFoundError
 from pymobiledevice3.lockdown import LockdownClient
 from pymobiledevice3.services.afc import AfcService
 from pymobiledevice3.services.house_arrest import HouseArrestService
 
 from tidevice3.cli.cli_common import cli, pass_service_provider
 from tidevice3.exceptions import FatalError
+from tidevice3.utils.afc import DEFAULT_CHUNK_SIZE, DEFAULT_SESSIONS, AfcPool, FileInfo, FindFilter, TransferStats, \
+    disk_usage, find, pull_file, pull_tree, push_file, push_tree, stat_file, walk_tree
+from tidevice3.utils.archive import archive_tree, restore_tree
+from tidevice3.utils.common import byte2humansize, humansize2byte
+from tidevice3.utils.sync import Manifest, sync_pull, sync_push
+
+
+def make_afc(service_provider: LockdownClient, bundle_id: str, documents: bool) -> AfcService:
+    if bundle_id:
+        return HouseArrestService(lockdown=service_provider, bundle_id=bundle_id, documents_only=documents)
+    return AfcService(lockdown=service_provider)
 
 
 def pass_afc(func):
     @pass_service_provider
     @click.pass_context
     def new_func(ctx: click.Context, service_provider: LockdownClient, *args, **kwargs):
-        if ctx.obj['bundle_id']:
-            afc = HouseArrestService(lockdown=service_provider,
-                                     bundle_id=ctx.obj['bundle_id'],
-                                     documents_only=ctx.obj["documents"])
-        else:
-            afc = AfcService(lockdown=service_provider)
+        factory = functools.partial(make_afc, service_provider, ctx.obj['bundle_id'], ctx.obj["documents"])
+        # more sessions for parallel transfer, see open_afc_pool
+        ctx.obj["afc_factory"] = factory
+        afc = factory()
         
         with afc:
             try:
@@ -42,6 +53,20 @@ def pass_afc(func):
     return update_wrapper(new_func, func)
 
 
+def open_afc_pool(afc: AfcService, sessions: int) -> AfcPool:
+    """ pool starts with the session of pass_afc, other sessions are opened when needed """
+    return AfcPool(click.get_current_context().obj["afc_factory"], sessions, afc)
+
+
+def echo_transfer_stats(action: str, stats: TransferStats, err: bool = False):
+    click.echo(f"{action} {stats.files} files, {byte2humansize(stats.bytes)} in {stats.elapsed:.1f}s, "
+               f"{byte2humansize(int(stats.bytes_per_second))}/s, {stats.files_per_second:.1f} files/s", err=err)
+    if stats.errors:
+        for path, error in stats.errors:
+            click.echo(f"failed: {path}: {error}", err=True)
+        raise FatalError(f"{len(stats.errors)} files failed")
+
+
 @cli.group()
 @click.option("-B", "--bundle-id", help="bundle id of app")
 @click.option('--documents', is_flag=True)
@@ -54,25 +79,130 @@ def fsync(ctx: click.Context, bundle_id: str, documents: bool):
 
 
 
+def echo_walk_error(path: str, e: Exception):
+    click.echo(f"{path}: {e}", err=True)
+
+
+LS_SORT_KEYS = {
+    "mtime": lambda item: (item[1].is_dir(), item[1].mtime),
+    "name": lambda item: item[0],
+    "size": lambda item: item[1].size,
+}
+
+
 @fsync.command(name="ls")
 @click.argument("remote_path", required=True)
 @click.option('-r', '--recursive', is_flag=True)
+@click.option("--sort", type=click.Choice(["mtime", "name", "size", "none"]), default=None,
+              help="sort entries, default mtime (directories first), none when --recursive; "
+                   "unsorted entries are printed as soon as they are stat")
+@click.option("--json", "ndjson", is_flag=True, help="output one json object per line")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1),
+              help="parallel AFC sessions")
 @pass_afc
-def list(afc: AfcService, remote_path: str, recursive: bool):
+def list(afc: AfcService, remote_path: str, recursive: bool, sort: Optional[str], ndjson: bool, jobs: int):
     """ perform a dirlist rooted at /var/mobile/Media """
-    items: List[FileInfo] = []
-    for name in afc.listdir(remote_path):
-        try:
-            file_info = stat_file(afc, posixpath.join(remote_path, name))
-            items.append(file_info)
-        except AfcException as e:
-            pass
-    items.sort(key=lambda x: [x.is_dir(), x.mtime], reverse=True)
-    for item in items:
-        name = item.name + ("/" if item.is_dir() else "")
+    if sort is None:
+        sort = "none" if recursive else "mtime"
+
+    def echo(path: str, item: FileInfo):
+        if ndjson:
+            click.echo(json.dumps({"path": path, **item.model_dump(mode="json")}))
+            return
+        name = (posixpath.relpath(path, remote_path) if recursive else item.name) + ("/" if item.is_dir() else "")
         size = byte2humansize(item.size)
         click.echo(f"{item.ifmt[2:]}\t{size}\t{name}")
 
+    top = stat_file(afc, remote_path)
+    if not top.is_dir():
+        echo(remote_path, top)
+        return
+    items: List[Tuple[str, FileInfo]] = []
+    with open_afc_pool(afc, jobs) as pool:
+        for path, item in walk_tree(pool, remote_path, jobs, echo_walk_error, max_depth=None if recursive else 1):
+            if sort == "none":
+                echo(path, item)
+            else:
+                items.append((path, item))
+    items.sort(key=LS_SORT_KEYS.get(sort, LS_SORT_KEYS["name"]), reverse=sort in ("mtime", "size"))
+    for path, item in items:
+        echo(path, item)
+
+
+def parse_size(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return humansize2byte(value)
+    except ValueError:
+        raise click.BadParameter(f"invalid size {value!r}, e.g. 100K, 10M")
+
+
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_time(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[datetime.datetime]:
+    """ age like 30m, 2h, 7d (before now), or date like 2024-01-31 """
+    if value is None:
+        return None
+    if value[-1:] in TIME_UNITS:
+        try:
+            seconds = float(value[:-1]) * TIME_UNITS[value[-1]]
+            return datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+        except ValueError:
+            pass
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter(f"invalid time {value!r}, e.g. 2h, 7d, 2024-01-31")
+
+
+@fsync.command(name="du")
+@click.argument("remote_path", default="/")
+@click.option("-d", "--max-depth", default=1, type=click.IntRange(min=0), show_default=True,
+              help="report directories down to this depth")
+@click.option("--exclude", multiple=True, help="glob of directory names to skip")
+@click.option("--json", "ndjson", is_flag=True, help="output one json object per line")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1), help="parallel AFC sessions")
+@pass_afc
+def afc_du(afc: AfcService, remote_path: str, max_depth: int, exclude: Tuple[str, ...], ndjson: bool, jobs: int):
+    """ total size of files under each directory """
+    find_filter = FindFilter(exclude=exclude)
+    with open_afc_pool(afc, jobs) as pool:
+        totals = disk_usage(pool, remote_path, jobs, max_depth, echo_walk_error, find_filter.prune)
+    for path, size in sorted(totals.items(), key=lambda item: item[0].count("/"), reverse=True):
+        if ndjson:
+            click.echo(json.dumps({"path": path, "size": size}))
+        else:
+            click.echo(f"{byte2humansize(size)}\t{path}")
+
+
+@fsync.command(name="find")
+@click.argument("remote_path", default="/")
+@click.option("--name", help="glob of file name, e.g. '*.jpg'")
+@click.option("--type", "ifmt", type=click.Choice(["f", "d", "l"]), help="file, directory or symbolic link")
+@click.option("--min-size", callback=parse_size, help="e.g. 10M")
+@click.option("--max-size", callback=parse_size, help="e.g. 1G")
+@click.option("--newer", callback=parse_time, help="modified after, e.g. 2h, 7d, 2024-01-31")
+@click.option("--older", callback=parse_time, help="modified before, e.g. 30d, 2024-01-31")
+@click.option("--max-depth", type=click.IntRange(min=1), default=None, help="descend at most this depth")
+@click.option("--exclude", multiple=True, help="glob of directory names to skip")
+@click.option("--json", "ndjson", is_flag=True, help="output one json object per line")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1), help="parallel AFC sessions")
+@pass_afc
+def afc_find(afc: AfcService, remote_path: str, name: Optional[str], ifmt: Optional[str], min_size: Optional[int],
+             max_size: Optional[int], newer: Optional[datetime.datetime], older: Optional[datetime.datetime],
+             max_depth: Optional[int], exclude: Tuple[str, ...], ndjson: bool, jobs: int):
+    """ search files by name, type, size and mtime, printed as soon as found """
+    find_filter = FindFilter(name=name, ifmt={"f": "S_IFREG", "d": "S_IFDIR", "l": "S_IFLNK", None: None}[ifmt],
+                             min_size=min_size, max_size=max_size, newer=newer, older=older, exclude=exclude)
+    with open_afc_pool(afc, jobs) as pool:
+        for path, item in find(pool, remote_path, find_filter, jobs, max_depth, echo_walk_error):
+            if ndjson:
+                click.echo(json.dumps({"path": path, **item.model_dump(mode="json")}))
+            else:
+                click.echo(path)
+
 
 @fsync.command(name="rm")
 @click.argument("path", default="/")
@@ -83,27 +213,54 @@ def remove(afc: AfcService, path: str):
     click.echo(path)
 
 
+def chunk_size_option(func):
+    return click.option("--chunk-size", default=DEFAULT_CHUNK_SIZE, type=click.IntRange(min=1),
+                        show_default=True, help="bytes read or written per AFC request")(func)
+
+
 @fsync.command(name="push")
-@click.argument('local_file', type=click.File('rb'))
+@click.argument('local_file', type=click.Path(exists=True, allow_dash=True, path_type=pathlib.Path))
 @click.argument('remote_file', type=click.Path(exists=False))
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1),
+              help="parallel AFC sessions, used when local_file is a directory")
+@chunk_size_option
 @pass_afc
-def afc_push(afc: AfcService, local_file, remote_file):
-    """ push local file into /var/mobile/Media """
-    finfo = stat_file(afc, remote_file)
-    if finfo.is_dir():
-        remote_file = posixpath.join(remote_file, local_file.name)
-    afc.set_file_contents(remote_file, local_file.read())
+def afc_push(afc: AfcService, local_file: pathlib.Path, remote_file, jobs: int, chunk_size: int):
+    """ push local file or directory into /var/mobile/Media, - for stdin """
+    try:
+        if stat_file(afc, remote_file).is_dir():
+            if str(local_file) == "-":
+                raise click.BadParameter("remote_file should be a file path when pushing stdin")
+            remote_file = posixpath.join(remote_file, local_file.resolve().name)
+    except AfcFileNotFoundError:
+        pass
+    if local_file.is_dir():
+        with open_afc_pool(afc, jobs) as pool:
+            stats = push_tree(pool, local_file, remote_file, jobs, chunk_size)
+        click.echo(f"local:{local_file} -> remote:{remote_file}")
+        echo_transfer_stats("pushed", stats)
+        return
+    start = time.time()
+    with click.open_file(str(local_file), "rb") as f:
+        size = push_file(afc, f, remote_file, chunk_size)
+    click.echo(f"local:{local_file} -> remote:{remote_file}")
+    echo_transfer_stats("pushed", TransferStats(files=1, bytes=size, elapsed=time.time() - start))
 
 
 @fsync.command('pull')
 @click.option("-f", "--force", is_flag=True, help="force overwrite")
+@click.option("-r", "--recursive", is_flag=True, help="pull directory")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1),
+              help="parallel AFC sessions, used with --recursive")
 @click.argument('remote_file', type=click.Path(exists=False))
 @click.argument('local_file', default="./", type=click.Path(exists=False, path_type=pathlib.Path))
+@chunk_size_option
 @pass_afc
-def afc_pull(afc: AfcService, remote_file, local_file: pathlib.Path, force: bool):
+def afc_pull(afc: AfcService, remote_file, local_file: pathlib.Path, force: bool, recursive: bool, jobs: int,
+             chunk_size: int):
     """ pull remote file from /var/mobile/Media """
     if local_file.is_dir():
-        local_file /= posixpath.basename(remote_file)
+        local_file /= posixpath.basename(remote_file.rstrip("/")) or "Media"
     
     if local_file.exists():
         if not force:
@@ -113,52 +270,77 @@ def afc_pull(afc: AfcService, remote_file, local_file: pathlib.Path, force: bool
     
     finfo = stat_file(afc, remote_file)
     if finfo.is_dir():
-        raise click.BadParameter("remote_file is a directory")
-    local_file.write_bytes(afc.get_file_contents(remote_file))
+        if not recursive:
+            raise click.BadParameter("remote_file is a directory, use -r to pull directory")
+        with open_afc_pool(afc, jobs) as pool:
+            stats = pull_tree(pool, remote_file, local_file, jobs, chunk_size)
+        click.echo(f"remote:{remote_file} -> local:{local_file}")
+        echo_transfer_stats("pulled", stats)
+        return
+    start = time.time()
+    size = pull_file(afc, remote_file, local_file, chunk_size, finfo.mtime)
     click.echo(f"remote:{remote_file} -> local:{local_file}")
+    echo_transfer_stats("pulled", TransferStats(files=1, bytes=size, elapsed=time.time() - start))
 
 
-class FileInfo(BaseModel):
-    name: str
-    size: int
-    mtime: datetime.datetime
-    ifmt: str
-
-    def is_dir(self) -> bool:
-        return self.ifmt == "S_IFDIR"
-
-
-def stat2fileinfo(info: dict) -> FileInfo:
-    # {'st_size': 326, 'st_blocks': 8, 'st_nlink': 1, 'st_ifmt': 'S_IFREG',
-    #  'st_mtime': datetime.datetime(2023, 7, 7, 18, 55, 10, 755297),
-    #  'st_birthtime': datetime.datetime(2023, 7, 7, 18, 55, 10, 754835),
-    #  'st_name': 'com.apple.ibooks-sync.plist'}
-    return FileInfo(
-        name=info["st_name"],
-        size=info["st_size"],
-        ifmt=info["st_ifmt"],
-        mtime=info["st_mtime"],
-    )
+@fsync.command("sync")
+@click.argument("local_dir", type=click.Path(file_okay=False, path_type=pathlib.Path))
+@click.argument("remote_dir")
+@click.option("--pull", is_flag=True, help="copy from device to local_dir, default from local_dir to device")
+@click.option("-c", "--checksum", is_flag=True, help="compare sha256 of content instead of size and mtime")
+@click.option("--delete", is_flag=True, help="delete extraneous files from destination")
+@click.option("-n", "--dry-run", is_flag=True, help="only show what would be transferred")
+@click.option("--no-manifest", is_flag=True, help="ignore the manifest of last sync, stat every remote file")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1), help="parallel AFC sessions")
+@chunk_size_option
+@pass_afc
+def afc_sync(afc: AfcService, local_dir: pathlib.Path, remote_dir: str, pull: bool, checksum: bool, delete: bool,
+             dry_run: bool, no_manifest: bool, jobs: int, chunk_size: int):
+    """ transfer changed files only, between local_dir and remote_dir """
+    ctx = click.get_current_context()
+    namespace = f"{ctx.obj['bundle_id']}:{ctx.obj['documents']}" if ctx.obj['bundle_id'] else ""
+    manifest = Manifest.for_device(afc.lockdown.udid, remote_dir, namespace)
+    if no_manifest:
+        manifest.entries = {}
 
+    def on_change(action: str, rel: str):
+        click.echo(f"{action}\t{rel}")
 
-def stat_file(afc: AfcService, path: str) -> FileInfo:
-    info = afc.stat(path)
-    info['st_name'] = posixpath.basename(path)
-    return stat2fileinfo(info)
+    with open_afc_pool(afc, jobs) as pool:
+        if pull:
+            result = sync_pull(pool, remote_dir, local_dir, manifest, checksum, delete, dry_run, jobs, chunk_size,
+                               on_change)
+        else:
+            if not local_dir.is_dir():
+                raise click.BadParameter(f"local_dir {local_dir} is not a directory")
+            result = sync_push(pool, local_dir, remote_dir, manifest, checksum, delete, dry_run, jobs, chunk_size,
+                               on_change)
+    click.echo(f"{result.skipped} unchanged, {len(result.deleted)} deleted")
+    echo_transfer_stats("pulled" if pull else "pushed", result)
 
 
-def byte2humansize(num_bytes):
-    """
-    Convert a size in bytes to a more human-readable format.
+@fsync.command("archive")
+@click.argument("remote_dir")
+@click.option("-o", "--output", type=click.File("wb", lazy=True), required=True, help="tar file, - for stdout")
+@click.option("-j", "--jobs", default=DEFAULT_SESSIONS, type=click.IntRange(min=1), help="parallel AFC sessions")
+@chunk_size_option
+@pass_afc
+def afc_archive(afc: AfcService, remote_dir: str, output, jobs: int, chunk_size: int):
+    """ export remote_dir as tar, e.g. t3 fsync archive / -o - | zstd > backup.tar.zst """
+    if not stat_file(afc, remote_dir).is_dir():
+        raise click.BadParameter(f"{remote_dir} is not a directory")
+    with open_afc_pool(afc, jobs) as pool, output:
+        stats = archive_tree(pool, remote_dir, output, jobs, chunk_size)
+    echo_transfer_stats("archived", stats, err=True)
 
-    :param num_bytes: Size in bytes.
-    :return: Human-readable size.
-    """
-    if num_bytes < 1024.0:
-        return f"{num_bytes}"
-    for unit in ['K', 'M', 'G', 'T', 'P', 'E', 'Z']:
-        num_bytes /= 1024.0
-        if num_bytes < 1024.0:
-            return f"{num_bytes:3.1f}{unit}"
-    return f"{num_bytes:.1f}Y"
 
+@fsync.command("restore")
+@click.argument("remote_dir")
+@click.option("-i", "--input", "input_file", type=click.File("rb"), required=True,
+              help="tar file (optionally gz, bz2, xz compressed), - for stdin")
+@chunk_size_option
+@pass_afc
+def afc_restore(afc: AfcService, remote_dir: str, input_file, chunk_size: int):
+    """ extract tar into remote_dir, e.g. zstd -dc backup.tar.zst | t3 fsync restore / -i - """
+    stats = restore_tree(afc, input_file, remote_dir, chunk_size)
+    echo_transfer_stats("restored", stats)
@@ -4,16 +4,108 @@
 """Created on Tue Feb 27 2024 10:05:20 by codeskyblue
 """
 
+from __future__ import annotations
+
+import logging
+import sys
+from typing import Optional
+
 import click
-from pymobiledevice3.lockdown import LockdownClient
 
-from tidevice3.api import app_install
-from tidevice3.cli.cli_common import cli, pass_rsd, pass_service_provider
+from tidevice3.api import app_install, app_install_all, connect_service_provider
+from tidevice3.cli.cli_common import cli
+from tidevice3.exceptions import FatalError
+from tidevice3.utils.common import byte2humansize, print_dict_as_table
+from tidevice3.utils.download import DownloadProgress, is_hyperlink
+
+logger = logging.getLogger(__name__)
+
+
+def install_options(func):
+    func = click.option("--skip-same", is_flag=True,
+                        help="skip when the same build is already installed")(func)
+    func = click.option("--stream", is_flag=True,
+                        help="upload url to device while downloading, without saving to local disk, url only")(func)
+    func = click.option("--parallel", default=8, type=click.IntRange(min=1),
+                        help="max devices installed at the same time, used with --all")(func)
+    func = click.option("-a", "--all", "all_devices", is_flag=True, help="install to all connected usb devices")(func)
+    func = click.option("-j", "--segments", default=1, type=click.IntRange(min=1),
+                        help="parallel download connections for url")(func)
+    return func
+
+
+class DownloadProgressBar:
+    """ render DownloadProgress as a single line progress bar on stderr """
+    width = 30
+
+    def __call__(self, progress: DownloadProgress):
+        if progress.phase == "done":
+            click.echo("\r\033[K", nl=False, err=True)
+            if progress.status == "downloaded":
+                click.echo(f"downloaded {byte2humansize(progress.bytes_done)} in {progress.elapsed:.1f}s, "
+                           f"{byte2humansize(int(progress.rate))}/s (connect {progress.connect_time or 0:.2f}s, "
+                           f"ttfb {progress.ttfb or 0:.2f}s)", err=True)
+            return
+        if progress.phase != "transfer":
+            return
+        if progress.total_bytes:
+            filled = self.width * progress.bytes_done // progress.total_bytes
+            bar = "[" + "#" * filled + "-" * (self.width - filled) + "]"
+            done = f"{byte2humansize(progress.bytes_done)}/{byte2humansize(progress.total_bytes)}"
+        else:
+            bar, done = "", byte2humansize(progress.bytes_done)
+        eta = f" ETA {progress.eta:.0f}s" if progress.eta is not None else ""
+        click.echo(f"\r\033[Kdownload {bar} {done} {byte2humansize(int(progress.rate))}/s{eta}", nl=False, err=True)
+
+
+def get_download_progress() -> Optional[DownloadProgressBar]:
+    return DownloadProgressBar() if sys.stderr.isatty() else None
+
+
+def install(ctx: click.Context, path_or_url: str, segments: int, all_devices: bool, parallel: int, stream: bool,
+            skip_same: bool):
+    if stream and all_devices:
+        raise click.BadParameter("--stream can not be used with --all, the ipa is downloaded only once")
+    if stream and skip_same:
+        raise click.BadParameter("--stream can not be used with --skip-same, the ipa is required to read versions")
+    if stream and not is_hyperlink(path_or_url):
+        raise click.BadParameter("--stream can only be used with url, local file is installed directly")
+    usbmux_address = ctx.obj['usbmux_address']
+    if not all_devices:
+        service_provider = connect_service_provider(ctx.obj['udid'], force_usbmux=True, usbmux_address=usbmux_address)
+        with service_provider:
+            app_install(service_provider, path_or_url, segments=segments, stream=stream, skip_same=skip_same,
+                        download_progress=get_download_progress())
+        return
+
+    def progress(udid: str, completion: int):
+        logger.info("%s: %d%% Complete", udid, completion)
+
+    udids = [ctx.obj['udid']] if ctx.obj['udid'] else None
+    results = app_install_all(path_or_url, udids, max_workers=parallel, segments=segments,
+                              progress=progress, usbmux_address=usbmux_address, skip_same=skip_same,
+                              download_progress=get_download_progress())
+    rows = []
+    for result in results:
+        rows.append({
+            "Identifier": result.Identifier,
+            "Status": "failed" if not result.Success else "skipped" if result.Skipped else "ok",
+            "Elapsed": f"{result.Elapsed:.1f}s",
+            "Error": result.Error or "",
+        })
+    print_dict_as_table(rows, ["Identifier", "Status", "Elapsed", "Error"])
+    failed = [r for r in results if not r.Success]
+    if not results:
+        raise FatalError("No device connected")
+    if failed:
+        raise FatalError(f"install failed on {len(failed)} of {len(results)} devices")
 
 
 @cli.command("install")
 @click.argument("path_or_url")
-@pass_service_provider
-def cli_install(service_provider: LockdownClient, path_or_url: str):
+@install_options
+@click.pass_context
+def cli_install(ctx: click.Context, path_or_url: str, segments: int, all_devices: bool, parallel: int,
+                stream: bool, skip_same: bool):
     """install given .ipa or url, alias for app install"""
-    app_install(service_provider, path_or_url)
+    install(ctx, path_or_url, segments, all_devices, parallel, stream, skip_same)
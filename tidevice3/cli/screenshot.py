@@ -5,24 +5,51 @@
 """
 
 import logging
+import os
 import typing
+from typing import Optional, Tuple
 
 import click
 from pymobiledevice3.lockdown import LockdownClient
 
-from tidevice3.api import screenshot, screenshot_png
+from tidevice3.api import SCREENSHOT_FORMATS, decode_screenshot, encode_screenshot, screenshot_png
 from tidevice3.cli.cli_common import cli, pass_rsd
 
 logger = logging.getLogger(__name__)
 
+FORMAT_EXTENSIONS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp", ".rgb": "raw", ".raw": "raw"}
+
+
+def parse_image_size(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """ WIDTHxHEIGHT, or a single number for both """
+    if value is None:
+        return None
+    try:
+        width, _, height = value.lower().partition("x")
+        size = (int(width), int(height or width))
+    except ValueError:
+        size = (0, 0)
+    if min(size) <= 0:
+        raise click.BadParameter(f"invalid size {value!r}, e.g. 540x960, 720")
+    return size
+
 
 @cli.command("screenshot")
+@click.option("-f", "--format", "format", type=click.Choice(SCREENSHOT_FORMATS),
+              help="default by file extension, raw is RGB pixels row by row")
+@click.option("-s", "--size", callback=parse_image_size, help="max WIDTHxHEIGHT, aspect ratio is kept, e.g. 540x960")
+@click.option("-q", "--quality", default=85, show_default=True, help="jpeg and webp quality, 1-100")
 @click.argument("out", type=click.File("wb"))
 @pass_rsd
-def cli_screenshot(service_provider: LockdownClient, out: typing.BinaryIO):
+def cli_screenshot(service_provider: LockdownClient, out: typing.BinaryIO, format: Optional[str],
+                   size: Optional[Tuple[int, int]], quality: int):
     """get device screenshot"""
-    if out.name.endswith(".png"):
-        out.write(screenshot_png(service_provider))
+    ext = os.path.splitext(out.name)[1].lower()
+    if format is None:
+        # stdout has no extension, write png
+        format = FORMAT_EXTENSIONS.get(ext, "png" if not ext else None)
+    png_data = screenshot_png(service_provider)
+    if format is None:
+        decode_screenshot(png_data, size).save(out)
     else:
-        im = screenshot(service_provider)
-        im.save(out)
+        out.write(encode_screenshot(png_data, format, size, quality))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 23:59:16 by codeskyblue
+"""
+
+import logging
+from typing import Optional, Tuple
+
+import click
+import uvicorn
+from pymobiledevice3.lockdown import LockdownClient
+
+from tidevice3.api import ScreenshotSession
+from tidevice3.cli.cli_common import cli, pass_rsd
+from tidevice3.cli.screenshot import parse_image_size
+from tidevice3.utils.screenstream import DEFAULT_FPS, DEFAULT_QUALITY, ScreenBroadcaster, create_app
+
+logger = logging.getLogger(__name__)
+
+
+@cli.command("screenstream")
+@click.option("-p", "--port", default=8080, show_default=True, help="listen port")
+@click.option("--host", default="127.0.0.1", show_default=True, help="listen address, 0.0.0.0 for all")
+@click.option("--fps", default=DEFAULT_FPS, show_default=True, help="max capture rate, viewers can ask less by ?fps=N")
+@click.option("-q", "--quality", default=DEFAULT_QUALITY, show_default=True, help="jpeg quality, 1-100")
+@click.option("-s", "--size", callback=parse_image_size, help="max WIDTHxHEIGHT, e.g. 540x960")
+@pass_rsd
+def cli_screenstream(service_provider: LockdownClient, port: int, host: str, fps: int, quality: int,
+                     size: Optional[Tuple[int, int]]):
+    """ share screen over http: / (viewer), /stream.mjpeg, /screenshot.jpg, /stats """
+    broadcaster = ScreenBroadcaster(ScreenshotSession(service_provider), fps=fps, quality=quality, size=size)
+    broadcaster.start()
+    logger.info("screenstream on http://%s:%d/stream.mjpeg", host, port)
+    try:
+        uvicorn.run(create_app(broadcaster), host=host, port=port)
+    finally:
+        broadcaster.close()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 15:12:40 by codeskyblue
+"""
+
+from __future__ import annotations
+
+__all__ = ["AfcFile", "AfcPool", "FileInfo", "FindFilter", "TransferStats", "stat2fileinfo", "stat_file",
+           "walk_tree", "disk_usage", "find", "pull_file", "push_file", "pull_tree", "push_tree"]
+
+import contextlib
+import datetime
+import fnmatch
+import logging
+import os
+import pathlib
+import posixpath
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+from pymobiledevice3.exceptions import AfcException
+from pymobiledevice3.services.afc import AfcService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1 << 20  # 1 MB
+DEFAULT_SESSIONS = 4
+STAT_BATCH_SIZE = 32  # entries stat by one task, so that large directories are spread over sessions
+PULL_TMP_SUFFIX = ".t3part"  # pull_file writes here until the file is complete
+
+
+class AfcFile:
+    """
+    File object of a remote file opened through AFC, data is transferred chunk by chunk
+
+    Usage:
+        with AfcFile(afc, "/Downloads/a.txt", "w") as f:
+            f.write(b"hello")
+    """
+    def __init__(self, afc: AfcService, path: str, mode: str = "r"):
+        self.afc = afc
+        self.path = path
+        self.mode = mode
+        self._handle = afc.fopen(path, mode)
+
+    def read(self, size: int) -> bytes:
+        return self.afc.fread(self._handle, size)
+
+    def write(self, data: bytes) -> int:
+        self.afc.fwrite(self._handle, data)
+        return len(data)
+
+    def close(self):
+        if self._handle is not None:
+            self.afc.fclose(self._handle)
+            self._handle = None
+
+    def __enter__(self) -> AfcFile:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AfcPool:
+    """
+    AFC sessions shared by worker threads, a session is used by one thread at a time.
+    New sessions are opened on demand by factory, up to size.
+
+    Usage:
+        with AfcPool(lambda: AfcService(lockdown=service_provider), 4) as pool:
+            with pool.session() as afc:
+                afc.listdir("/")
+    """
+    def __init__(self, factory: Callable[[], AfcService], size: int = DEFAULT_SESSIONS,
+                 afc: Optional[AfcService] = None):
+        """
+        :param afc: an opened session to use first, it is not closed by the pool
+        """
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle: queue.LifoQueue[Optional[AfcService]] = queue.LifoQueue()
+        self._owned: List[AfcService] = []
+        self._count = 0
+        self._lock = threading.Lock()
+        if afc is not None:
+            self._idle.put(afc)
+            self._count = 1
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[AfcService]:
+        afc = self._acquire()
+        try:
+            yield afc
+        except AfcException:
+            self._idle.put(afc)
+            raise
+        except BaseException:
+            # connection may be broken, do not hand it out again
+            self._discard(afc)
+            raise
+        self._idle.put(afc)
+
+    def _acquire(self) -> AfcService:
+        while True:
+            try:
+                afc = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._count < self.size:
+                        # lockdown connection is not thread safe, services are started one by one
+                        afc = self.factory()
+                        self._owned.append(afc)
+                        self._count += 1
+                        return afc
+                afc = self._idle.get()
+            # None is put by _discard, a slot is free to open a new session
+            if afc is not None:
+                return afc
+
+    def _discard(self, afc: AfcService):
+        with self._lock:
+            self._count -= 1
+            if afc in self._owned:
+                self._owned.remove(afc)
+                with contextlib.suppress(Exception):
+                    afc.close()
+        # wake up a thread waiting for an idle session
+        self._idle.put(None)
+
+    def close(self):
+        with self._lock:
+            for afc in self._owned:
+                with contextlib.suppress(Exception):
+                    afc.close()
+            self._owned.clear()
+
+    def __enter__(self) -> AfcPool:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class FileInfo(BaseModel):
+    name: str
+    size: int
+    mtime: datetime.datetime
+    ifmt: str
+
+    def is_dir(self) -> bool:
+        return self.ifmt == "S_IFDIR"
+
+
+def stat2fileinfo(info: dict) -> FileInfo:
+    # {'st_size': 326, 'st_blocks': 8, 'st_nlink': 1, 'st_ifmt': 'S_IFREG',
+    #  'st_mtime': datetime.datetime(2023, 7, 7, 18, 55, 10, 755297),
+    #  'st_birthtime': datetime.datetime(2023, 7, 7, 18, 55, 10, 754835),
+    #  'st_name': 'com.apple.ibooks-sync.plist'}
+    return FileInfo(
+        name=info["st_name"],
+        size=info["st_size"],
+        ifmt=info["st_ifmt"],
+        mtime=info["st_mtime"],
+    )
+
+
+def stat_file(afc: AfcService, path: str) -> FileInfo:
+    info = afc.stat(path)
+    info['st_name'] = posixpath.basename(path)
+    return stat2fileinfo(info)
+
+
+class TransferStats(BaseModel):
+    files: int = 0
+    bytes: int = 0
+    elapsed: float = 0.0
+    errors: List[Tuple[str, str]] = []  # (path, error)
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def log_error(path: str, e: Exception):
+    logger.warning("%s: %s", path, e)
+
+
+def _list_dir(pool: AfcPool, path: str) -> List[str]:
+    with pool.session() as afc:
+        return afc.listdir(path)
+
+
+def _stat_batch(pool: AfcPool, paths: List[str],
+                on_error: Callable[[str, Exception], None]) -> List[Tuple[str, FileInfo]]:
+    entries = []
+    with pool.session() as afc:
+        for path in paths:
+            try:
+                entries.append((path, stat_file(afc, path)))
+            except AfcException as e:
+                on_error(path, e)
+    return entries
+
+
+def _depth(path: str) -> int:
+    return len([part for part in path.split("/") if part])
+
+
+def walk_tree(
+    pool: AfcPool, top: str, workers: int = DEFAULT_SESSIONS,
+    on_error: Callable[[str, Exception], None] = log_error,
+    cached: Optional[Dict[str, FileInfo]] = None, max_depth: Optional[int] = None,
+    prune: Optional[Callable[[str, FileInfo], bool]] = None
+) -> Iterator[Tuple[str, FileInfo]]:
+    """
+    Walk remote tree with several sessions, yield (path, FileInfo) of every entry under top
+    as soon as its stat returns. A directory is always yielded before its children,
+    otherwise the order is not defined. Symbolic links are not followed.
+
+    :param on_error: called with (path, exception) when listdir or stat failed, the entry is skipped
+    :param cached: path -> FileInfo from an earlier walk, listed entries found here are not stat again
+    :param max_depth: do not list directories deeper than this, entries directly under top are depth 1
+    :param prune: called with (path, FileInfo) of a directory, return True to skip it and its children
+    """
+    cached = cached or {}
+    top_depth = _depth(top)
+
+    def descend(path: str) -> bool:
+        return max_depth is None or _depth(path) - top_depth < max_depth
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # future -> (directory, True if listdir else stat)
+        pending: Dict[Future, Tuple[str, bool]] = {executor.submit(_list_dir, pool, top): (top, True)}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirpath, is_listdir = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except AfcException as e:
+                        on_error(dirpath, e)
+                        continue
+                    if is_listdir:
+                        paths = []
+                        for name in result:
+                            path = posixpath.join(dirpath, name)
+                            info = cached.get(path)
+                            if info is None:
+                                paths.append(path)
+                                continue
+                            if info.is_dir() and prune and prune(path, info):
+                                continue
+                            if info.is_dir() and descend(path):
+                                pending[executor.submit(_list_dir, pool, path)] = (path, True)
+                            yield path, info
+                        for i in range(0, len(paths), STAT_BATCH_SIZE):
+                            batch = paths[i:i + STAT_BATCH_SIZE]
+                            pending[executor.submit(_stat_batch, pool, batch, on_error)] = (dirpath, False)
+                        continue
+                    for path, info in result:
+                        if info.is_dir() and prune and prune(path, info):
+                            continue
+                        if info.is_dir() and descend(path):
+                            pending[executor.submit(_list_dir, pool, path)] = (path, True)
+                        yield path, info
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def disk_usage(
+    pool: AfcPool, top: str, workers: int = DEFAULT_SESSIONS, max_depth: Optional[int] = None,
+    on_error: Callable[[str, Exception], None] = log_error,
+    prune: Optional[Callable[[str, FileInfo], bool]] = None
+) -> Dict[str, int]:
+    """
+    Return directory -> total size of files under it (recursively), including top.
+    Only directories within max_depth are reported, the sizes still count the whole tree.
+    """
+    top = top.rstrip("/") or "/"
+    top_depth = _depth(top)
+    totals: Dict[str, int] = {top: 0}
+    for path, info in walk_tree(pool, top, workers, on_error, prune=prune):
+        depth = _depth(path) - top_depth
+        if info.is_dir():
+            if max_depth is None or depth <= max_depth:
+                totals.setdefault(path, 0)
+            continue
+        # add size to every reported ancestor
+        parent = posixpath.dirname(path)
+        while True:
+            if parent in totals:
+                totals[parent] += info.size
+            if parent == top or _depth(parent) <= top_depth:
+                break
+            parent = posixpath.dirname(parent)
+    return totals
+
+
+class FindFilter(BaseModel):
+    """ predicates of find, None means any """
+    name: Optional[str] = None  # glob of file name
+    ifmt: Optional[str] = None  # S_IFREG, S_IFDIR ...
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    newer: Optional[datetime.datetime] = None  # mtime after
+    older: Optional[datetime.datetime] = None  # mtime before
+    exclude: List[str] = []  # globs of directory names not to descend
+
+    def match(self, info: FileInfo) -> bool:
+        if self.name is not None and not fnmatch.fnmatch(info.name, self.name):
+            return False
+        if self.ifmt is not None and info.ifmt != self.ifmt:
+            return False
+        if self.min_size is not None and info.size < self.min_size:
+            return False
+        if self.max_size is not None and info.size > self.max_size:
+            return False
+        if self.newer is not None and info.mtime <= self.newer:
+            return False
+        if self.older is not None and info.mtime >= self.older:
+            return False
+        return True
+
+    def prune(self, path: str, info: FileInfo) -> bool:
+        return any(fnmatch.fnmatch(info.name, pattern) for pattern in self.exclude)
+
+
+def find(
+    pool: AfcPool, top: str, find_filter: FindFilter, workers: int = DEFAULT_SESSIONS,
+    max_depth: Optional[int] = None, on_error: Callable[[str, Exception], None] = log_error
+) -> Iterator[Tuple[str, FileInfo]]:
+    """ yield (path, FileInfo) matching find_filter as soon as found, excluded directories are not listed """
+    for path, info in walk_tree(pool, top, workers, on_error, max_depth=max_depth, prune=find_filter.prune):
+        if find_filter.match(info):
+            yield path, info
+
+
+def pull_file(afc: AfcService, remote_path: str, local_path: pathlib.Path, chunk_size: int = DEFAULT_CHUNK_SIZE,
+              mtime: Optional[datetime.datetime] = None) -> int:
+    """
+    Copy remote file to local_path chunk by chunk, return number of bytes
+
+    :param mtime: set as modification time of local file
+    """
+    size = 0
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    # written aside and renamed when complete, a failed pull never leaves a truncated local_path
+    tmp_path = local_path.with_name(local_path.name + PULL_TMP_SUFFIX)
+    try:
+        with AfcFile(afc, remote_path, "r") as rf, tmp_path.open("wb") as f:
+            while True:
+                chunk = rf.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+        if mtime is not None:
+            os.utime(tmp_path, (mtime.timestamp(), mtime.timestamp()))
+        os.replace(tmp_path, local_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return size
+
+
+def push_file(afc: AfcService, fileobj: BinaryIO, remote_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """ copy local file object to remote_path chunk by chunk, return number of bytes """
+    size = 0
+    with AfcFile(afc, remote_path, "w") as wf:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            wf.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def pull_tree(
+    pool: AfcPool, remote_dir: str, local_dir: pathlib.Path, workers: int = DEFAULT_SESSIONS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE, on_file: Optional[Callable[[str, pathlib.Path], None]] = None
+) -> TransferStats:
+    """
+    Copy remote directory into local_dir. Files are transferred by several sessions at the same time,
+    a failed file is recorded in TransferStats.errors and does not stop the others.
+
+    :param on_file: called with (remote_path, local_path) after each file pulled
+    """
+    stats = TransferStats()
+    lock = threading.Lock()
+    start = time.time()
+
+    def on_error(path: str, e: Exception):
+        log_error(path, e)
+        with lock:
+            stats.errors.append((path, str(e)))
+
+    def pull(remote_path: str, local_path: pathlib.Path, info: FileInfo):
+        try:
+            with pool.session() as afc:
+                size = pull_file(afc, remote_path, local_path, chunk_size, info.mtime)
+        except (AfcException, OSError) as e:
+            on_error(remote_path, e)
+            return
+        with lock:
+            stats.files += 1
+            stats.bytes += size
+        if on_file:
+            on_file(remote_path, local_path)
+
+    local_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for remote_path, info in walk_tree(pool, remote_dir, workers, on_error):
+            local_path = local_dir.joinpath(*posixpath.relpath(remote_path, remote_dir).split("/"))
+            if info.is_dir():
+                local_path.mkdir(parents=True, exist_ok=True)
+            elif info.ifmt == "S_IFREG":
+                futures.append(executor.submit(pull, remote_path, local_path, info))
+            else:
+                logger.debug("skip %s %s", info.ifmt, remote_path)
+        for future in futures:
+            future.result()
+    stats.elapsed = time.time() - start
+    return stats
+
+
+def push_tree(
+    pool: AfcPool, local_dir: pathlib.Path, remote_dir: str, workers: int = DEFAULT_SESSIONS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE, on_file: Optional[Callable[[pathlib.Path, str], None]] = None
+) -> TransferStats:
+    """
+    Copy local directory to remote_dir. All remote directories are created first in one pass,
+    then files are uploaded by several sessions at the same time.
+    A failed file is recorded in TransferStats.errors and does not stop the others.
+
+    :param on_file: called with (local_path, remote_path) after each file pushed
+    """
+    stats = TransferStats()
+    lock = threading.Lock()
+    start = time.time()
+
+    def on_error(path: str, e: Exception):
+        log_error(path, e)
+        with lock:
+            stats.errors.append((path, str(e)))
+
+    def push(local_path: pathlib.Path, remote_path: str):
+        try:
+            with local_path.open("rb") as f, pool.session() as afc:
+                size = push_file(afc, f, remote_path, chunk_size)
+        except (AfcException, OSError) as e:
+            on_error(str(local_path), e)
+            return
+        with lock:
+            stats.files += 1
+            stats.bytes += size
+        if on_file:
+            on_file(local_path, remote_path)
+
+    remote_dirs = [remote_dir]
+    files: List[Tuple[pathlib.Path, str]] = []
+    for dirpath, dirnames, filenames in os.walk(local_dir):
+        rel_dir = pathlib.Path(dirpath).relative_to(local_dir).as_posix()
+        remote_parent = posixpath.normpath(posixpath.join(remote_dir, rel_dir))
+        remote_dirs.extend(posixpath.join(remote_parent, name) for name in dirnames)
+        files.extend((pathlib.Path(dirpath, name), posixpath.join(remote_parent, name)) for name in filenames)
+
+    # parents before children, files can be uploaded in any order then
+    with pool.session() as afc:
+        for path in remote_dirs:
+            afc.makedirs(path)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(push, local_path, remote_path) for local_path, remote_path in files]
+        for future in futures:
+            future.result()
+    stats.elapsed = time.time() - start
+    return stats
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 22:35:09 by codeskyblue
+
+Export a remote directory as a tar stream and restore it, file data never held in memory
+"""
+
+from __future__ import annotations
+
+__all__ = ["archive_tree", "restore_tree"]
+
+import logging
+import posixpath
+import tarfile
+import time
+from typing import BinaryIO, Callable, Optional
+
+from pymobiledevice3.exceptions import AfcException
+from pymobiledevice3.services.afc import AfcService
+
+from tidevice3.utils.afc import DEFAULT_CHUNK_SIZE, DEFAULT_SESSIONS, AfcFile, AfcPool, TransferStats, log_error, \
+    push_file, walk_tree
+
+logger = logging.getLogger(__name__)
+
+
+def archive_tree(
+    pool: AfcPool, remote_dir: str, fileobj: BinaryIO, workers: int = DEFAULT_SESSIONS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE, on_file: Optional[Callable[[str], None]] = None
+) -> TransferStats:
+    """
+    Write remote directory to fileobj as an uncompressed tar stream, member names are relative to remote_dir.
+    The tree is listed by several sessions, file data is copied chunk by chunk.
+    Entries failed to read are recorded in TransferStats.errors, and the archive goes on.
+    """
+    stats = TransferStats()
+    start = time.time()
+
+    def on_error(path: str, e: Exception):
+        log_error(path, e)
+        stats.errors.append((path, str(e)))
+
+    with tarfile.open(fileobj=fileobj, mode="w|", copybufsize=chunk_size) as tar:
+        for path, info in walk_tree(pool, remote_dir, workers, on_error):
+            tarinfo = tarfile.TarInfo(posixpath.relpath(path, remote_dir))
+            tarinfo.mtime = int(info.mtime.timestamp())
+            if info.is_dir():
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+                tar.addfile(tarinfo)
+                continue
+            if info.ifmt != "S_IFREG":
+                logger.debug("skip %s %s", info.ifmt, path)
+                continue
+            tarinfo.size = info.size
+            tarinfo.mode = 0o644
+            with pool.session() as afc:
+                try:
+                    f = AfcFile(afc, path, "r")
+                except AfcException as e:
+                    on_error(path, e)
+                    continue
+                # once the header is written, a read error breaks the stream and is raised
+                with f:
+                    tar.addfile(tarinfo, f)
+            stats.files += 1
+            stats.bytes += info.size
+            if on_file:
+                on_file(path)
+    stats.elapsed = time.time() - start
+    return stats
+
+
+def restore_tree(
+    afc: AfcService, fileobj: BinaryIO, remote_dir: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_file: Optional[Callable[[str], None]] = None
+) -> TransferStats:
+    """
+    Extract tar stream (optionally gzip, bz2 or xz compressed) from fileobj into remote_dir.
+    Members are read in order and pushed chunk by chunk. Links and members outside remote_dir are skipped.
+    """
+    stats = TransferStats()
+    start = time.time()
+    afc.makedirs(remote_dir)
+    with tarfile.open(fileobj=fileobj, mode="r|*", copybufsize=chunk_size) as tar:
+        for member in tar:
+            name = posixpath.normpath(member.name)
+            if name.startswith("/") or name == ".." or name.startswith("../"):
+                logger.warning("skip unsafe member: %s", member.name)
+                continue
+            remote_path = posixpath.join(remote_dir, name)
+            if member.isdir():
+                afc.makedirs(remote_path)
+            elif member.isfile():
+                afc.makedirs(posixpath.dirname(remote_path))
+                try:
+                    push_file(afc, tar.extractfile(member), remote_path, chunk_size)
+                except AfcException as e:
+                    log_error(remote_path, e)
+                    stats.errors.append((remote_path, str(e)))
+                    continue
+                stats.files += 1
+                stats.bytes += member.size
+                if on_file:
+                    on_file(remote_path)
+            else:
+                logger.warning("skip %s, only files and directories are restored", member.name)
+    stats.elapsed = time.time() - start
+    return stats
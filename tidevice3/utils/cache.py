@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 10:21:37 by codeskyblue
+
+Download cache, files are stored by content hash
+
+Layout:
+    <root>/index.db                 sqlite index, url -> sha256 -> blob -> bundle id and versions,
+                                    and ipa installed on devices
+    <root>/blobs/<sha256>/<name>    downloaded files, one per content
+    <root>/tmp/<url-key>/download   unfinished downloads
+    <root>/locks/                   cross-process lock files
+"""
+
+from __future__ import annotations
+
+__all__ = ["DownloadCache", "CacheEntry", "InstallRecord", "DEFAULT_CACHE_DIR", "DEFAULT_CACHE_MAX_BYTES"]
+
+import contextlib
+import datetime
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from tidevice3.exceptions import FatalError
+from tidevice3.utils.common import FileLock
+from tidevice3.utils.ipa import IPAInfo, read_ipa_info
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = pathlib.Path(
+    os.environ.get("T3_CACHE_DIR") or pathlib.Path.home() / ".cache" / "tidevice3"
+)
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("T3_CACHE_MAX_BYTES") or 10 << 30)  # 10 GB
+# files used recently may still be read by other process, never evict them
+PRUNE_GRACE_SECONDS = 600
+TMP_EXPIRE_SECONDS = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    md5 TEXT,
+    size INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_md5 ON blobs (md5);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256);
+CREATE TABLE IF NOT EXISTS bundles (
+    sha256 TEXT PRIMARY KEY,
+    bundle_id TEXT,
+    version TEXT,
+    short_version TEXT
+);
+CREATE INDEX IF NOT EXISTS bundles_bundle_id ON bundles (bundle_id, short_version, version);
+CREATE TABLE IF NOT EXISTS installs (
+    udid TEXT NOT NULL,
+    bundle_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    installed_at REAL NOT NULL,
+    version TEXT,
+    short_version TEXT,
+    PRIMARY KEY (udid, bundle_id)
+);
+"""
+# columns added after the table was created
+_MIGRATIONS = {
+    "installs": [("version", "TEXT"), ("short_version", "TEXT")],
+}
+
+
+class InstallRecord(BaseModel):
+    sha256: str
+    version: Optional[str] = None
+    short_version: Optional[str] = None
+    installed_at: datetime.datetime
+
+
+class CacheEntry(BaseModel):
+    sha256: str
+    md5: Optional[str] = None
+    size: int
+    filename: str
+    last_used: datetime.datetime
+    path: pathlib.Path
+    bundle_id: Optional[str] = None
+    version: Optional[str] = None
+    short_version: Optional[str] = None
+
+
+_SELECT_BLOBS = """
+SELECT blobs.*, bundles.bundle_id, bundles.version, bundles.short_version
+FROM blobs LEFT JOIN bundles USING (sha256)
+"""
+_SELECT_URL_BLOB = """
+SELECT blobs.*, bundles.bundle_id, bundles.version, bundles.short_version, urls.etag, urls.last_modified
+FROM urls JOIN blobs USING (sha256) LEFT JOIN bundles USING (sha256)
+WHERE url = ?
+"""
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+class DownloadCache:
+    """
+    Size-bounded download cache, least recently used files are evicted first.
+    Safe to be shared by multiple processes.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path, None] = None, max_bytes: Optional[int] = None):
+        self.root = pathlib.Path(root or DEFAULT_CACHE_DIR)
+        self.max_bytes = DEFAULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.blobs_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+        self.locks_dir = self.root / "locks"
+        for d in (self.blobs_dir, self.tmp_dir, self.locks_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            for table, columns in _MIGRATIONS.items():
+                existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for name, type_ in columns:
+                    if name not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {type_}")
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.root / "index.db", timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lock(self, url: str) -> FileLock:
+        """ lock held while downloading url, so that the same url is only downloaded once """
+        return FileLock(self.locks_dir / f"{url_key(url)}.lock")
+
+    def download_path(self, url: str) -> pathlib.Path:
+        """ where to put the unfinished download, stable for the same url so that it can be resumed """
+        return self.tmp_dir / url_key(url) / "download"
+
+    def validators(self, url: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Return (etag, last_modified) of the cached file of url, used for conditional request.
+        Both are None if url not cached
+        """
+        with self._connect() as conn:
+            row = conn.execute(_SELECT_URL_BLOB, (url,)).fetchone()
+            if self._valid_entry(row, 0) is None:
+                return None, None
+            return row["etag"], row["last_modified"]
+
+    def _row_to_entry(self, row: sqlite3.Row) -> CacheEntry:
+        return CacheEntry(
+            sha256=row["sha256"],
+            md5=row["md5"],
+            size=row["size"],
+            filename=row["filename"],
+            last_used=datetime.datetime.fromtimestamp(row["last_used"]),
+            path=self.blobs_dir / row["sha256"] / row["filename"],
+            bundle_id=row["bundle_id"],
+            version=row["version"],
+            short_version=row["short_version"],
+        )
+
+    def _valid_entry(self, row: Optional[sqlite3.Row], size: int) -> Optional[CacheEntry]:
+        if row is None:
+            return None
+        entry = self._row_to_entry(row)
+        if size and entry.size != size:
+            return None
+        if not entry.path.is_file() or entry.path.stat().st_size != entry.size:
+            return None
+        return entry
+
+    def lookup(self, url: str, size: int = 0, etag: Optional[str] = None,
+               md5: Optional[str] = None, sha256: Optional[str] = None, last_modified: Optional[str] = None,
+               changed: bool = False) -> Optional[pathlib.Path]:
+        """
+        Find cached file of given url, or file with same content hash downloaded from another url
+
+        :param size: remote content-length, 0 means unknown
+        :param etag: remote ETag
+        :param md5: remote content md5 in hex
+        :param sha256: remote content sha256 in hex
+        :param last_modified: remote Last-Modified
+        :param changed: server answered 200 to a conditional request, the file cached for url is outdated,
+            only a file with the same content hash is used
+        :return: cached file path or None
+        """
+        with self._connect() as conn:
+            entry = None
+            row = None if changed else conn.execute(_SELECT_URL_BLOB, (url,)).fetchone()
+            if row is not None and (not etag or not row["etag"] or etag == row["etag"]) \
+                    and (not last_modified or not row["last_modified"] or last_modified == row["last_modified"]) \
+                    and (not md5 or md5 == row["md5"]) and (not sha256 or sha256 == row["sha256"]):
+                entry = self._valid_entry(row, size)
+            if entry is None and (md5 or sha256):
+                if sha256:
+                    row = conn.execute(_SELECT_BLOBS + "WHERE sha256 = ?", (sha256,)).fetchone()
+                else:
+                    row = conn.execute(_SELECT_BLOBS + "WHERE md5 = ?", (md5,)).fetchone()
+                entry = self._valid_entry(row, size)
+                if entry:
+                    logger.debug("same content found in cache: %s", entry.sha256)
+                    self._save_url(conn, url, entry.sha256, etag, None)
+            if entry is None:
+                return None
+            self._touch(conn, entry)
+        return entry.path
+
+    def _touch(self, conn: sqlite3.Connection, entry: CacheEntry):
+        now = time.time()
+        conn.execute("UPDATE blobs SET last_used = ? WHERE sha256 = ?", (now, entry.sha256))
+        # update file mtime to avoid flie being deleted by clean script
+        os.utime(entry.path, (now, now))
+
+    def _save_url(self, conn: sqlite3.Connection, url: str, sha256: str,
+                  etag: Optional[str], last_modified: Optional[str]):
+        conn.execute(
+            "INSERT OR REPLACE INTO urls (url, sha256, etag, last_modified, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (url, sha256, etag, last_modified, time.time()),
+        )
+
+    def add(self, url: str, filepath: pathlib.Path, filename: str, sha256: str, md5: Optional[str] = None,
+            etag: Optional[str] = None, last_modified: Optional[str] = None) -> pathlib.Path:
+        """
+        Move downloaded file into cache, evict old files if over budget
+
+        :param filename: name of the file inside cache, file suffix matters (.ipa or .ipcc)
+        :return: path of the file inside cache
+        """
+        blob_dir = self.blobs_dir / sha256
+        blob_dir.mkdir(exist_ok=True)
+        size = filepath.stat().st_size
+        with self._connect() as conn:
+            row = conn.execute(_SELECT_BLOBS + "WHERE sha256 = ?", (sha256,)).fetchone()
+            entry = self._valid_entry(row, size)
+            if entry is not None:
+                # same content downloaded from another url
+                filepath.unlink()
+            else:
+                dst = blob_dir / (filename or filepath.name)
+                os.replace(filepath, dst)
+                entry = CacheEntry(sha256=sha256, md5=md5, size=size, filename=dst.name,
+                                   last_used=datetime.datetime.now(), path=dst)
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, md5, size, filename, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (sha256, md5, size, dst.name, time.time()),
+                )
+            self._save_url(conn, url, sha256, etag, last_modified)
+            self._touch(conn, entry)
+        with contextlib.suppress(OSError):
+            filepath.parent.rmdir()
+        self._index_bundle(entry.sha256, entry.path)
+        self.prune()
+        return entry.path
+
+    def _index_bundle(self, sha256: str, path: pathlib.Path) -> Optional[IPAInfo]:
+        """ read bundle id and versions from ipa and save to index, other files are indexed as unknown """
+        info = None
+        if path.suffix.lower() == ".ipa":
+            try:
+                info = read_ipa_info(path)
+            except FatalError as e:
+                logger.debug("read ipa info of %s failed: %s", path, e)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bundles (sha256, bundle_id, version, short_version) VALUES (?, ?, ?, ?)",
+                (sha256, info.CFBundleIdentifier if info else None, info.CFBundleVersion if info else None,
+                 info.CFBundleShortVersionString if info else None),
+            )
+        return info
+
+    def ipa_info(self, sha256: str) -> Optional[IPAInfo]:
+        """ bundle id and versions of cached ipa, files cached before indexing are indexed on first query """
+        with self._connect() as conn:
+            row = conn.execute(_SELECT_BLOBS + "WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            entry = self._row_to_entry(row)
+            indexed = conn.execute("SELECT 1 FROM bundles WHERE sha256 = ?", (sha256,)).fetchone() is not None
+        if not indexed:
+            return self._index_bundle(sha256, entry.path)
+        if entry.bundle_id is None:
+            return None
+        return IPAInfo(CFBundleIdentifier=entry.bundle_id, CFBundleVersion=entry.version,
+                       CFBundleShortVersionString=entry.short_version)
+
+    def find(self, bundle_id: str, version: Optional[str] = None) -> List[CacheEntry]:
+        """
+        Find cached ipa by bundle id, most recently used first
+
+        :param version: match CFBundleShortVersionString or CFBundleVersion
+        """
+        self._index_missing_bundles()
+        sql = _SELECT_BLOBS + "WHERE bundles.bundle_id = ?"
+        params = [bundle_id]
+        if version:
+            sql += " AND (bundles.short_version = ? OR bundles.version = ?)"
+            params += [version, version]
+        with self._connect() as conn:
+            rows = conn.execute(sql + " ORDER BY last_used DESC", params).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def _index_missing_bundles(self):
+        with self._connect() as conn:
+            rows = conn.execute(_SELECT_BLOBS + "WHERE bundles.sha256 IS NULL").fetchall()
+        for row in rows:
+            entry = self._row_to_entry(row)
+            if entry.path.is_file():
+                self._index_bundle(entry.sha256, entry.path)
+
+    def sha256_of(self, path: pathlib.Path) -> Optional[str]:
+        """ content hash of a file inside cache, None if path is not in cache """
+        path = pathlib.Path(path)
+        if path.parent.parent != self.blobs_dir:
+            return None
+        return path.parent.name
+
+    def record_install(self, udid: str, bundle_id: str, sha256: str, version: Optional[str] = None,
+                       short_version: Optional[str] = None):
+        """ remember the content hash and versions of the ipa installed on device """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO installs (udid, bundle_id, sha256, installed_at, version, short_version) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (udid, bundle_id, sha256, time.time(), version, short_version),
+            )
+
+    def installed_record(self, udid: str, bundle_id: str) -> Optional[InstallRecord]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM installs WHERE udid = ? AND bundle_id = ?", (udid, bundle_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return InstallRecord(sha256=row["sha256"], version=row["version"], short_version=row["short_version"],
+                             installed_at=datetime.datetime.fromtimestamp(row["installed_at"]))
+
+    def entries(self) -> List[CacheEntry]:
+        """ cached files, most recently used first """
+        with self._connect() as conn:
+            rows = conn.execute(_SELECT_BLOBS + "ORDER BY last_used DESC").fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def urls(self, sha256: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT url FROM urls WHERE sha256 = ?", (sha256,)).fetchall()
+        return [row["url"] for row in rows]
+
+    def total_bytes(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def remove(self, entry: CacheEntry):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM urls WHERE sha256 = ?", (entry.sha256,))
+            conn.execute("DELETE FROM bundles WHERE sha256 = ?", (entry.sha256,))
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (entry.sha256,))
+        shutil.rmtree(self.blobs_dir / entry.sha256, ignore_errors=True)
+
+    def prune(self, max_bytes: Optional[int] = None, grace_seconds: float = PRUNE_GRACE_SECONDS) -> List[CacheEntry]:
+        """
+        Evict least recently used files until total size is within max_bytes
+
+        :param max_bytes: byte budget, default is self.max_bytes
+        :param grace_seconds: files used within this period are kept
+        :return: removed entries
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        removed = []
+        with FileLock(self.locks_dir / "prune.lock"):
+            total = self.total_bytes()
+            with self._connect() as conn:
+                rows = conn.execute(
+                    _SELECT_BLOBS + "WHERE last_used <= ? ORDER BY last_used",
+                    (time.time() - grace_seconds,)
+                ).fetchall() if total > max_bytes else []
+            for entry in map(self._row_to_entry, rows):
+                if total <= max_bytes:
+                    break
+                logger.info("evict cached file: %s", entry.path)
+                self.remove(entry)
+                total -= entry.size
+                removed.append(entry)
+            self._prune_tmp()
+        return removed
+
+    def _prune_tmp(self):
+        deadline = time.time() - TMP_EXPIRE_SECONDS
+        for tmpdir in self.tmp_dir.iterdir():
+            try:
+                mtimes = [p.stat().st_mtime for p in tmpdir.iterdir()] + [tmpdir.stat().st_mtime]
+            except OSError:  # removed by another process
+                continue
+            if max(mtimes) < deadline:
+                shutil.rmtree(tmpdir, ignore_errors=True)
@@ -6,8 +6,18 @@
 from __future__ import annotations
 
 import functools
+import os
+import pathlib
+import sys
 import threading
+import time
 import unicodedata
+from typing import Union
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
 
 
 def threadsafe_function(fn):
@@ -30,6 +40,84 @@ def threadsafe_function(fn):
     return wrapper
 
 
+class FileLock:
+    """
+    Cross-process exclusive lock based on a lock file, released automatically when the process exits
+
+    Usage:
+        with FileLock("/tmp/some.lock"):
+            ...
+    """
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self._path = pathlib.Path(path)
+        self._fd = None
+
+    def acquire(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if sys.platform == "win32":
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK gives up after 10 seconds
+                        time.sleep(0.1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        if sys.platform == "win32":
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self) -> FileLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+def byte2humansize(num_bytes):
+    """
+    Convert a size in bytes to a more human-readable format.
+
+    :param num_bytes: Size in bytes.
+    :return: Human-readable size.
+    """
+    if num_bytes < 1024.0:
+        return f"{num_bytes}"
+    for unit in ['K', 'M', 'G', 'T', 'P', 'E', 'Z']:
+        num_bytes /= 1024.0
+        if num_bytes < 1024.0:
+            return f"{num_bytes:3.1f}{unit}"
+    return f"{num_bytes:.1f}Y"
+
+
+def humansize2byte(size: str) -> int:
+    """
+    Convert a human-readable size to bytes, reverse of byte2humansize
+
+    :param size: e.g. 512, 10K, 1.5M, 2G (1024 based)
+    """
+    size = size.strip().upper().rstrip("B")
+    units = ['K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y']
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * 1024 ** (units.index(size[-1]) + 1))
+    return int(size)
+
+
 def unicode_len(s: str) -> int:
     """ printable length of string """
     length = 0
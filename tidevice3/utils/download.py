@@ -8,26 +8,40 @@ from __future__ import annotations
 
 import re
 
-__all__ = ["download_file", "is_hyperlink", "DownloadError"]
+__all__ = ["download_file", "is_hyperlink", "DownloadError", "DownloadProgress"]
 
 import base64
 import hashlib
+import json
 import logging
 import os
 import pathlib
-import shutil
+import threading
 import time
-from typing import Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
 import requests
+import urllib3
+from pydantic import BaseModel
 from requests.structures import CaseInsensitiveDict
 
 from tidevice3.exceptions import DownloadError
+from tidevice3.utils.http import DEFAULT_RETRIES, backoff_delay
+from tidevice3.utils.http import request as send_request
+
+if TYPE_CHECKING:
+    from tidevice3.utils.cache import DownloadCache
 
 logger = logging.getLogger(__name__)
 
 CACHE_DOWNLOAD_SUFFIX = ".t3-download-cache"
+DIGEST_SUFFIX = ".t3-digest"
+DIGEST_ALGORITHMS = ("md5", "sha256")
 DEFAULT_DOWNLOAD_TIMEOUT = 600  # 10 minutes
+DEFAULT_CHUNK_SIZE = 1 << 20  # 1 MB
+RESUME_EXPIRE_SECONDS = 60
+PROGRESS_INTERVAL = 0.2  # seconds between two progress callbacks
 
 StrOrPathLike = Union[str, pathlib.Path]
 
@@ -44,10 +58,222 @@ def md5sum(filepath: StrOrPathLike) -> str:
     return m.hexdigest()
 
 
+class DigestWriter:
+    """
+    Wrap a writable file object, compute md5 and sha256 of the written data on the fly
+    """
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.hashes = {name: hashlib.new(name) for name in DIGEST_ALGORITHMS}
+
+    def update(self, data: bytes):
+        for m in self.hashes.values():
+            m.update(data)
+
+    def update_from_file(self, filepath: StrOrPathLike):
+        """ hash existing content, used when resume download """
+        with open(filepath, "rb") as f:
+            while True:
+                data = f.read(1<<20)
+                if not data:
+                    break
+                self.update(data)
+
+    def write(self, data: bytes) -> int:
+        self.update(data)
+        return self.fileobj.write(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        return {name: m.hexdigest() for name, m in self.hashes.items()}
+
+
+class DownloadProgress(BaseModel):
+    """
+    Progress event of a download, also used as the summary when phase is "done"
+
+    phase: connect, transfer or done
+    connect_time: seconds until the response headers of the first request (dns, tcp, tls and server time)
+    ttfb: seconds until the first byte of the body
+    transfer_time: seconds from the first byte to now
+    """
+    url: str
+    phase: str
+    bytes_done: int = 0
+    total_bytes: int = 0  # 0 means unknown
+    rate: float = 0.0  # bytes per second
+    eta: Optional[float] = None
+    elapsed: float = 0.0
+    connect_time: Optional[float] = None
+    ttfb: Optional[float] = None
+    transfer_time: float = 0.0
+    status: Optional[str] = None  # downloaded, cached or failed, only set when done
+    error: Optional[str] = None
+
+
+class DownloadMonitor:
+    """
+    Collect bytes and phase timings of one download, shared by the segment threads.
+    callback is throttled to once per PROGRESS_INTERVAL, except phase changes.
+    """
+    def __init__(self, url: str, callback: Optional[Callable[[DownloadProgress], None]] = None,
+                 interval: float = PROGRESS_INTERVAL):
+        self.url = url
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._first_byte: Optional[float] = None
+        self._last_emit = 0.0
+        self._bytes_start = 0
+        self.phase = "connect"
+        self.bytes_done = 0
+        self.total_bytes = 0
+        self.connect_time: Optional[float] = None
+        self.ttfb: Optional[float] = None
+
+    def connected(self):
+        """ called when response headers received """
+        with self._lock:
+            if self.connect_time is None:
+                self.connect_time = time.monotonic() - self._start
+
+    def start_transfer(self, total_bytes: int, bytes_start: int = 0):
+        """ bytes_start is the size already on disk when resume """
+        with self._lock:
+            self.phase = "transfer"
+            self.total_bytes = total_bytes
+            self.bytes_done = self._bytes_start = bytes_start
+        self._emit(force=True)
+
+    def update(self, size: int):
+        with self._lock:
+            if self._first_byte is None:
+                self._first_byte = time.monotonic()
+                self.ttfb = self._first_byte - self._start
+            self.bytes_done += size
+        self._emit()
+
+    def finish(self, status: str, error: Optional[str] = None) -> DownloadProgress:
+        """ emit the last event and write the summary record to log """
+        with self._lock:
+            self.phase = "done"
+        progress = self.snapshot(status, error)
+        if self.callback:
+            self.callback(progress)
+        summary = progress.model_dump()
+        logger.info("download summary: %s", json.dumps(summary), extra={"t3_download": summary})
+        return progress
+
+    def snapshot(self, status: Optional[str] = None, error: Optional[str] = None) -> DownloadProgress:
+        with self._lock:
+            now = time.monotonic()
+            transfer_time = now - self._first_byte if self._first_byte else 0.0
+            rate = (self.bytes_done - self._bytes_start) / transfer_time if transfer_time > 0 else 0.0
+            eta = None
+            if rate > 0 and self.total_bytes and self.phase == "transfer":
+                eta = max(0.0, (self.total_bytes - self.bytes_done) / rate)
+            return DownloadProgress(
+                url=self.url, phase=self.phase, bytes_done=self.bytes_done, total_bytes=self.total_bytes,
+                rate=rate, eta=eta, elapsed=now - self._start, connect_time=self.connect_time,
+                ttfb=self.ttfb, transfer_time=transfer_time, status=status, error=error)
+
+    def _emit(self, force: bool = False):
+        if not self.callback:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.interval:
+            return
+        self._last_emit = now
+        self.callback(self.snapshot())
+
+
+def copy_stream(r: requests.Response, fileobj: BinaryIO, chunk_size: int, monitor: Optional[DownloadMonitor]):
+    """ like shutil.copyfileobj(r.raw, fileobj), but report bytes to monitor """
+    while True:
+        chunk = r.raw.read(chunk_size)
+        if not chunk:
+            break
+        fileobj.write(chunk)
+        if monitor:
+            monitor.update(len(chunk))
+
+
+def digest_path(filepath: StrOrPathLike) -> pathlib.Path:
+    return pathlib.Path(str(filepath) + DIGEST_SUFFIX)
+
+
+def save_digests(filepath: pathlib.Path, digests: Dict[str, Optional[str]]):
+    """
+    store verified digests (and etag, last_modified for revalidation) next to the file,
+    valid until file size or mtime changed
+    """
+    st = filepath.stat()
+    data = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, **digests}
+    digest_path(filepath).write_text(json.dumps(data))
+
+
+def load_digests(filepath: pathlib.Path) -> Optional[Dict[str, str]]:
+    try:
+        data = json.loads(digest_path(filepath).read_text())
+        st = filepath.stat()
+    except (OSError, ValueError):
+        return None
+    if data.pop("size", None) != st.st_size or data.pop("mtime_ns", None) != st.st_mtime_ns:
+        return None
+    return data
+
+
+def remove_file(filepath: pathlib.Path):
+    """ remove file together with its digest file """
+    filepath.unlink(missing_ok=True)
+    digest_path(filepath).unlink(missing_ok=True)
+
+
+def get_file_digests(filepath: pathlib.Path, save: bool = True) -> Dict[str, str]:
+    """
+    return md5 and sha256 of the file, read from the digest file when file not changed
+
+    :param save: write the digest file next to filepath for next time
+    """
+    digests = load_digests(filepath)
+    if digests is None or not all(name in digests for name in DIGEST_ALGORITHMS):
+        writer = DigestWriter(None)
+        writer.update_from_file(filepath)
+        digests = writer.hexdigests()
+        if not save:
+            return digests
+        try:
+            save_digests(filepath, digests)
+        except OSError as e:  # e.g. read-only directory
+            logger.debug("save digests of %s failed: %s", filepath, e)
+    return digests
+
+
+def parse_digest(value: str, length: int) -> Optional[str]:
+    """ parse hex or base64 encoded digest, return hex digest or None """
+    value = value.strip().strip('"')
+    if len(value) == length * 2:
+        try:
+            bytes.fromhex(value)
+            return value.lower()
+        except ValueError:
+            pass
+    try:
+        digest = base64.b64decode(value, validate=True)
+        if len(digest) == length:
+            return digest.hex()
+    except ValueError:
+        pass
+    return None
+
+
 class RemoteFileInfo:
     content_md5: str | None = None
+    content_sha256: str | None = None
     content_length: int = 0
     accept_ranges: bool = False
+    etag: str | None = None
+    last_modified: str | None = None
 
 
 def get_remote_file_info(headers: CaseInsensitiveDict) -> RemoteFileInfo:
@@ -57,14 +283,24 @@ def get_remote_file_info(headers: CaseInsensitiveDict) -> RemoteFileInfo:
     info = RemoteFileInfo()
     info.content_length = int(headers.get("content-length", 0))
     info.accept_ranges = headers.get("accept-ranges") == "bytes"
+    info.etag = headers.get("etag")
+    info.last_modified = headers.get("last-modified")
     md5_base64 = headers.get("content-md5")
     if md5_base64:
-        try:
-            content_md5 = base64.b64decode(md5_base64).hex()
-            if len(content_md5) == 32:
-                info.content_md5 = content_md5
-        except:
-            pass
+        info.content_md5 = parse_digest(md5_base64, 16)
+    # Digest: md5=<base64>,sha-256=<base64> (RFC 3230), or checksum headers of artifact stores
+    for part in headers.get("digest", "").split(","):
+        algorithm, _, value = part.partition("=")
+        algorithm = algorithm.strip().lower()
+        if algorithm == "md5" and not info.content_md5:
+            info.content_md5 = parse_digest(value, 16)
+        elif algorithm == "sha-256":
+            info.content_sha256 = parse_digest(value, 32)
+    for name in ("x-checksum-sha256", "x-amz-checksum-sha256"):
+        if not info.content_sha256 and headers.get(name):
+            info.content_sha256 = parse_digest(headers[name], 32)
+    if not info.content_md5 and headers.get("x-checksum-md5"):
+        info.content_md5 = parse_digest(headers["x-checksum-md5"], 16)
     return info
 
 
@@ -75,50 +311,205 @@ def check_if_already_downloaded(
         return False
     if filepath.stat().st_size != remote_file_info.content_length:
         return False
-    if remote_file_info.content_md5:
-        if md5sum(filepath) != remote_file_info.content_md5:
-            return False
+    if remote_file_info.content_md5 or remote_file_info.content_sha256:
+        return check_digests(remote_file_info, get_file_digests(filepath))
+    return True
+
+
+def check_digests(remote_file_info: RemoteFileInfo, digests: Dict[str, str]) -> bool:
+    """ check digests against md5 and sha256 published by server """
+    if remote_file_info.content_md5 and digests["md5"] != remote_file_info.content_md5:
+        return False
+    if remote_file_info.content_sha256 and digests["sha256"] != remote_file_info.content_sha256:
+        return False
     return True
 
 
 def update_file_mtime(filepath: pathlib.Path):
     """update file mtime to avoid flie being deleted by clean script"""
+    digests = load_digests(filepath)
     _atime, _mtime = (time.time(), time.time())
     os.utime(filepath, (_atime, _mtime))
+    if digests is not None:
+        save_digests(filepath, digests)
 
 
 def download_file_from_range(
-    url: str, filepath: pathlib.Path, bytes_start: int, timeout: float
-):
+    url: str, filepath: pathlib.Path, remote_file_info: RemoteFileInfo, bytes_start: int, timeout: float,
+    chunk_size: int = DEFAULT_CHUNK_SIZE, monitor: Optional[DownloadMonitor] = None
+) -> Dict[str, str]:
+    """ append remaining bytes to filepath, return digests of the whole file """
     r = make_request_get_stream(
         url, timeout, headers={"Range": f"bytes={bytes_start}-"}
     )
+    return download_body(url, r, filepath, remote_file_info, timeout, chunk_size, monitor)
+
+
+def download_body(
+    url: str, r: requests.Response, filepath: pathlib.Path, remote_file_info: RemoteFileInfo,
+    timeout: float, chunk_size: int, monitor: Optional[DownloadMonitor] = None, retries: int = DEFAULT_RETRIES
+) -> Dict[str, str]:
+    """
+    Append body of r to filepath, return digests of the whole file.
+    When the connection breaks, continue with a range request from the last written byte.
+    """
     with filepath.open("ab") as f:
-        shutil.copyfileobj(r.raw, f)
+        writer = DigestWriter(f)
+        writer.update_from_file(filepath)
+        for attempt in range(retries + 1):
+            try:
+                copy_stream(r, writer, chunk_size, monitor)
+                if f.tell() >= remote_file_info.content_length:
+                    break
+                raise DownloadError("connection closed before download complete", url, f.tell())
+            except (requests.RequestException, urllib3.exceptions.HTTPError, DownloadError) as e:
+                r.close()
+                if attempt == retries or not remote_file_info.accept_ranges:
+                    raise DownloadError("download failed", url, f.tell()) from e
+                offset = f.tell()
+                delay = backoff_delay(attempt)
+                logger.warning("download interrupted at %d: %s, resume in %.1fs", offset, e, delay)
+                time.sleep(delay)
+                r = make_request_get_stream(url, timeout, headers={"Range": f"bytes={offset}-"})
+                if r.status_code != 206:
+                    raise DownloadError("server does not respect range request", url, r.status_code)
+    return writer.hexdigests()
+
+
+def split_ranges(content_length: int, segments: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Split [0, content_length) into at most segments inclusive byte ranges,
+    every range (except the last one) is aligned to chunk_size
+    """
+    chunks = (content_length + chunk_size - 1) // chunk_size
+    chunks_per_segment = max(1, (chunks + segments - 1) // segments)
+    segment_size = chunks_per_segment * chunk_size
+    ranges = []
+    for start in range(0, content_length, segment_size):
+        ranges.append((start, min(start + segment_size, content_length) - 1))
+    return ranges
+
+
+def download_segment(
+    url: str, filepath: pathlib.Path, bytes_start: int, bytes_end: int,
+    chunk_size: int, timeout: float, retries: int = DEFAULT_RETRIES,
+    monitor: Optional[DownloadMonitor] = None
+):
+    """
+    Download bytes [bytes_start, bytes_end] into the same position of a preallocated file.
+    When the connection breaks, continue from the last written byte instead of the segment start.
+    """
+    offset = bytes_start
+    for attempt in range(retries + 1):
+        try:
+            # closed on every path, the pooled connection is not leaked by a failed segment
+            with make_request_get_stream(url, timeout, headers={"Range": f"bytes={offset}-{bytes_end}"}) as r, \
+                    filepath.open("r+b") as f:
+                if r.status_code != 206:
+                    raise DownloadError("server does not respect range request", url, r.status_code)
+                f.seek(offset)
+                for chunk in r.iter_content(chunk_size):
+                    chunk = chunk[:bytes_end + 1 - offset]
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if monitor:
+                        monitor.update(len(chunk))
+            if offset > bytes_end:
+                return
+            raise DownloadError("segment not complete", url, offset, bytes_end)
+        except (requests.RequestException, DownloadError) as e:
+            if attempt == retries:
+                raise DownloadError("segment download failed", url, bytes_start, bytes_end) from e
+            delay = backoff_delay(attempt)
+            logger.warning("segment %d-%d failed: %s, retry from %d in %.1fs", bytes_start, bytes_end, e, offset, delay)
+            time.sleep(delay)
+
+
+def download_file_segmented(
+    url: str, filepath: pathlib.Path, content_length: int,
+    segments: int, chunk_size: int, timeout: float, monitor: Optional[DownloadMonitor] = None
+):
+    """
+    Download file with multiple connections, each connection fetch one byte range.
+    Failed segments are retried separately, the other segments keep going.
+    """
+    with filepath.open("wb") as f:
+        f.truncate(content_length)
+    ranges = split_ranges(content_length, segments, chunk_size)
+    logger.debug("segmented download with %d connections", len(ranges))
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(download_segment, url, filepath, start, end, chunk_size, timeout,
+                                monitor=monitor)
+                for start, end in ranges
+            ]
+            for future in futures:
+                future.result()
+    except BaseException:
+        # holes in a preallocated file can not be resumed
+        filepath.unlink(missing_ok=True)
+        raise
+
+
+def is_resumable(tmpfpath: pathlib.Path) -> bool:
+    """ partial download written recently """
+    return tmpfpath.exists() and tmpfpath.stat().st_mtime > time.time() - RESUME_EXPIRE_SECONDS
 
 
 def get_bytes_start(
     tmpfpath: pathlib.Path, remote_file_info: RemoteFileInfo
 ) -> Optional[int]:
-    if (
-        remote_file_info.accept_ranges
-        and tmpfpath.exists()
-        and tmpfpath.stat().st_mtime > time.time() - 60
-    ):
+    if remote_file_info.accept_ranges and is_resumable(tmpfpath):
         return tmpfpath.stat().st_size
 
 
-def make_request_get_stream(
-    url: str, timeout: float, headers: dict = None
+def make_request(
+    method: str, url: str, timeout: float, headers: dict = None
 ) -> requests.Response:
-    r = requests.get(url, stream=True, timeout=timeout, headers=headers)
+    r = send_request(method, url, timeout, headers, stream=True)
     try:
         r.raise_for_status()
     except requests.exceptions.HTTPError as e:
+        r.close()
         raise DownloadError(e, url)
     return r
 
 
+def make_request_get_stream(
+    url: str, timeout: float, headers: dict = None
+) -> requests.Response:
+    return make_request("GET", url, timeout, headers)
+
+
+def make_conditional_headers(etag: Optional[str], last_modified: Optional[str]) -> dict:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def probe_remote_file(
+    url: str, timeout: float, use_head: bool, headers: dict = None
+) -> requests.Response:
+    """
+    Request for the response headers, status code 304 means local copy is still valid.
+    HEAD is used when the body will be fetched with ranges, so the connection can be reused.
+    Fall back to GET if HEAD is rejected, e.g. presigned url only valid for GET
+    """
+    if use_head:
+        try:
+            r = make_request("HEAD", url, timeout, headers)
+            if r.status_code == 304 or "content-length" in r.headers:
+                return r
+            r.close()
+        except (requests.RequestException, DownloadError) as e:
+            logger.debug("HEAD %s failed: %s", url, e)
+    return make_request_get_stream(url, timeout, headers)
+
+
 def is_hyperlink(url: str) -> bool:
     return url.startswith("http://") or url.startswith("https://")
 
@@ -137,7 +528,9 @@ def guess_filename_from_url(url: str, headers: CaseInsensitiveDict = {}) -> str:
 
 
 def download_file(
-    url: str, filepath: StrOrPathLike | None = None, timeout: float = DEFAULT_DOWNLOAD_TIMEOUT
+    url: str, filepath: StrOrPathLike | None = None, timeout: float = DEFAULT_DOWNLOAD_TIMEOUT,
+    segments: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE, cache: Optional[DownloadCache] = None,
+    progress: Optional[Callable[[DownloadProgress], None]] = None
 ) -> pathlib.Path:
     """
     Download file from given url to filepath
@@ -145,6 +538,10 @@ def download_file(
     :param url: url to download
     :param filepath: local file path
     :param timeout: timeout in seconds
+    :param segments: number of parallel connections, only used when server accept ranges
+    :param chunk_size: read/write chunk size in bytes
+    :param cache: store file in download cache, filepath is ignored. return path inside cache
+    :param progress: called with DownloadProgress while downloading, and once more when done
 
     raise DownloadError if download failed
     """
@@ -152,30 +549,135 @@ def download_file(
         raise DownloadError("only support http/https url", url)
     
     logger.info("download from url: %s", url)
-    r = make_request_get_stream(url, timeout)
+    monitor = DownloadMonitor(url, progress)
+    try:
+        if cache is not None:
+            with cache.lock(url):
+                path = download_file_to_cache(url, cache, timeout, segments, chunk_size, monitor)
+        else:
+            path = download_file_to_path(url, filepath, timeout, segments, chunk_size, monitor)
+    except Exception as e:
+        monitor.finish("failed", str(e))
+        raise
+    monitor.finish("downloaded" if monitor.phase == "transfer" else "cached")
+    return path
+
+
+def download_file_to_path(
+    url: str, filepath: StrOrPathLike | None, timeout: float, segments: int, chunk_size: int,
+    monitor: DownloadMonitor
+) -> pathlib.Path:
+    if filepath is None:
+        guessed_path = pathlib.Path(guess_filename_from_url(url))
+    else:
+        filepath = guessed_path = pathlib.Path(filepath)
+    validators = load_digests(guessed_path) or {}
+    use_head = segments > 1 or is_resumable(pathlib.Path(str(guessed_path) + CACHE_DOWNLOAD_SUFFIX))
+    conditional_headers = make_conditional_headers(validators.get("etag"), validators.get("last_modified"))
+    r = probe_remote_file(url, timeout, use_head, conditional_headers)
+    monitor.connected()
+    if r.status_code == 304:
+        r.close()
+        logger.debug("not modified, use cached asset: %s", guessed_path)
+        update_file_mtime(guessed_path)
+        return guessed_path
 
     if filepath is None:
-        filepath = guess_filename_from_url(url, r.headers)
-    filepath = pathlib.Path(filepath)
+        filepath = pathlib.Path(guess_filename_from_url(url, r.headers))
+    remote_file_info = get_remote_file_info(r.headers)
+    # a full answer to a conditional request means the local file is outdated
+    changed = bool(conditional_headers) and filepath == guessed_path
+    return download_response(url, r, remote_file_info, filepath, timeout, segments, chunk_size, monitor, changed)
+
+
+def download_file_to_cache(
+    url: str, cache: DownloadCache, timeout: float, segments: int, chunk_size: int,
+    monitor: DownloadMonitor
+) -> pathlib.Path:
+    filepath = cache.download_path(url)
+    etag, last_modified = cache.validators(url)
+    use_head = segments > 1 or is_resumable(pathlib.Path(str(filepath) + CACHE_DOWNLOAD_SUFFIX))
+    conditional_headers = make_conditional_headers(etag, last_modified)
+    r = probe_remote_file(url, timeout, use_head, conditional_headers)
+    monitor.connected()
+    # a full answer to a conditional request means the file changed since cached
+    changed = bool(conditional_headers)
+    if r.status_code == 304:
+        r.close()
+        cached_path = cache.lookup(url)
+        if cached_path:
+            logger.debug("not modified, use cached asset: %s", cached_path)
+            return cached_path
+        # evicted just now
+        r = probe_remote_file(url, timeout, use_head)
+        changed = False
+
+    remote_file_info = get_remote_file_info(r.headers)
+    cached_path = cache.lookup(url, remote_file_info.content_length, remote_file_info.etag,
+                               remote_file_info.content_md5, remote_file_info.content_sha256,
+                               remote_file_info.last_modified, changed)
+    if cached_path:
+        logger.debug("use cached asset: %s", cached_path)
+        r.close()
+        return cached_path
+    filepath.parent.mkdir(exist_ok=True)
+    download_response(url, r, remote_file_info, filepath, timeout, segments, chunk_size, monitor)
+    digests = get_file_digests(filepath)
+    digest_path(filepath).unlink()
+    return cache.add(url, filepath, guess_filename_from_url(url, r.headers), digests["sha256"], digests["md5"],
+                     remote_file_info.etag, remote_file_info.last_modified)
+
+
+def download_response(
+    url: str, r: requests.Response, remote_file_info: RemoteFileInfo, filepath: pathlib.Path,
+    timeout: float, segments: int, chunk_size: int, monitor: DownloadMonitor, changed: bool = False
+) -> pathlib.Path:
+    """
+    save body of the response r to filepath, r is the response of GET or HEAD
+
+    :param changed: filepath is known to be outdated, even if the size is the same
+    """
     tmpfpath = pathlib.Path(
         str(filepath) + CACHE_DOWNLOAD_SUFFIX
     )  # 文件先下载到这里，等检查完后再Move过去
 
-    remote_file_info = get_remote_file_info(r.headers)
-    if check_if_already_downloaded(filepath, remote_file_info):
+    if not changed and check_if_already_downloaded(filepath, remote_file_info):
         logger.debug("use cached asset: %s", filepath)
+        r.close()
         update_file_mtime(filepath)
         return filepath
 
     bytes_start = get_bytes_start(tmpfpath, remote_file_info)
     if bytes_start:
         logger.debug("resume download from %s", bytes_start)
-        download_file_from_range(url, tmpfpath, bytes_start, timeout)
+        r.close()
+        monitor.start_transfer(remote_file_info.content_length, bytes_start)
+        digests = download_file_from_range(url, tmpfpath, remote_file_info, bytes_start, timeout, chunk_size, monitor)
+    elif segments > 1 and remote_file_info.accept_ranges and remote_file_info.content_length > chunk_size:
+        r.close()
+        monitor.start_transfer(remote_file_info.content_length)
+        download_file_segmented(url, tmpfpath, remote_file_info.content_length, segments, chunk_size, timeout,
+                                monitor)
+        # segments arrive out of order, so they can not be hashed while downloading
+        digests = None
     else:
-        with tmpfpath.open("wb") as f:
-            shutil.copyfileobj(r.raw, f)
-    if not check_if_already_downloaded(tmpfpath, remote_file_info):
+        if r.request.method != "GET":
+            r = make_request_get_stream(url, timeout)
+        monitor.start_transfer(remote_file_info.content_length)
         tmpfpath.unlink(missing_ok=True)
+        digests = download_body(url, r, tmpfpath, remote_file_info, timeout, chunk_size, monitor)
+    if digests is not None:
+        save_digests(tmpfpath, digests)
+    if not check_if_already_downloaded(tmpfpath, remote_file_info):
+        remove_file(tmpfpath)
         raise DownloadError("download file not complete", url)
+    # keep etag and last_modified for the revalidation next time
+    digests = get_file_digests(tmpfpath)
+    if remote_file_info.etag:
+        digests["etag"] = remote_file_info.etag
+    if remote_file_info.last_modified:
+        digests["last_modified"] = remote_file_info.last_modified
+    save_digests(tmpfpath, digests)
     os.rename(tmpfpath, filepath)
+    os.replace(digest_path(tmpfpath), digest_path(filepath))
     return filepath
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 19:20:41 by codeskyblue
+
+Shared http client, connections are pooled and idempotent requests are retried
+"""
+
+from __future__ import annotations
+
+__all__ = ["get_session", "request", "backoff_delay"]
+
+import logging
+import os
+import random
+import time
+from typing import Optional
+
+import requests
+
+from tidevice3.utils.common import threadsafe_function
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_RETRIES = int(os.environ.get("T3_HTTP_RETRIES", 3))
+DEFAULT_BACKOFF = float(os.environ.get("T3_HTTP_BACKOFF", 0.5))  # seconds, doubled every retry
+DEFAULT_BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+@threadsafe_function
+def get_session() -> requests.Session:
+    """ shared session, so that connections are kept alive and reused between requests """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=DEFAULT_POOL_MAXSIZE,
+                                                pool_maxsize=DEFAULT_POOL_MAXSIZE)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+_session: Optional[requests.Session] = None
+
+
+def backoff_delay(attempt: int, backoff: float = DEFAULT_BACKOFF, backoff_max: float = DEFAULT_BACKOFF_MAX) -> float:
+    """ exponential backoff with full jitter, so that clients do not retry at the same time """
+    return random.uniform(0, min(backoff_max, backoff * (2 ** attempt)))
+
+
+def retry_after(r: requests.Response) -> Optional[float]:
+    """ seconds in Retry-After header, http-date is not supported """
+    try:
+        return min(DEFAULT_BACKOFF_MAX, float(r.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        return None
+
+
+def request(
+    method: str, url: str, timeout: float, headers: dict = None, stream: bool = False,
+    retries: Optional[int] = None, backoff: float = DEFAULT_BACKOFF
+) -> requests.Response:
+    """
+    Send request with the shared session.
+    Idempotent requests are retried on connection errors, timeouts and status code 429, 5xx.
+    The last response is returned as is, the caller should check the status code.
+
+    :param retries: max retries, default T3_HTTP_RETRIES or 3
+    :param backoff: first retry delay in seconds, doubled every retry
+    """
+    if retries is None:
+        retries = DEFAULT_RETRIES
+    if method.upper() not in IDEMPOTENT_METHODS:
+        retries = 0
+    for attempt in range(retries + 1):
+        try:
+            r = get_session().request(method, url, stream=stream, timeout=timeout, headers=headers)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt, backoff)
+            logger.warning("%s %s failed: %s, retry in %.1fs", method, url, e, delay)
+        else:
+            if r.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                return r
+            r.close()
+            delay = retry_after(r)
+            if delay is None:
+                delay = backoff_delay(attempt, backoff)
+            logger.warning("%s %s status %d, retry in %.1fs", method, url, r.status_code, delay)
+        time.sleep(delay)
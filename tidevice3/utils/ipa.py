@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 16:40:03 by codeskyblue
+"""
+
+from __future__ import annotations
+
+__all__ = ["IPAInfo", "read_ipa_info"]
+
+import pathlib
+import plistlib
+import re
+import zipfile
+from typing import Optional, Union
+
+from pydantic import BaseModel, ValidationError
+
+from tidevice3.exceptions import FatalError
+
+INFO_PLIST_PATTERN = re.compile(r"^Payload/[^/]+\.app/Info\.plist$")
+
+
+class IPAInfo(BaseModel):
+    CFBundleIdentifier: str
+    CFBundleVersion: str
+    CFBundleShortVersionString: Optional[str] = None
+
+    def same_version(self, app_info: dict) -> bool:
+        """ compare with the app info returned by InstallationProxyService.get_apps """
+        return self.CFBundleIdentifier == app_info.get("CFBundleIdentifier") \
+            and self.CFBundleVersion == app_info.get("CFBundleVersion") \
+            and self.CFBundleShortVersionString == app_info.get("CFBundleShortVersionString")
+
+
+def read_ipa_info(path: Union[str, pathlib.Path]) -> IPAInfo:
+    """
+    Read bundle id and versions from Payload/*.app/Info.plist,
+    only the zip central directory and the plist itself are read, the archive is not extracted
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            for name in zf.namelist():
+                if INFO_PLIST_PATTERN.match(name):
+                    info = plistlib.loads(zf.read(name))
+                    return IPAInfo.model_validate(info)
+    except (zipfile.BadZipFile, plistlib.InvalidFileException, ValidationError) as e:
+        raise FatalError("invalid ipa", path, e)
+    raise FatalError("Info.plist not found in ipa", path)
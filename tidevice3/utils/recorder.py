@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 23:12:30 by codeskyblue
+
+Screen record pipeline
+
+    capture thread -> capture queue -> dispatch thread -> decoder processes -> encoder (caller thread)
+
+Capture never waits: when the capture queue is full the frame is dropped and counted.
+The dispatch thread blocks when too many frames are being decoded, that is the backpressure.
+"""
+
+from __future__ import annotations
+
+__all__ = ["ScreenRecorder", "RecordStats", "VfrWriter", "SegmentWriter", "hls_output_params", "TextOverlay",
+           "limit_fps", "draw_text", "resize_for_ffmpeg", "decode_frame", "frame_fingerprint"]
+
+import datetime
+import hashlib
+import io
+import logging
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_DECODERS = 2
+DEFAULT_VFR_SLACK = 0.3  # seconds
+VFR_TIME_SCALE = 1000  # timestamps in milliseconds
+DEFAULT_SEGMENT_SECONDS = 60
+
+
+def limit_fps(screenshot_iterator: Iterator[Any], fps: int, debug: bool = False, vfr: bool = False) -> Iterator[Any]:
+    """
+    Limit the frame rate of the screenshot iterator to the given FPS
+
+    In fixed fps mode gaps are filled by yielding the last screenshot again.
+    In vfr mode screenshots are never repeated, fps is only the max frame rate.
+    """
+    frame_duration = 1.0 / fps
+    next_frame_time = time.monotonic()
+    last_screenshot = None
+
+    for screenshot in screenshot_iterator:
+        current_time = time.monotonic()
+
+        if current_time >= next_frame_time:
+            last_screenshot = screenshot
+
+            # Write frame to video
+            if debug:
+                print(".", end="", flush=True)
+            yield screenshot
+
+            # Schedule next frame
+            next_frame_time += frame_duration
+
+        if vfr:
+            # no catching up after a slow frame
+            next_frame_time = max(next_frame_time, current_time)
+            continue
+
+        # Fill in with the last image if the next frame time is still in the future
+        while next_frame_time <= current_time:
+            if last_screenshot is not None:
+                if debug:
+                    print("o", end="", flush=True)
+                yield last_screenshot
+            next_frame_time += frame_duration
+
+
+def draw_text(pil_img: Image.Image, text: str):
+    """ GPT生成的，效果勉强吧，不太好，总比没有的强 """
+    draw = ImageDraw.Draw(pil_img)
+    font = ImageFont.load_default()
+
+    # Calculate the bounding box of the text
+    text_bbox = font.getbbox(text)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+    text_x = 20
+    text_y = 50
+
+    # Define text color and background color
+    text_color = (255, 0, 0)  # Red color
+    background_color = (128, 128, 128, 128)  # Gray color with 50% transparency
+
+    # Create a rectangle background for text
+    background_rectangle = [
+        (text_x - 10, text_y - 10),  # Upper left corner
+        (text_x + text_width + 10, text_y + text_height + 10)  # Lower right corner
+    ]
+    draw.rectangle(background_rectangle, fill=background_color)
+    draw.text((text_x, text_y), text, fill=text_color, font=font)
+    return pil_img
+
+
+class TextOverlay:
+    """
+    Same look as draw_text, but for RGB numpy frames.
+    Every glyph is rendered once on the background color, drawing text is copying small arrays into the frame.
+    """
+    def __init__(self, x: int = 20, y: int = 50, padding: int = 10,
+                 color: tuple = (255, 0, 0), background: tuple = (128, 128, 128)):
+        self.x = x
+        self.y = y
+        self.padding = padding
+        self.color = color
+        self.background = background
+        self._font = ImageFont.load_default()
+        text_bbox = self._font.getbbox("Time: 0123456789-: Frame")
+        # draw_text rectangle covers y - padding .. y + text_height + padding, both ends included
+        self._height = text_bbox[3] - text_bbox[1] + 2 * padding + 1
+        self._pad_tile = np.full((self._height, padding + 1, 3), background, dtype=np.uint8)
+        self._glyphs: Dict[str, np.ndarray] = {}
+
+    def _glyph(self, ch: str) -> np.ndarray:
+        tile = self._glyphs.get(ch)
+        if tile is None:
+            width = int(self._font.getlength(ch))
+            img = Image.new("RGB", (width, self._height), self.background)
+            ImageDraw.Draw(img).text((0, self.padding), ch, fill=self.color, font=self._font)
+            tile = self._glyphs[ch] = np.asarray(img)
+        return tile
+
+    @staticmethod
+    def _blit(frame: np.ndarray, tile: np.ndarray, x: int, y: int) -> int:
+        h = min(tile.shape[0], frame.shape[0] - y)
+        w = min(tile.shape[1], frame.shape[1] - x)
+        if h > 0 and w > 0:
+            frame[y:y+h, x:x+w] = tile[:h, :w]
+        return x + tile.shape[1]
+
+    def draw(self, frame: np.ndarray, text: str) -> np.ndarray:
+        """ draw text into frame (H, W, 3) in place """
+        y = self.y - self.padding
+        x = self._blit(frame, self._pad_tile[:, :self.padding], self.x - self.padding, y)
+        for ch in text:
+            x = self._blit(frame, self._glyph(ch), x, y)
+        self._blit(frame, self._pad_tile, x, y)
+        return frame
+
+
+_overlay: Optional[TextOverlay] = None
+
+
+def get_overlay() -> TextOverlay:
+    """ overlay with glyph cache, one per decoder process """
+    global _overlay
+    if _overlay is None:
+        _overlay = TextOverlay()
+    return _overlay
+
+
+def resize_for_ffmpeg(img: Image.Image) -> Image.Image:
+    """
+    部分机型截图的尺寸不对，所以需要resize，目前发现机型：iPhone x
+    """
+    w, h = img.size
+    if w % 2 != 0:
+        w -= 1
+    if h % 2 != 0:
+        h -= 1
+    img = img.crop((0, 0, w, h))
+    return img
+
+
+def decode_frame(png_data: bytes, text: Optional[str] = None) -> np.ndarray:
+    """ decode png into RGB array with even width and height, runs in decoder process """
+    pil_img = Image.open(io.BytesIO(png_data)).convert("RGB")
+    pil_img = resize_for_ffmpeg(pil_img)
+    if not text:
+        return np.asarray(pil_img)
+    return get_overlay().draw(np.array(pil_img), text)
+
+
+class VfrWriter:
+    """
+    Write RGB frames to a video with variable frame rate, every frame keeps its capture time.
+
+    imageio's ffmpeg writer always forces a constant input rate, so ffmpeg from imageio-ffmpeg is started here
+    with wall clock input timestamps. append_data waits until capture time + a constant delay before writing,
+    so that the time between frames in the video is the time between captures.
+    """
+    def __init__(self, path: str, codec: str = "libx264", slack: float = DEFAULT_VFR_SLACK,
+                 output_params: Optional[List[str]] = None):
+        self.path = path
+        self.codec = codec
+        self.slack = slack  # extra delay to absorb decoding jitter
+        self.output_params = output_params or []
+        self.late = 0  # frames written after their time, the gap before them is stretched
+        self._proc: Optional[subprocess.Popen] = None
+        self._offset = 0.0
+
+    def _open(self, frame: np.ndarray):
+        h, w = frame.shape[:2]
+        cmd = [imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{w}x{h}",
+               "-framerate", str(VFR_TIME_SCALE), "-use_wallclock_as_timestamps", "1", "-i", "-",
+               "-an", "-vcodec", self.codec, "-pix_fmt", "yuv420p",
+               "-fps_mode", "vfr", "-enc_time_base", f"1:{VFR_TIME_SCALE}"] + self.output_params + [self.path]
+        logger.debug("run: %s", " ".join(cmd))
+        # out of the terminal's process group, Ctrl-C stops recording and ffmpeg still finalizes the file
+        if sys.platform.startswith("win"):
+            kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            kwargs = {"start_new_session": True}
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, **kwargs)
+
+    def append_data(self, frame: np.ndarray, timestamp: float):
+        """
+        :param timestamp: capture time from time.monotonic()
+        """
+        if self._proc is None:
+            self._open(frame)
+            self._offset = max(0.0, time.monotonic() - timestamp) + self.slack
+        delay = timestamp + self._offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.late += 1
+        self._proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self._proc.stdin.flush()
+
+    def close(self):
+        if self._proc is None:
+            return
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exit code {self._proc.returncode}, output: {self.path}")
+
+
+def frame_fingerprint(png_data: bytes) -> bytes:
+    """ identical screens are encoded to identical png by the device """
+    return hashlib.blake2b(png_data, digest_size=16).digest()
+
+
+def hls_output_params(segment_seconds: float, keep: int = 0) -> List[str]:
+    """
+    ffmpeg options to write a HLS playlist, segments (.ts) are written next to it.
+    Finished segments stay playable when recording is killed.
+
+    :param keep: only the last keep segments are kept on disk, 0 to keep all
+    """
+    params = ["-f", "hls", "-hls_time", str(segment_seconds), "-hls_list_size", str(keep),
+              # a segment can only start on a key frame
+              "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})"]
+    if keep > 0:
+        params += ["-hls_flags", "temp_file+delete_segments"]
+    else:
+        params += ["-hls_flags", "temp_file", "-hls_playlist_type", "event"]
+    return params
+
+
+class SegmentWriter:
+    """
+    Fixed fps writer for HLS output, same usage as imageio.get_writer.
+    imageio does not accept .m3u8, so imageio-ffmpeg is used directly.
+    """
+    def __init__(self, path: str, fps: int, segment_seconds: float = DEFAULT_SEGMENT_SECONDS, keep: int = 0):
+        self.path = path
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.keep = keep
+        self._gen = None
+
+    def append_data(self, frame: np.ndarray):
+        if self._gen is None:
+            h, w = frame.shape[:2]
+            self._gen = imageio_ffmpeg.write_frames(
+                self.path, (w, h), fps=self.fps, macro_block_size=2, ffmpeg_log_level="error",
+                output_params=hls_output_params(self.segment_seconds, self.keep))
+            self._gen.send(None)
+        self._gen.send(np.ascontiguousarray(frame, dtype=np.uint8))
+
+    def close(self):
+        if self._gen is not None:
+            self._gen.close()
+
+
+def _ignore_sigint():
+    # Ctrl-C is handled by the main process, decoders finish the frames already submitted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class RecordStats(BaseModel):
+    captured: int = 0  # frames received from device
+    dropped: int = 0  # captured frames dropped because the pipeline is full
+    duplicated: int = 0  # frames written again to keep the frame rate
+    encoded: int = 0  # frames written to video, including duplicates
+    late: int = 0  # vfr only, frames written after their presentation time
+    decoded: int = 0
+    unchanged: int = 0  # frames same as the previous one, not decoded
+    elapsed: float = 0.0
+
+    @property
+    def saved_ratio(self) -> float:
+        """ part of the frames that skipped decoding because the screen did not change """
+        total = self.decoded + self.unchanged
+        return self.unchanged / total if total else 0.0
+
+    def summary(self) -> str:
+        capture_fps = self.captured / self.elapsed if self.elapsed > 0 else 0.0
+        return (f"{self.elapsed:.1f}s, captured {self.captured} ({capture_fps:.1f} fps), "
+                f"dropped {self.dropped}, duplicated {self.duplicated}, encoded {self.encoded}, late {self.late}, "
+                f"unchanged {self.unchanged} ({self.saved_ratio:.0%} decode saved)")
+
+
+class _Job:
+    """ one captured frame on its way to the encoder """
+    def __init__(self, future: Future, timestamp: float):
+        self.future = future
+        self.timestamp = timestamp
+        self.repeat = 1
+
+
+_STOP = object()
+
+
+class ScreenRecorder:
+    """
+    Record png frames to a video writer (e.g. imageio.get_writer) at fixed fps.
+    Frames are decoded by a process pool, each captured frame is decoded once even if it is repeated.
+    With a VfrWriter frames are never repeated, fps is the max frame rate.
+    When skip_unchanged, a frame same as the previous one is not decoded: it is a repeat in fixed fps mode,
+    and in vfr mode the previous frame is shown longer. The time overlay is not updated during that time.
+
+    Usage:
+        recorder = ScreenRecorder(iter_screenshot(service_provider), writer, fps=5)
+        stats = recorder.run()  # until frames end, stop() is called or KeyboardInterrupt
+    """
+    def __init__(self, frames: Iterator[bytes], writer, fps: int, show_time: bool = True,
+                 decoders: int = DEFAULT_DECODERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 skip_unchanged: bool = False, debug: bool = False):
+        self.frames = frames
+        self.writer = writer
+        self.fps = fps
+        self.show_time = show_time
+        self.decoders = decoders
+        self.skip_unchanged = skip_unchanged
+        self.debug = debug
+        self.vfr = isinstance(writer, VfrWriter)
+        self.stats = RecordStats()
+        self._capture_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # decoding + waiting for encoder, bounded so that memory of decoded frames is bounded too
+        encode_queue_size = max(2, decoders * 2)
+        if self.vfr:
+            # frames wait in the queue until their presentation time
+            encode_queue_size += int(fps * writer.slack) + 1
+        self._encode_queue: queue.Queue = queue.Queue(maxsize=encode_queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def _capture(self):
+        try:
+            for png_data in self.frames:
+                if self._stop.is_set():
+                    break
+                with self._lock:
+                    self.stats.captured += 1
+                    index = self.stats.captured
+                try:
+                    self._capture_queue.put_nowait((index, time.monotonic(), datetime.datetime.now(), png_data))
+                except queue.Full:
+                    with self._lock:
+                        self.stats.dropped += 1
+                    if self.debug:
+                        print("x", end="", flush=True)
+        except Exception as e:
+            logger.warning("capture stopped: %s", e)
+        finally:
+            self._capture_queue.put(_STOP)
+
+    def _captured_frames(self) -> Iterator[tuple]:
+        while True:
+            item = self._capture_queue.get()
+            if item is _STOP:
+                return
+            yield item
+
+    def _dispatch(self, executor: ProcessPoolExecutor):
+        last_item, last_fingerprint, job = None, None, None
+        held_timestamp = None  # vfr only, capture time of the last unchanged frame not written yet
+        try:
+            for item in limit_fps(self._captured_frames(), self.fps, debug=self.debug, vfr=self.vfr):
+                if item is last_item:
+                    job.repeat += 1
+                    continue
+                index, timestamp, now, png_data = item
+                if self.skip_unchanged:
+                    fingerprint = frame_fingerprint(png_data)
+                    if job is not None and fingerprint == last_fingerprint:
+                        last_item = item
+                        self.stats.unchanged += 1
+                        if self.vfr:
+                            held_timestamp = timestamp
+                        else:
+                            job.repeat += 1
+                        continue
+                    last_fingerprint = fingerprint
+                if job is not None and not self.vfr:
+                    self._encode_queue.put(job)
+                self.stats.decoded += 1
+                text = f"Time: {now:%Y-%m-%d %H:%M:%S} Frame: {index}" if self.show_time else None
+                last_item, job = item, _Job(executor.submit(decode_frame, png_data, text), timestamp)
+                held_timestamp = None
+                if self.vfr:
+                    # VfrWriter presents a frame at its capture time, it can not wait for the next change
+                    self._encode_queue.put(job)
+            if job is not None and not self.vfr:
+                self._encode_queue.put(job)
+            if held_timestamp is not None:
+                # write the held frame again at the last capture, so that a static end is not cut off
+                self._encode_queue.put(_Job(job.future, held_timestamp))
+        finally:
+            self._encode_queue.put(_STOP)
+
+    def run(self) -> RecordStats:
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.decoders, initializer=_ignore_sigint) as executor:
+            capture_thread = threading.Thread(target=self._capture, name="screenrecord-capture", daemon=True)
+            dispatch_thread = threading.Thread(target=self._dispatch, args=(executor,),
+                                               name="screenrecord-dispatch", daemon=True)
+            capture_thread.start()
+            dispatch_thread.start()
+            while True:
+                try:
+                    job = self._encode_queue.get()
+                    if job is _STOP:
+                        break
+                    frame = job.future.result()
+                    if self.vfr:
+                        self.writer.append_data(frame, job.timestamp)
+                        self.stats.encoded += 1
+                        continue
+                    for _ in range(job.repeat):
+                        self.writer.append_data(frame)
+                    self.stats.encoded += job.repeat
+                    self.stats.duplicated += job.repeat - 1
+                except KeyboardInterrupt:
+                    # finish frames already captured
+                    self.stop()
+        self.stats.elapsed = time.monotonic() - start
+        if self.vfr:
+            self.stats.late = self.writer.late
+        return self.stats
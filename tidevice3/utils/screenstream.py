@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 23:58:47 by codeskyblue
+
+Share one screenshot loop between many http viewers, as MJPEG stream or latest jpeg
+
+Every captured frame is encoded to jpeg once, in the capture thread, all viewers send the same bytes.
+A viewer always gets the newest frame, frames are skipped instead of queued when it is slower than capture.
+"""
+
+from __future__ import annotations
+
+__all__ = ["ScreenBroadcaster", "StreamStats", "MJPEGResponse", "create_app"]
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+import fastapi
+from fastapi import FastAPI
+from fastapi.responses import HTMLResponse, StreamingResponse
+from pydantic import BaseModel
+
+from tidevice3.api import ScreenshotSession, encode_screenshot
+from tidevice3.utils.recorder import frame_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FPS = 10
+DEFAULT_QUALITY = 80
+DEFAULT_IDLE_TIMEOUT = 10.0  # seconds, capture stops when nobody watches
+DEFAULT_SLOW_CLIENT_TIMEOUT = 10.0  # seconds, a viewer is dropped when one frame can not be sent in time
+MJPEG_BOUNDARY = "frame"
+
+
+class Frame:
+    def __init__(self, seq: int, jpeg: bytes, fingerprint: bytes):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.fingerprint = fingerprint
+        self.timestamp = time.monotonic()
+
+
+class StreamStats(BaseModel):
+    captured: int = 0
+    encoded: int = 0
+    reused: int = 0  # frames same as the previous one, jpeg not encoded again
+    clients: int = 0  # MJPEG viewers now
+    dropped_clients: int = 0  # viewers disconnected for being too slow
+
+
+class ScreenBroadcaster:
+    """
+    Capture screenshots in one thread while anyone is watching, and share the encoded frames.
+
+    Usage:
+        with ScreenshotSession(service_provider) as session:
+            broadcaster = ScreenBroadcaster(session, fps=10)
+            broadcaster.start()
+            ...
+            broadcaster.close()
+    """
+    def __init__(self, session: ScreenshotSession, fps: float = DEFAULT_FPS, quality: int = DEFAULT_QUALITY,
+                 size: Optional[Tuple[int, int]] = None, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 slow_client_timeout: float = DEFAULT_SLOW_CLIENT_TIMEOUT):
+        self.session = session
+        self.fps = fps
+        self.quality = quality
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.slow_client_timeout = slow_client_timeout
+        self.stats = StreamStats()
+        self.latest: Optional[Frame] = None
+        self._demand_time = -idle_timeout
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="screenstream-capture", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.session.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def _active(self) -> bool:
+        return self.stats.clients > 0 or time.monotonic() - self._demand_time < self.idle_timeout
+
+    def _touch(self):
+        self._demand_time = time.monotonic()
+        self._wakeup.set()
+
+    @contextmanager
+    def watch(self):
+        """ keep capturing while in this context """
+        with self._lock:
+            self.stats.clients += 1
+        self._touch()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stats.clients -= 1
+            self._touch()
+
+    def _publish(self, png_data: bytes):
+        fingerprint = frame_fingerprint(png_data)
+        last = self.latest
+        if last is not None and last.fingerprint == fingerprint:
+            jpeg = last.jpeg
+            self.stats.reused += 1
+        else:
+            jpeg = encode_screenshot(png_data, "jpeg", self.size, self.quality)
+            self.stats.encoded += 1
+        self.latest = Frame(last.seq + 1 if last else 1, jpeg, fingerprint)
+
+    def _run(self):
+        connected = False
+        while not self.closed:
+            if not self._active():
+                if connected:
+                    logger.info("nobody is watching, capture paused")
+                    self.session.close()
+                    connected = False
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            start = time.monotonic()
+            try:
+                png_data = self.session.screenshot_png()
+            except Exception as e:
+                logger.warning("screenshot failed: %s", e)
+                self._closed.wait(1.0)
+                continue
+            connected = True
+            self.stats.captured += 1
+            self._publish(png_data)
+            delay = start + 1.0 / self.fps - time.monotonic()
+            if delay > 0:
+                self._closed.wait(delay)
+
+    async def next_frame(self, after_seq: int = 0, timeout: float = 10.0, poll: float = 0.02) -> Optional[Frame]:
+        """ wait for a frame newer than after_seq, None if timeout """
+        deadline = time.monotonic() + timeout
+        while not self.closed:
+            frame = self.latest
+            if frame is not None and frame.seq > after_seq:
+                return frame
+            if time.monotonic() > deadline:
+                return None
+            await asyncio.sleep(poll)
+        return None
+
+    async def latest_jpeg(self, max_age: float = 1.0, timeout: float = 10.0) -> Optional[bytes]:
+        """ latest frame captured within max_age seconds, capture is started if paused """
+        self._touch()
+        frame = self.latest
+        if frame is not None and time.monotonic() - frame.timestamp <= max_age:
+            return frame.jpeg
+        frame = await self.next_frame(frame.seq if frame else 0, timeout)
+        return frame.jpeg if frame else None
+
+    async def mjpeg(self, fps: Optional[float] = None) -> AsyncIterator[bytes]:
+        """ multipart MJPEG body, limited to fps (at most the capture fps) """
+        interval = 1.0 / min(fps or self.fps, self.fps)
+        seq = 0
+        with self.watch():
+            while not self.closed:
+                next_time = time.monotonic() + interval
+                frame = await self.next_frame(seq)
+                if frame is None:
+                    continue
+                seq = frame.seq
+                yield (f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(frame.jpeg)}\r\n\r\n").encode() + frame.jpeg + b"\r\n"
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    def drop_slow_client(self):
+        logger.warning("drop slow viewer, a frame was not sent in %.1fs", self.slow_client_timeout)
+        with self._lock:
+            self.stats.dropped_clients += 1
+
+
+class MJPEGResponse(StreamingResponse):
+    """
+    Streaming response which gives up when one chunk can not be sent within send_timeout.
+    The server waits in send until the socket is writable, so a viewer which stopped reading
+    would otherwise keep the stream, and the capture, running forever.
+    """
+    def __init__(self, content: AsyncIterator[bytes], send_timeout: float, on_timeout: Callable[[], None], **kwargs):
+        super().__init__(content, media_type=f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}", **kwargs)
+        self.send_timeout = send_timeout
+        self.on_timeout = on_timeout
+
+    async def stream_response(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        try:
+            async for chunk in self.body_iterator:
+                message = {"type": "http.response.body", "body": chunk, "more_body": True}
+                try:
+                    await asyncio.wait_for(send(message), self.send_timeout)
+                except asyncio.TimeoutError:
+                    # returning with an unfinished response makes the server close the connection
+                    self.on_timeout()
+                    return
+        finally:
+            await self.body_iterator.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+INDEX_HTML = """<!DOCTYPE html>
+<html><head><title>t3 screenstream</title></head>
+<body style="margin:0;background:#222;text-align:center">
+<img src="stream.mjpeg" style="max-height:100vh;max-width:100%">
+</body></html>
+"""
+
+
+def create_app(broadcaster: ScreenBroadcaster) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/", response_class=HTMLResponse)
+    def index():
+        return INDEX_HTML
+
+    @app.get("/stream.mjpeg")
+    def stream(fps: Optional[float] = fastapi.Query(None, gt=0)):
+        return MJPEGResponse(broadcaster.mjpeg(fps), broadcaster.slow_client_timeout, broadcaster.drop_slow_client,
+                             headers={"Cache-Control": "no-store"})
+
+    @app.get("/screenshot.jpg")
+    async def latest():
+        jpeg = await broadcaster.latest_jpeg()
+        if jpeg is None:
+            return fastapi.Response(status_code=503, content="no screenshot available")
+        return fastapi.Response(content=jpeg, media_type="image/jpeg", headers={"Cache-Control": "no-store"})
+
+    @app.get("/stats")
+    def stats() -> StreamStats:
+        return broadcaster.stats
+
+    return app
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Created on Sat Oct 17 2026 21:06:18 by codeskyblue
+
+Incremental sync between a local directory and a remote directory over AFC
+
+Only files changed in size or mtime (or sha256 with checksum) are transferred.
+The remote stat of every synced file is kept in a manifest per device and remote directory:
+    <cache>/manifests/<udid>/<key>.json
+Next push lists the remote directories and reuses the manifest for entries still there,
+so an unchanged tree is verified without one stat per file.
+"""
+
+from __future__ import annotations
+
+__all__ = ["Manifest", "SyncResult", "sync_push", "sync_pull"]
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import posixpath
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from pymobiledevice3.exceptions import AfcException, AfcFileNotFoundError
+
+from tidevice3.utils.afc import DEFAULT_CHUNK_SIZE, DEFAULT_SESSIONS, AfcFile, AfcPool, FileInfo, TransferStats, \
+    log_error, pull_file, push_file, stat_file, walk_tree
+from tidevice3.utils.cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = DEFAULT_CACHE_DIR / "manifests"
+MTIME_TOLERANCE = 1.0  # seconds, local filesystems may round mtime
+
+
+class ManifestEntry(BaseModel):
+    info: FileInfo  # remote stat
+    local_size: Optional[int] = None
+    local_mtime_ns: Optional[int] = None
+    sha256: Optional[str] = None
+
+
+class Manifest:
+    """ remote stat of synced files, keyed by path relative to the remote directory """
+    def __init__(self, path: Optional[pathlib.Path] = None):
+        """ :param path: json file, None to keep in memory only """
+        self.path = path
+        self.entries: Dict[str, ManifestEntry] = {}
+
+    @classmethod
+    def for_device(cls, udid: str, remote_dir: str, namespace: str = "") -> Manifest:
+        """ :param namespace: e.g. bundle id of house arrest, which has another root """
+        key = hashlib.sha1(f"{namespace}:{remote_dir.rstrip('/')}".encode()).hexdigest()
+        manifest = cls(MANIFEST_DIR / udid / f"{key}.json")
+        manifest.load()
+        return manifest
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+            self.entries = {rel: ManifestEntry.model_validate(entry) for rel, entry in data["files"].items()}
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug("manifest %s not loaded: %s", self.path, e)
+            self.entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({
+            "files": {rel: entry.model_dump(mode="json") for rel, entry in self.entries.items()},
+        }))
+        os.replace(tmp_path, self.path)
+
+    def remote_infos(self, remote_dir: str) -> Dict[str, FileInfo]:
+        """ remote path -> FileInfo, used as the cached argument of walk_tree """
+        return {posixpath.join(remote_dir, rel): entry.info for rel, entry in self.entries.items()}
+
+
+class SyncResult(TransferStats):
+    skipped: int = 0
+    deleted: List[str] = []
+
+
+def sha256_file(path: pathlib.Path) -> str:
+    m = hashlib.sha256()
+    with path.open("rb") as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            m.update(data)
+    return m.hexdigest()
+
+
+def sha256_remote(pool: AfcPool, remote_path: str, chunk_size: int) -> str:
+    m = hashlib.sha256()
+    with pool.session() as afc, AfcFile(afc, remote_path, "r") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            m.update(data)
+    return m.hexdigest()
+
+
+def list_local(local_dir: pathlib.Path) -> Tuple[Dict[str, os.stat_result], Set[str]]:
+    """ return (relpath -> stat of files, relpath of directories) """
+    files, dirs = {}, set()
+    for dirpath, dirnames, filenames in os.walk(local_dir):
+        rel_dir = pathlib.Path(dirpath).relative_to(local_dir).as_posix()
+        for name in dirnames:
+            dirs.add(posixpath.normpath(posixpath.join(rel_dir, name)))
+        for name in filenames:
+            rel = posixpath.normpath(posixpath.join(rel_dir, name))
+            files[rel] = os.stat(os.path.join(dirpath, name))
+    return files, dirs
+
+
+def list_remote(
+    pool: AfcPool, remote_dir: str, workers: int, on_error: Callable[[str, Exception], None],
+    cached: Optional[Dict[str, FileInfo]] = None
+) -> Dict[str, FileInfo]:
+    """ relpath -> FileInfo, a missing remote_dir is an empty tree """
+    def on_walk_error(path: str, e: Exception):
+        if path == remote_dir and isinstance(e, AfcFileNotFoundError):
+            return
+        on_error(path, e)
+
+    remote = {}
+    for path, info in walk_tree(pool, remote_dir, workers, on_walk_error, cached):
+        remote[posixpath.relpath(path, remote_dir)] = info
+    return remote
+
+
+def depth_first(paths) -> List[str]:
+    """ children before parents, so that directories are empty when removed """
+    return sorted(paths, key=lambda p: p.count("/"), reverse=True)
+
+
+class _Syncer:
+    """ state shared by the transfer threads of one sync """
+    def __init__(self, pool: AfcPool, local_dir: pathlib.Path, remote_dir: str, manifest: Manifest,
+                 checksum: bool, dry_run: bool, chunk_size: int,
+                 on_change: Optional[Callable[[str, str], None]]):
+        self.pool = pool
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir
+        self.manifest = manifest
+        self.checksum = checksum
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.on_change = on_change
+        self.result = SyncResult()
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.lock = threading.Lock()
+
+    def local_path(self, rel: str) -> pathlib.Path:
+        return self.local_dir.joinpath(*rel.split("/"))
+
+    def remote_path(self, rel: str) -> str:
+        return posixpath.join(self.remote_dir, rel)
+
+    def on_error(self, path: str, e: Exception):
+        log_error(path, e)
+        with self.lock:
+            self.result.errors.append((path, str(e)))
+
+    def changed(self, action: str, rel: str):
+        if self.on_change:
+            self.on_change(action, rel)
+
+    def remote_sha256(self, rel: str, info: FileInfo) -> str:
+        entry = self.manifest.entries.get(rel)
+        if entry and entry.sha256 and entry.info == info:
+            return entry.sha256
+        return sha256_remote(self.pool, self.remote_path(rel), self.chunk_size)
+
+    def same_content(self, rel: str, st: os.stat_result, info: FileInfo, local_sha256: Optional[str]) -> bool:
+        return st.st_size == info.size and local_sha256 == self.remote_sha256(rel, info)
+
+    def record(self, rel: str, info: FileInfo, st: os.stat_result, sha256: Optional[str],
+               transferred: bool = False):
+        entry = ManifestEntry(info=info, local_size=st.st_size, local_mtime_ns=st.st_mtime_ns, sha256=sha256)
+        with self.lock:
+            self.entries[rel] = entry
+            if transferred:
+                self.result.files += 1
+                self.result.bytes += st.st_size
+            else:
+                self.result.skipped += 1
+
+    def push(self, rel: str, st: os.stat_result, info: Optional[FileInfo]):
+        try:
+            local_path = self.local_path(rel)
+            sha256 = sha256_file(local_path) if self.checksum else None
+            if info is not None and not info.is_dir():
+                if self.checksum:
+                    unchanged = self.same_content(rel, st, info, sha256)
+                else:
+                    entry = self.manifest.entries.get(rel)
+                    # remote untouched since last sync, and local file not modified
+                    unchanged = (entry is not None and entry.info == info and entry.local_size == st.st_size
+                                 and entry.local_mtime_ns == st.st_mtime_ns) \
+                        or (st.st_size == info.size and st.st_mtime <= info.mtime.timestamp())
+                if unchanged:
+                    self.record(rel, info, st, sha256)
+                    return
+            self.changed("push", rel)
+            if self.dry_run:
+                return
+            remote_path = self.remote_path(rel)
+            with self.pool.session() as afc:
+                if info is not None and info.is_dir():
+                    afc.rm(remote_path)
+                with local_path.open("rb") as f:
+                    push_file(afc, f, remote_path, self.chunk_size)
+                new_info = stat_file(afc, remote_path)
+            self.record(rel, new_info, st, sha256, transferred=True)
+        except (AfcException, OSError) as e:
+            self.on_error(self.remote_path(rel), e)
+
+    def pull(self, rel: str, info: FileInfo, st: Optional[os.stat_result]):
+        try:
+            local_path = self.local_path(rel)
+            sha256 = None
+            if st is not None:
+                if self.checksum:
+                    sha256 = sha256_file(local_path)
+                    unchanged = self.same_content(rel, st, info, sha256)
+                else:
+                    unchanged = st.st_size == info.size \
+                        and abs(st.st_mtime - info.mtime.timestamp()) < MTIME_TOLERANCE
+                if unchanged:
+                    self.record(rel, info, st, sha256)
+                    return
+            self.changed("pull", rel)
+            if self.dry_run:
+                return
+            with self.pool.session() as afc:
+                pull_file(afc, self.remote_path(rel), local_path, self.chunk_size, info.mtime)
+            if self.checksum:
+                sha256 = sha256_file(local_path)
+            self.record(rel, info, local_path.stat(), sha256, transferred=True)
+        except (AfcException, OSError) as e:
+            self.on_error(self.remote_path(rel), e)
+
+    def remove_remote(self, rel: str):
+        self.changed("delete", rel)
+        if self.dry_run:
+            return
+        try:
+            with self.pool.session() as afc:
+                afc.rm(self.remote_path(rel))
+            self.result.deleted.append(rel)
+        except AfcException as e:
+            self.on_error(self.remote_path(rel), e)
+
+    def remove_local(self, rel: str):
+        self.changed("delete", rel)
+        if self.dry_run:
+            return
+        path = self.local_path(rel)
+        try:
+            if path.is_dir() and not path.is_symlink():
+                path.rmdir()
+            else:
+                path.unlink()
+            self.result.deleted.append(rel)
+        except OSError as e:
+            self.on_error(str(path), e)
+
+    def finish(self, start: float, remote: Dict[str, FileInfo]) -> SyncResult:
+        """ save manifest, remote entries not synced (directories, extraneous files) have no local state """
+        if not self.dry_run:
+            deleted = set(self.result.deleted)
+            entries = {rel: ManifestEntry(info=info) for rel, info in remote.items() if rel not in deleted}
+            entries.update(self.entries)
+            self.manifest.entries = entries
+            self.manifest.save()
+        self.result.elapsed = time.time() - start
+        return self.result
+
+
+def sync_push(
+    pool: AfcPool, local_dir: pathlib.Path, remote_dir: str, manifest: Optional[Manifest] = None,
+    checksum: bool = False, delete: bool = False, dry_run: bool = False,
+    workers: int = DEFAULT_SESSIONS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_change: Optional[Callable[[str, str], None]] = None
+) -> SyncResult:
+    """
+    Make remote_dir the same as local_dir, only changed files are pushed
+
+    :param manifest: remote stat from last sync, entries still listed remotely are not stat again
+    :param checksum: compare sha256 instead of mtime, remote files are read unless hash is in manifest
+    :param delete: remove remote files which do not exist in local_dir
+    :param on_change: called with (action, relpath), action is push or delete
+    """
+    start = time.time()
+    manifest = manifest or Manifest()
+    syncer = _Syncer(pool, local_dir, remote_dir, manifest, checksum, dry_run, chunk_size, on_change)
+    local_files, local_dirs = list_local(local_dir)
+    if not dry_run:
+        with pool.session() as afc:
+            afc.makedirs(remote_dir)
+    remote = list_remote(pool, remote_dir, workers, syncer.on_error, manifest.remote_infos(remote_dir))
+
+    if not dry_run:
+        with pool.session() as afc:
+            for rel in sorted(local_dirs, key=lambda p: p.count("/")):
+                info = remote.get(rel)
+                if info is None or not info.is_dir():
+                    if info is not None:
+                        afc.rm(syncer.remote_path(rel))
+                    afc.makedirs(syncer.remote_path(rel))
+                    remote[rel] = stat_file(afc, syncer.remote_path(rel))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(syncer.push, rel, st, remote.get(rel)) for rel, st in local_files.items()]
+        # unexpected errors are raised here, the manifest is not saved then
+        for future in futures:
+            future.result()
+    if delete:
+        extraneous = [rel for rel in remote if rel not in local_files and rel not in local_dirs]
+        # nothing is left inside an extraneous directory, it can be removed after its children
+        for rel in depth_first(extraneous):
+            syncer.remove_remote(rel)
+    return syncer.finish(start, remote)
+
+
+def sync_pull(
+    pool: AfcPool, remote_dir: str, local_dir: pathlib.Path, manifest: Optional[Manifest] = None,
+    checksum: bool = False, delete: bool = False, dry_run: bool = False,
+    workers: int = DEFAULT_SESSIONS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+    on_change: Optional[Callable[[str, str], None]] = None
+) -> SyncResult:
+    """
+    Make local_dir the same as remote_dir, only changed files are pulled.
+    Remote is always stat, the manifest only saves reading remote files for checksum.
+
+    :param on_change: called with (action, relpath), action is pull or delete
+    """
+    start = time.time()
+    manifest = manifest or Manifest()
+    syncer = _Syncer(pool, local_dir, remote_dir, manifest, checksum, dry_run, chunk_size, on_change)
+    remote = list_remote(pool, remote_dir, workers, syncer.on_error)
+    local_files, local_dirs = list_local(local_dir) if local_dir.is_dir() else ({}, set())
+
+    if not dry_run:
+        local_dir.mkdir(parents=True, exist_ok=True)
+        for rel, info in remote.items():
+            if info.is_dir():
+                if rel in local_files:
+                    syncer.local_path(rel).unlink()
+                    del local_files[rel]
+                syncer.local_path(rel).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(syncer.pull, rel, info, local_files.get(rel))
+                   for rel, info in remote.items() if info.ifmt == "S_IFREG"]
+        for future in futures:
+            future.result()
+    if delete:
+        keep = {rel for rel, info in remote.items() if info.is_dir() or info.ifmt == "S_IFREG"}
+        extraneous = [rel for rel in [*local_files, *local_dirs] if rel not in keep]
+        for rel in depth_first(extraneous):
+            syncer.remove_local(rel)
+    return syncer.finish(start, remote)